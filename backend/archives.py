@@ -0,0 +1,151 @@
+"""
+Helpers for reading images out of uploaded zip/tar archives.
+"""
+import os
+import tarfile
+import zipfile
+import zlib
+from typing import BinaryIO, List, Optional, Tuple
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+ARCHIVE_CONTENT_TYPES = (
+    'application/zip',
+    'application/x-zip-compressed',
+    'application/x-tar',
+    'application/gzip',
+    'application/x-gzip',
+    'application/x-bzip2',
+    'application/x-xz',
+)
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff', '.gif')
+
+# Errors reading one member (encrypted, unsupported compression, bad CRC, truncated
+# stream); they fail that member only, not the whole archive
+MEMBER_ERRORS = (zipfile.BadZipFile, RuntimeError, NotImplementedError, EOFError, zlib.error, OSError,
+                 tarfile.TarError)
+
+
+class ArchiveLimitExceeded(ValueError):
+    """Raised when an archive holds more images, or more uncompressed bytes, than allowed."""
+
+
+def is_archive(filename: Optional[str], content_type: Optional[str] = None) -> bool:
+    """Return True if the upload looks like a zip or tar archive."""
+    name = (filename or '').lower()
+    return name.endswith(ARCHIVE_SUFFIXES) or (content_type or '').lower() in ARCHIVE_CONTENT_TYPES
+
+
+def is_image_name(name: str) -> bool:
+    base = os.path.basename(name)
+    return not base.startswith('.') and base.lower().endswith(IMAGE_SUFFIXES)
+
+
+def extract_images(fileobj: BinaryIO, max_members: int,
+                   max_total_bytes: int) -> List[Tuple[str, bytes, Optional[str]]]:
+    """
+    Read all image members of a zip or tar archive into memory.
+
+    Non-image members (by extension) and hidden files are skipped. The member count and
+    the total uncompressed size are bounded so a malicious archive cannot exhaust memory.
+    A member that cannot be read (encrypted, corrupt, truncated) is returned with an
+    error message instead of its contents (it still counts towards ``max_members``);
+    the rest of the archive is still read.
+
+    Args:
+        fileobj: Seekable binary file object with the archive contents.
+        max_members: Maximum number of images to extract.
+        max_total_bytes: Maximum total uncompressed size of the extracted images.
+
+    Returns:
+        List of (member name, bytes, error) tuples in archive order; error is None,
+        or a message (with empty bytes) for a member that could not be read.
+
+    Raises:
+        ArchiveLimitExceeded: If the archive exceeds the limits.
+        ValueError: If the archive's directory (zip) or first header (tar) is
+            unreadable.
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        return _extract_zip(fileobj, max_members, max_total_bytes)
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode='r:*')
+    except (tarfile.TarError, EOFError, zlib.error, OSError) as e:
+        raise ValueError(f"Unsupported or corrupt archive: {e}")
+    with archive:
+        return _extract_tar(archive, max_members, max_total_bytes)
+
+
+class _Budget:
+    def __init__(self, max_members: int, max_total_bytes: int):
+        self.members_left = max_members
+        self.bytes_left = max_total_bytes
+
+    def take_member(self):
+        """Count one more returned member, readable or not."""
+        if self.members_left <= 0:
+            raise ArchiveLimitExceeded("Archive contains more than the allowed number of images")
+        self.members_left -= 1
+
+    def read(self, name: str, stream: BinaryIO) -> bytes:
+        # Read at most one byte past the budget; declared sizes in headers can lie
+        data = stream.read(self.bytes_left + 1)
+        if len(data) > self.bytes_left:
+            raise ArchiveLimitExceeded(f"Archive exceeds the maximum uncompressed size (at {name})")
+        self.bytes_left -= len(data)
+        return data
+
+
+def _member_error(e: Exception) -> str:
+    return f"Error reading archive member: {e or type(e).__name__}"
+
+
+def _extract_zip(fileobj: BinaryIO, max_members: int, max_total_bytes: int) -> List[Tuple[str, bytes, Optional[str]]]:
+    budget = _Budget(max_members, max_total_bytes)
+    images = []
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, OSError) as e:
+        raise ValueError(f"Unsupported or corrupt archive: {e}")
+    with archive:
+        for info in archive.infolist():
+            if info.is_dir() or not is_image_name(info.filename):
+                continue
+            budget.take_member()
+            try:
+                with archive.open(info) as member:
+                    images.append((info.filename, budget.read(info.filename, member), None))
+            except MEMBER_ERRORS as e:
+                images.append((info.filename, b"", _member_error(e)))
+    return images
+
+
+def _extract_tar(archive: tarfile.TarFile, max_members: int, max_total_bytes: int) -> List[Tuple[str, bytes, Optional[str]]]:
+    budget = _Budget(max_members, max_total_bytes)
+    images = []
+    members = iter(archive)
+    while True:
+        try:
+            member = next(members)
+        except StopIteration:
+            break
+        except MEMBER_ERRORS as e:
+            # Headers follow the data of each member: nothing after a corrupt or
+            # truncated stretch can be found
+            if not images:
+                raise ValueError(f"Unsupported or corrupt archive: {e}")
+            budget.take_member()
+            images.append(("(rest of archive)", b"", _member_error(e)))
+            break
+        if not member.isfile() or not is_image_name(member.name):
+            continue
+        budget.take_member()
+        try:
+            stream = archive.extractfile(member)
+            if stream is not None:
+                images.append((member.name, budget.read(member.name, stream), None))
+        except MEMBER_ERRORS as e:
+            images.append((member.name, b"", _member_error(e)))
+    return images
@@ -0,0 +1,162 @@
+"""
+Dynamic micro-batching for model inference.
+
+Concurrent requests submit their preprocessed tensors to a shared queue. A single
+background task drains the queue into batches (bounded by a maximum batch size and a
+maximum wait time), runs one forward pass per batch and hands every caller back the
+results for its own rows.
+"""
+import asyncio
+import itertools
+import time
+from typing import Callable, List, Optional
+
+import torch
+
+import metrics
+
+
+class MicroBatcher:
+    """
+    Collect tensors from concurrent callers and run them through the model in batches.
+
+    Low-priority submissions (background work such as queued jobs) only go into a
+    batch when no normal-priority tensor is waiting.
+
+    Args:
+        run_batch: Callable taking a (N, 3, 224, 224) tensor and returning a list of N
+            per-row results (e.g. ``predict_batch``). It is executed in ``executor`` so
+            the event loop is never blocked by a forward pass.
+        max_batch_size: Maximum number of rows in a single forward pass.
+        max_wait_ms: How long the first request of a batch may wait for others to join.
+        executor: Executor used to run ``run_batch`` (None = loop's default executor).
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[torch.Tensor], list],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        executor=None,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.executor = executor
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._order = itertools.count()  # FIFO order within a priority
+        self._task: Optional[asyncio.Task] = None
+        self._pending = None  # Item that did not fit into the previous batch
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """Start the background batching task on the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching task and fail any requests still waiting in the queue."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        leftovers = [self._pending] if self._pending is not None else []
+        self._pending = None
+        while self._queue is not None and not self._queue.empty():
+            leftovers.append(self._queue.get_nowait()[2])
+        for _, future, _ in leftovers:
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped"))
+
+    async def submit(self, image_tensor: torch.Tensor, low_priority: bool = False) -> List[dict]:
+        """
+        Queue a tensor for inference and wait for its results.
+
+        Args:
+            image_tensor: Tensor of shape (N, 3, 224, 224) or (3, 224, 224).
+            low_priority: Only batch it when no normal-priority tensor is waiting.
+
+        Returns:
+            List with one result per row of ``image_tensor``.
+        """
+        if not self.running:
+            raise RuntimeError("Batcher is not running")
+        if image_tensor.dim() == 3:
+            image_tensor = image_tensor.unsqueeze(0)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((int(low_priority), next(self._order), (image_tensor, future, time.perf_counter())))
+        return await future
+
+    async def _next_item(self, timeout: Optional[float] = None):
+        if self._pending is not None:
+            item, self._pending = self._pending, None
+            return item
+        if timeout is None:
+            return (await self._queue.get())[2]
+        return (await asyncio.wait_for(self._queue.get(), timeout))[2]
+
+    async def _collect(self) -> list:
+        """Wait for the first request, then gather more until the batch is full or the wait expires."""
+        items = [await self._next_item()]
+        rows = items[0][0].shape[0]
+        deadline = time.monotonic() + self.max_wait
+
+        while rows < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    item = self._queue.get_nowait()[2]
+                else:
+                    item = await self._next_item(remaining)
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+            if rows + item[0].shape[0] > self.max_batch_size:
+                # Keep it for the next batch rather than exceeding the limit
+                self._pending = item
+                break
+            items.append(item)
+            rows += item[0].shape[0]
+
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            # Requests whose callers went away (client disconnect) need no compute
+            items = [item for item in items if not item[1].done()]
+            if not items:
+                continue
+
+            started = time.perf_counter()
+            queue_wait = metrics.STAGE_SECONDS.labels("queue_wait")
+            for _, _, enqueued in items:
+                queue_wait.observe(started - enqueued)
+            batch = items[0][0] if len(items) == 1 else torch.cat([t for t, _, _ in items], dim=0)
+            try:
+                results = await loop.run_in_executor(self.executor, self.run_batch, batch)
+            except asyncio.CancelledError:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Batcher stopped"))
+                raise
+            except Exception as e:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for tensor, future, _ in items:
+                n = tensor.shape[0]
+                if not future.done():
+                    future.set_result(results[offset:offset + n])
+                offset += n
@@ -0,0 +1 @@
+"""Benchmarks and verification tools for the VeriFrame backend (run from ``backend/``)."""
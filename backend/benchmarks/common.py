@@ -0,0 +1,133 @@
+"""
+Shared helpers for benchmarks: synthetic images and models that work without model.pth,
+latency summaries and JSON reports that can be compared between versions.
+"""
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_image(kind: str, size: tuple, seed: int = 0) -> Image.Image:
+    """
+    Build a deterministic RGB test image of the given kind and (width, height).
+
+    Kinds: ``noise`` (uniform noise), ``gradient`` (smooth), ``spliced`` (a smooth,
+    previously JPEG-compressed background with a pristine noisy patch pasted in, which
+    is what ELA is designed to reveal).
+    """
+    rng = np.random.default_rng(seed)
+    w, h = size
+    if kind == "noise":
+        array = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+    elif kind == "gradient":
+        x = np.linspace(0, 255, w, dtype=np.float32)
+        y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+        array = np.stack([np.broadcast_to(x, (h, w)), np.broadcast_to(y, (h, w)), (x + y) / 2], axis=-1)
+        array = array.astype(np.uint8)
+    elif kind == "spliced":
+        base = synthetic_image("gradient", size, seed)
+        buffer = io.BytesIO()
+        base.save(buffer, format="JPEG", quality=60)
+        array = np.array(Image.open(buffer).convert("RGB"))
+        ph, pw = max(1, h // 4), max(1, w // 4)
+        array[h // 3:h // 3 + ph, w // 3:w // 3 + pw] = rng.integers(0, 256, (ph, pw, 3), dtype=np.uint8)
+    else:
+        raise ValueError(f"Unknown image kind: {kind}")
+    return Image.fromarray(array, mode="RGB")
+
+
+def encode(image: Image.Image, fmt: str = "JPEG", quality: int = 92) -> bytes:
+    """Encode an image the way an upload would arrive."""
+    buffer = io.BytesIO()
+    options = {"quality": quality} if fmt in ("JPEG", "WEBP") else {}
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def build_model(model_path: Optional[str] = None, arch: str = "generic", seed: int = 0):
+    """
+    Return an eval-mode model on ``main.device``.
+
+    Loads ``model_path`` with ``main.load_model`` when given; otherwise builds a
+    randomly initialized ``DeepfakeCNN`` (``arch="generic"``) or ``resnet18``
+    (``arch="resnet18"``) so benchmarks run without a trained checkpoint.
+    """
+    import torch
+    import main
+
+    if model_path:
+        return main.load_model(model_path)
+
+    torch.manual_seed(seed)
+    if arch == "generic":
+        model = main.create_generic_cnn()
+    elif arch == "resnet18":
+        model = main.create_resnet18()
+    else:
+        raise ValueError(f"Unknown architecture: {arch}")
+    model.eval().to(main.device)
+    main.model = model
+    return model
+
+
+def image_for_megapixels(megapixels: float, kind: str = "spliced", seed: int = 0) -> Image.Image:
+    """Synthetic 4:3 image with roughly the given number of megapixels."""
+    width = max(1, int(round((megapixels * 1e6 * 4 / 3) ** 0.5)))
+    height = max(1, int(round(width * 3 / 4)))
+    return synthetic_image(kind, (width, height), seed)
+
+
+def latency_summary(seconds: list) -> dict:
+    """Latency statistics in milliseconds for a list of durations in seconds."""
+    ms = sorted(s * 1000 for s in seconds)
+    if not ms:
+        return {"count": 0}
+
+    def percentile(p):
+        return ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))]
+
+    return {
+        "count": len(ms),
+        "mean_ms": round(statistics.mean(ms), 3),
+        "p50_ms": round(percentile(50), 3),
+        "p90_ms": round(percentile(90), 3),
+        "p99_ms": round(percentile(99), 3),
+        "max_ms": round(ms[-1], 3),
+    }
+
+
+def environment() -> dict:
+    """Where a report was produced, so results are only compared like for like."""
+    import torch
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+    }
+
+
+def write_report(report: dict, path: Optional[str]):
+    if path:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {path}")
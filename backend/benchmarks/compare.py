@@ -0,0 +1,96 @@
+"""
+Compare two benchmark reports (``--output`` JSON of micro, load, startup, ...) and flag
+regressions.
+
+Every numeric metric present in both reports is compared. Fields ending in ``_ms`` or
+``_s`` are latencies (lower is better); fields ending in ``_per_sec`` are throughputs
+(higher is better); other fields are ignored. List entries are matched by their
+``case`` field. The script exits with status 1 if any metric got worse by more than
+``--threshold``, so it can gate a release.
+
+Usage (from the backend directory):
+    python -m benchmarks.compare baseline.json current.json [--threshold 0.2] [--metrics p50_ms,requests_per_sec]
+"""
+import argparse
+import json
+import sys
+
+
+def flatten(node, prefix: str = "") -> dict:
+    """Map dotted paths to numeric leaves, keying list entries by their ``case``."""
+    values = {}
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "environment":
+                continue
+            values.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(node, list):
+        for i, value in enumerate(node):
+            key = value.get("case", str(i)) if isinstance(value, dict) else str(i)
+            values.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        values[prefix.rstrip(".")] = float(node)
+    return values
+
+
+def direction(path: str) -> int:
+    """+1 if higher is worse (latency), -1 if lower is worse (throughput), 0 to ignore."""
+    name = path.rsplit(".", 1)[-1]
+    if name.endswith("_per_sec"):
+        return -1
+    if name.endswith("_ms") or name.endswith("_s"):
+        return 1
+    return 0
+
+
+def compare(baseline: dict, current: dict, threshold: float, metrics=None) -> list:
+    """
+    Returns a list of (path, baseline, current, relative change, regressed) tuples; the
+    relative change is signed so that positive means worse.
+    """
+    old, new = flatten(baseline), flatten(current)
+    rows = []
+    for path in sorted(old.keys() & new.keys()):
+        sign = direction(path)
+        if sign == 0 or (metrics and path.rsplit(".", 1)[-1] not in metrics):
+            continue
+        before, after = old[path], new[path]
+        if before == 0:
+            continue
+        change = sign * (after - before) / before
+        rows.append((path, before, after, change, change > threshold))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline", help="Report from the reference version")
+    parser.add_argument("current", help="Report from the version under test")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative change counted as a regression (default 0.2 = 20%%)")
+    parser.add_argument("--metrics", help="Only compare these comma-separated metric names (e.g. p50_ms,p99_ms)")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get("benchmark") != current.get("benchmark"):
+        print(f"Reports come from different benchmarks: {baseline.get('benchmark')} vs {current.get('benchmark')}")
+        return 2
+    for key in ("cpu_count", "torch", "platform"):
+        if baseline.get("environment", {}).get(key) != current.get("environment", {}).get(key):
+            print(f"WARNING: environments differ in {key}, results may not be comparable")
+
+    rows = compare(baseline, current, args.threshold, set(args.metrics.split(",")) if args.metrics else None)
+    regressions = [row for row in rows if row[4]]
+    print(f"{'metric':<60} {'baseline':>10} {'current':>10} {'change':>8}")
+    for path, before, after, change, regressed in rows:
+        marker = "  REGRESSION" if regressed else ""
+        print(f"{path:<60} {before:>10.2f} {after:>10.2f} {change:>+8.1%}{marker}")
+    print(f"{len(rows)} metrics compared, {len(regressions)} regressed by more than {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""
+Accuracy/latency comparison of decode-time downscaling against full-resolution ELA.
+
+For every image and every working size, preprocessing (decode + ELA) is timed and the
+model's tampered probability is compared with the full-resolution result. Use it to
+pick ``VERIFRAME_ELA_WORKING_SIZE`` for a deployment.
+
+Usage (from the backend directory):
+    python -m benchmarks.downscale --images /data/sample --model model.pth
+    python -m benchmarks.downscale --working-sizes 0,3000,2048,1024 --output downscale.json
+
+Without ``--images`` a set of large synthetic photos is generated; without
+``--model`` a randomly initialized model is used (latency numbers stay meaningful,
+accuracy numbers then only show how much the model input changes).
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import torch
+
+from archives import is_image_name
+from benchmarks.common import build_model, encode, synthetic_image
+from main import compute_ela_array, ela_to_tensor
+
+
+def load_images(directory: str, limit: int) -> list:
+    names = sorted(n for n in os.listdir(directory) if is_image_name(n))[:limit]
+    images = []
+    for name in names:
+        with open(os.path.join(directory, name), "rb") as f:
+            images.append((name, f.read()))
+    return images
+
+
+def synthetic_images(sizes: list) -> list:
+    images = []
+    for i, (w, h) in enumerate(sizes):
+        kind = "spliced" if i % 2 == 0 else "noise"
+        images.append((f"{kind}_{w}x{h}.jpg", encode(synthetic_image(kind, (w, h), seed=i), "JPEG", 92)))
+    return images
+
+
+def tampered_probability(model, ela_array) -> float:
+    with torch.no_grad():
+        return torch.softmax(model(ela_to_tensor(ela_array)), dim=1)[0, 1].item()
+
+
+def compare(images: list, working_sizes: list, model, repeat: int) -> dict:
+    report = {}
+    baseline = {}
+    for working_size in working_sizes:
+        latencies, deltas, agreements = [], [], []
+        for name, data in images:
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                ela = compute_ela_array(data, working_size=working_size, max_pixels=0)
+                best = min(best, time.perf_counter() - start)
+            latencies.append(best * 1000)
+            prob = tampered_probability(model, ela)
+            if working_size == 0:
+                baseline[name] = prob
+            elif name in baseline:
+                deltas.append(abs(prob - baseline[name]))
+                agreements.append((prob > 0.5) == (baseline[name] > 0.5))
+        entry = {
+            "mean_latency_ms": round(statistics.mean(latencies), 2),
+            "max_latency_ms": round(max(latencies), 2),
+        }
+        if deltas:
+            entry.update({
+                "mean_abs_prob_delta": round(statistics.mean(deltas), 5),
+                "max_abs_prob_delta": round(max(deltas), 5),
+                "label_agreement": round(sum(agreements) / len(agreements), 4),
+            })
+        report[str(working_size)] = entry
+
+    full = report.get("0")
+    if full:
+        for entry in report.values():
+            entry["speedup"] = round(full["mean_latency_ms"] / entry["mean_latency_ms"], 2)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Directory of sample images (default: synthetic large photos)")
+    parser.add_argument("--limit", type=int, default=50, help="Maximum number of images to use")
+    parser.add_argument("--working-sizes", default="0,4096,2048,1024,512",
+                        help="Comma-separated longest-side limits; 0 is the full-resolution baseline")
+    parser.add_argument("--model", help="Model checkpoint (default: randomly initialized model)")
+    parser.add_argument("--arch", default="generic", choices=["generic", "resnet18"],
+                        help="Architecture of the random model when --model is not given")
+    parser.add_argument("--repeat", type=int, default=2, help="Timing repetitions per image (best is used)")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    working_sizes = [int(s) for s in args.working_sizes.split(",")]
+    if 0 not in working_sizes:
+        working_sizes.insert(0, 0)
+    else:
+        working_sizes.sort(key=lambda s: s != 0)  # baseline first
+
+    if args.images:
+        images = load_images(args.images, args.limit)
+    else:
+        images = synthetic_images([(4000, 3000), (6000, 4000), (8000, 6000)][:args.limit])
+    if not images:
+        print("No images found", file=sys.stderr)
+        return 1
+
+    model = build_model(args.model, args.arch)
+    report = {
+        "benchmark": "downscale",
+        "images": len(images),
+        "model": args.model or f"random-{args.arch}",
+        "working_sizes": compare(images, working_sizes, model, args.repeat),
+    }
+
+    print(f"{'working_size':>12} {'mean_ms':>9} {'speedup':>8} {'mean_dp':>9} {'max_dp':>9} {'agree':>7}")
+    for size, entry in report["working_sizes"].items():
+        print(f"{size:>12} {entry['mean_latency_ms']:>9.1f} {entry.get('speedup', 1.0):>8.2f} "
+              f"{entry.get('mean_abs_prob_delta', 0.0):>9.4f} {entry.get('max_abs_prob_delta', 0.0):>9.4f} "
+              f"{entry.get('label_agreement', 1.0):>7.2%}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
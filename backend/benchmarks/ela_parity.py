@@ -0,0 +1,85 @@
+"""
+Parity check and speed comparison between ``fast_ela`` and the reference ELA pipeline.
+
+The reference is ``apply_ela`` followed by the ``get_transform()`` (ToTensor) used in
+``main.py``. Every case must match within ``--tolerance``, otherwise the script exits
+with status 1, so it can gate changes to the preprocessing code.
+
+Usage (from the backend directory):
+    python -m benchmarks.ela_parity [--tolerance 1e-6] [--repeat 3]
+"""
+import argparse
+import io
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+import fast_ela
+from benchmarks.common import synthetic_image
+from main import apply_ela, get_transform
+
+
+def roundtrip(image: Image.Image, fmt: str) -> Image.Image:
+    """Encode and decode the image the way an upload would arrive."""
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **({"quality": 92} if fmt == "JPEG" else {}))
+    decoded = Image.open(io.BytesIO(buffer.getvalue()))
+    return decoded.convert("RGB") if decoded.mode != "RGB" else decoded
+
+
+def cases():
+    sizes = [(224, 224), (100, 60), (641, 479), (1920, 1080)]
+    for kind in ("noise", "gradient", "spliced"):
+        for size in sizes:
+            for fmt in ("JPEG", "PNG"):
+                for quality in (75, 90, 95):
+                    for source in ("pil", "array"):
+                        yield kind, size, fmt, quality, source
+
+
+def timed(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tolerance", type=float, default=1e-6, help="Maximum allowed absolute difference")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions per case (best is reported)")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    total_ref = total_fast = 0.0
+    print(f"{'case':<46} {'max_abs_diff':>12} {'ref_ms':>8} {'fast_ms':>8}")
+    for kind, size, fmt, quality, source in cases():
+        image = roundtrip(synthetic_image(kind, size), fmt)
+        fast_input = np.array(image) if source == "array" else image
+        expected, ref_time = timed(lambda: get_transform()(apply_ela(image, quality=quality)), args.repeat)
+        actual, fast_time = timed(lambda: fast_ela.to_tensor(fast_ela.ela_array(fast_input, quality=quality)), args.repeat)
+
+        diff = (expected - actual).abs().max().item() if expected.shape == actual.shape else float("inf")
+        ok = diff <= args.tolerance and actual.dtype == torch.float32
+        failures += not ok
+        total_ref += ref_time
+        total_fast += fast_time
+        name = f"{kind} {size[0]}x{size[1]} {fmt} q{quality} {source}"
+        print(f"{name:<46} {diff:>12.2e} {ref_time * 1e3:>8.2f} {fast_time * 1e3:>8.2f}{'' if ok else '  FAIL'}")
+
+    print(f"\nTotal: reference {total_ref * 1e3:.1f} ms, fast {total_fast * 1e3:.1f} ms "
+          f"({total_ref / total_fast:.2f}x)")
+    if failures:
+        print(f"{failures} case(s) exceeded tolerance {args.tolerance}")
+        return 1
+    print("All cases match")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
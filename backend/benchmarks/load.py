@@ -0,0 +1,179 @@
+"""
+End-to-end load test of the FastAPI app through an in-process ASGI client.
+
+Requests go through the real app (routing, upload parsing, admission control, ELA
+pool, micro-batcher, model) without a network stack, using ``httpx.AsyncClient`` with
+``ASGITransport``. For every concurrency level, ``--requests`` uploads are sent by that
+many concurrent clients; the report has throughput, latency percentiles, status codes
+and the mean time spent in each pipeline stage (from the /metrics histograms).
+
+The prediction cache is disabled unless ``--cache`` is given, so every request does
+the full work.
+
+Usage (from the backend directory):
+    python -m benchmarks.load [--concurrency 1,4,16,64] [--requests 200] [--output load.json]
+    python -m benchmarks.load --endpoint batch --batch-files 16 --concurrency 1,4
+
+Without ``--model`` a randomly initialized model of ``--arch`` is served.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Comma-separated numbers of concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--endpoint", default="predict", choices=["predict", "batch"],
+                        help="predict: one image per request; batch: --batch-files images per /predict/batch request")
+    parser.add_argument("--batch-files", type=int, default=16, help="Images per /predict/batch request")
+    parser.add_argument("--megapixels", type=float, default=2.0, help="Size of the uploaded images")
+    parser.add_argument("--format", default="JPEG", choices=["JPEG", "PNG", "WEBP"], help="Upload format")
+    parser.add_argument("--distinct-images", type=int, default=64, help="Number of different images uploaded")
+    parser.add_argument("--cache", action="store_true", help="Keep the prediction cache enabled")
+    parser.add_argument("--model", help="Model checkpoint (default: randomly initialized model)")
+    parser.add_argument("--arch", default="generic", choices=["generic", "resnet18"],
+                        help="Architecture of the random model when --model is not given")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def stage_totals(metrics) -> dict:
+    """Current (sum, count) of every stage histogram."""
+    return {
+        values[0]: (child.sum, sum(child.counts))
+        for values, child in list(metrics.STAGE_SECONDS._children.items())
+    }
+
+
+def stage_means(before: dict, after: dict) -> dict:
+    means = {}
+    for stage, (total, count) in after.items():
+        prev_total, prev_count = before.get(stage, (0.0, 0))
+        if count > prev_count:
+            means[stage] = round((total - prev_total) / (count - prev_count) * 1000, 3)
+    return means
+
+
+async def run_level(client, uploads: list, args, concurrency: int) -> dict:
+    from benchmarks.common import latency_summary
+
+    latencies, statuses = [], {}
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < args.requests:
+            i = next_index
+            next_index += 1
+            if args.endpoint == "predict":
+                name, data = uploads[i % len(uploads)]
+                request = client.post("/predict", files={"file": (name, data, f"image/{args.format.lower()}")})
+            else:
+                files = [
+                    ("files", (name, data, f"image/{args.format.lower()}"))
+                    for name, data in (uploads[(i * args.batch_files + j) % len(uploads)] for j in range(args.batch_files))
+                ]
+                request = client.post("/predict/batch", files=files)
+            start = time.perf_counter()
+            response = await request
+            latencies.append(time.perf_counter() - start)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    images = args.requests * (args.batch_files if args.endpoint == "batch" else 1)
+    ok = statuses.get("200", 0)
+    return {
+        "case": f"{args.endpoint}-c{concurrency}",
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_sec": round(args.requests / elapsed, 2),
+        "images_per_sec": round(images * ok / args.requests / elapsed, 2),
+        "status_codes": statuses,
+        "latency": latency_summary(latencies),
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+
+    import metrics
+    import main as app_main
+    from benchmarks.common import encode, environment, image_for_megapixels
+
+    uploads = [
+        (f"img{i}.{args.format.lower()}", encode(image_for_megapixels(args.megapixels, seed=i), args.format))
+        for i in range(args.distinct_images)
+    ]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    report = {
+        "benchmark": "load",
+        "environment": environment(),
+        "config": {
+            "model": args.model or f"random-{args.arch}",
+            "endpoint": args.endpoint,
+            "batch_files": args.batch_files if args.endpoint == "batch" else 1,
+            "megapixels": args.megapixels,
+            "format": args.format,
+            "cache": args.cache,
+            "ela_workers": app_main.ELA_WORKERS,
+            "inference_workers": app_main.INFERENCE_WORKERS,
+            "batch_max_size": app_main.BATCH_MAX_SIZE,
+            "batch_max_wait_ms": app_main.BATCH_MAX_WAIT_MS,
+            "max_queue_depth": app_main.MAX_QUEUE_DEPTH,
+        },
+        "levels": [],
+    }
+
+    # Runs the startup/shutdown events (worker pools, model load) like a server would
+    async with app_main.app.router.lifespan_context(app_main.app):
+        if app_main.registry.active is None:
+            raise RuntimeError("Model failed to load")
+        transport = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # Warm up the ELA workers and the model before measuring
+            await run_level(client, uploads, argparse.Namespace(**{**vars(args), "requests": max(levels)}), max(levels))
+            print(f"{'concurrency':>11} {'req/s':>8} {'img/s':>8} {'p50_ms':>9} {'p99_ms':>9}  status")
+            for concurrency in levels:
+                before = stage_totals(metrics)
+                entry = await run_level(client, uploads, args, concurrency)
+                entry["stage_mean_ms"] = stage_means(before, stage_totals(metrics))
+                report["levels"].append(entry)
+                print(f"{concurrency:>11} {entry['requests_per_sec']:>8.2f} {entry['images_per_sec']:>8.2f} "
+                      f"{entry['latency']['p50_ms']:>9.1f} {entry['latency']['p99_ms']:>9.1f}  {entry['status_codes']}",
+                      flush=True)
+    return report
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if not args.cache:
+        os.environ["VERIFRAME_CACHE_MAX_MB"] = "0"
+        os.environ.pop("VERIFRAME_CACHE_DB", None)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # main reads its configuration at import time, so import it after the overrides
+        import torch
+        import main as app_main
+        from benchmarks.common import build_model, write_report
+
+        if args.model:
+            app_main.MODEL_PATH = os.path.abspath(args.model)
+        else:
+            app_main.MODEL_PATH = os.path.join(tmp, f"random_{args.arch}.pth")
+            torch.save(build_model(arch=args.arch).state_dict(), app_main.MODEL_PATH)
+        report = asyncio.run(run(args))
+    write_report(report, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
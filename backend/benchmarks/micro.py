@@ -0,0 +1,126 @@
+"""
+Microbenchmarks for the request path: ``apply_ela``, ``preprocess_image`` and
+``predict_image``.
+
+ELA and preprocessing are timed for every combination of format (JPEG/PNG/WebP) and
+image size (megapixels). ``apply_ela`` gets an already decoded image;
+``preprocess_image`` gets the encoded upload, so it includes decoding and uses the
+configured ELA implementation and working size. ``ela_ensemble`` times a multi-quality
+ELA sweep from one upload (single decode, concurrent recompressions) against
+``ela_ensemble_naive``, one full preprocessing run per quality. Model inference does not depend on
+the upload, so ``predict_image`` (and ``predict_batch`` throughput) is timed once per
+run.
+
+Usage (from the backend directory):
+    python -m benchmarks.micro [--sizes 0.3,2,12,50] [--formats JPEG,PNG,WEBP] [--output micro.json]
+    python -m benchmarks.compare baseline.json micro.json
+
+Without ``--model`` a randomly initialized model of ``--arch`` is used.
+"""
+import argparse
+import io
+import sys
+import time
+
+from PIL import Image
+
+from benchmarks.common import (
+    build_model, encode, environment, image_for_megapixels, latency_summary, write_report,
+)
+import main as app_main
+
+
+def timings(fn, repeat: int, warmup: int = 1) -> list:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_image(megapixels: float, fmt: str, repeat: int, qualities: tuple = ()) -> dict:
+    data = encode(image_for_megapixels(megapixels), fmt)
+    decoded = Image.open(io.BytesIO(data)).convert("RGB")
+    entry = {
+        "case": f"{fmt}-{megapixels:g}MP",
+        "format": fmt,
+        "megapixels": megapixels,
+        "size": list(decoded.size),
+        "bytes": len(data),
+        "apply_ela": latency_summary(timings(lambda: app_main.apply_ela(decoded, quality=90), repeat)),
+        "preprocess_image": latency_summary(timings(lambda: app_main.preprocess_image(data), repeat)),
+    }
+    if qualities:
+        entry["ela_ensemble"] = latency_summary(
+            timings(lambda: app_main.compute_ela_array(data, qualities=qualities), repeat)
+        )
+        entry["ela_ensemble_naive"] = latency_summary(
+            timings(lambda: [app_main.compute_ela_array(data, qualities=(q,)) for q in qualities], repeat)
+        )
+    return entry
+
+
+def bench_model(batch_sizes: list, repeat: int) -> dict:
+    tensor = app_main.preprocess_image(encode(image_for_megapixels(0.3)))
+    result = {"predict_image": latency_summary(timings(lambda: app_main.predict_image(tensor), repeat))}
+    for size in batch_sizes:
+        batch = tensor.repeat(size, 1, 1, 1)
+        samples = timings(lambda: app_main.predict_batch(batch), repeat)
+        summary = latency_summary(samples)
+        summary["images_per_sec"] = round(size / (summary["p50_ms"] / 1000), 2)
+        result[f"predict_batch_{size}"] = summary
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="0.3,2,12,50", help="Comma-separated image sizes in megapixels")
+    parser.add_argument("--formats", default="JPEG,PNG,WEBP", help="Comma-separated upload formats")
+    parser.add_argument("--ensemble", default="75,85,90,95",
+                        help="JPEG qualities of the multi-quality ELA case (empty to skip)")
+    parser.add_argument("--batch-sizes", default="1,4,16", help="predict_batch sizes to time")
+    parser.add_argument("--model", help="Model checkpoint (default: randomly initialized model)")
+    parser.add_argument("--arch", default="generic", choices=["generic", "resnet18"],
+                        help="Architecture of the random model when --model is not given")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case (after one warmup run)")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    build_model(args.model, args.arch)
+    report = {
+        "benchmark": "micro",
+        "environment": environment(),
+        "config": {
+            "model": args.model or f"random-{args.arch}",
+            "ela_impl": app_main.ELA_IMPL,
+            "ela_working_size": app_main.ELA_WORKING_SIZE,
+            "repeat": args.repeat,
+            "ensemble": args.ensemble,
+        },
+        "images": [],
+    }
+
+    print(f"{'format':<6} {'MP':>6} {'apply_ela_p50':>14} {'preprocess_p50':>15} {'ensemble_p50':>13} {'naive_p50':>10}")
+    for fmt in args.formats.upper().split(","):
+        for megapixels in (float(s) for s in args.sizes.split(",")):
+            entry = bench_image(megapixels, fmt, args.repeat, app_main.parse_ela_qualities(args.ensemble) or ())
+            report["images"].append(entry)
+            print(f"{fmt:<6} {megapixels:>6g} {entry['apply_ela']['p50_ms']:>12.1f}ms "
+                  f"{entry['preprocess_image']['p50_ms']:>13.1f}ms "
+                  f"{entry.get('ela_ensemble', {}).get('p50_ms', 0):>11.1f}ms "
+                  f"{entry.get('ela_ensemble_naive', {}).get('p50_ms', 0):>8.1f}ms", flush=True)
+
+    report["model"] = bench_model([int(s) for s in args.batch_sizes.split(",")], args.repeat)
+    for name, entry in report["model"].items():
+        extra = f" ({entry['images_per_sec']} images/sec)" if "images_per_sec" in entry else ""
+        print(f"{name:<20} p50 {entry['p50_ms']:.1f}ms{extra}")
+
+    write_report(report, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
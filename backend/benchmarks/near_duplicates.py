@@ -0,0 +1,110 @@
+"""
+Near-duplicate index benchmark: build time, memory and lookup latency at scale.
+
+For every index size, random 64-bit hashes are inserted in bulk (as ``near_duplicates.py
+rebuild`` does) and then queried at each Hamming radius with a mix of hits (a stored
+hash with up to ``radius`` bits flipped) and misses (a fresh random hash). The
+multi-index lookup is compared with a linear ``np.bitwise_count`` scan over all hashes,
+and both must agree on every query's distance.
+
+Usage (from the backend directory):
+    python -m benchmarks.near_duplicates [--entries 100000,1000000,5000000] [--distances 4,6,8] [--queries 1000] [--output nd.json]
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import environment, latency_summary, write_report
+from near_duplicates import NearDuplicateIndex
+
+
+def make_queries(hashes: np.ndarray, count: int, radius: int, rng: np.random.Generator) -> list:
+    """Half perturbed copies of stored hashes, half random hashes."""
+    queries = []
+    for i in range(count):
+        if i % 2 == 0:
+            value = int(hashes[rng.integers(len(hashes))])
+            for bit in rng.choice(64, size=int(rng.integers(radius + 1)), replace=False):
+                value ^= 1 << int(bit)
+        else:
+            value = int(rng.integers(0, 2 ** 63, dtype=np.int64)) << 1 | int(rng.integers(2))
+        queries.append(value)
+    return queries
+
+
+def linear_lookup(hashes: np.ndarray, image_hash: int, max_distance: int):
+    distances = np.bitwise_count(hashes ^ np.uint64(image_hash))
+    best = int(np.argmin(distances))
+    return int(distances[best]) if distances[best] <= max_distance else None
+
+
+def bench_size(entries: int, distances: list, queries: int, seed: int) -> list:
+    rng = np.random.default_rng(seed)
+    hashes = rng.integers(0, 2 ** 64, size=entries, dtype=np.uint64)
+    scores = rng.random((entries, 4), dtype=np.float32)
+    refs = [f"img-{i}" for i in range(entries)]
+
+    index = NearDuplicateIndex()
+    start = time.perf_counter()
+    index.add_many(hashes, scores, "bench", refs)
+    build_s = time.perf_counter() - start
+    stats = index.stats()
+    print(f"{entries:>10,} entries: built in {build_s:.2f}s, {stats['bytes'] / 2 ** 20:.1f} MiB (arrays)")
+
+    results = []
+    for radius in distances:
+        sample = make_queries(hashes, queries, radius, rng)
+        indexed, linear, hits, mismatches = [], [], 0, 0
+        for value in sample:
+            t0 = time.perf_counter()
+            match = index.lookup(value, radius)
+            t1 = time.perf_counter()
+            expected = linear_lookup(hashes, value, radius)
+            t2 = time.perf_counter()
+            indexed.append(t1 - t0)
+            linear.append(t2 - t1)
+            hits += match is not None
+            mismatches += (match["distance"] if match else None) != expected
+        case = {
+            "case": f"{entries}_d{radius}",
+            "entries": entries,
+            "max_distance": radius,
+            "build_s": round(build_s, 3),
+            "index_bytes": stats["bytes"],
+            "hit_rate": round(hits / len(sample), 4),
+            "mismatches": mismatches,
+            "indexed": latency_summary(indexed),
+            "linear": latency_summary(linear),
+        }
+        case["speedup_p50"] = round(case["linear"]["p50_ms"] / max(case["indexed"]["p50_ms"], 1e-6), 1)
+        results.append(case)
+        print(
+            f"  radius {radius}: indexed p50 {case['indexed']['p50_ms']:.3f} ms / p99 {case['indexed']['p99_ms']:.3f} ms,"
+            f" linear p50 {case['linear']['p50_ms']:.3f} ms ({case['speedup_p50']}x), hits {hits}, mismatches {mismatches}"
+        )
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", default="100000,1000000,5000000", help="Comma-separated index sizes")
+    parser.add_argument("--distances", default="4,6,8", help="Comma-separated maximum Hamming distances")
+    parser.add_argument("--queries", type=int, default=1000, help="Lookups per size and distance")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args(argv)
+
+    distances = [int(d) for d in args.distances.split(",")]
+    cases = []
+    for entries in (int(n) for n in args.entries.split(",")):
+        cases.extend(bench_size(entries, distances, args.queries, args.seed))
+
+    write_report({"benchmark": "near_duplicates", "environment": environment(), "cases": cases}, args.output)
+    # The index must never disagree with the exhaustive scan
+    return 1 if any(case["mismatches"] for case in cases) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
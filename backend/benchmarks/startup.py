@@ -0,0 +1,136 @@
+"""
+Startup-time benchmark: time-to-first-prediction of a fresh process.
+
+Each scenario starts a new Python process that imports ``main``, loads the model and
+serves one prediction, and reports the time spent in each phase:
+
+- ``no_cache``: model artifact cache disabled (architecture inference every boot)
+- ``cold``: empty artifact cache (first boot after a deploy, populates the cache)
+- ``warm``: populated artifact cache (every later boot)
+
+Usage (from the backend directory):
+    python -m benchmarks.startup [--model model.pth] [--runtime eager] [--repeat 3] [--output startup.json]
+
+Without ``--model`` a randomly initialized checkpoint of ``--arch`` is generated.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_PREFIX = "STARTUP_RESULT "
+
+CHILD = r"""
+import time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+main.load_model({model_path!r})
+t2 = time.perf_counter()
+with open({image_path!r}, "rb") as f:
+    image_bytes = f.read()
+main.predict_image(main.preprocess_image(image_bytes))
+t3 = time.perf_counter()
+import json
+print({prefix!r} + json.dumps({{
+    "import_s": t1 - t0,
+    "load_model_s": t2 - t1,
+    "first_prediction_s": t3 - t2,
+    "in_process_total_s": t3 - t0,
+}}))
+"""
+
+
+def run_child(model_path: str, image_path: str, env: dict) -> dict:
+    code = CHILD.format(model_path=model_path, image_path=image_path, prefix=RESULT_PREFIX)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", code], cwd=BACKEND_DIR, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    wall = time.perf_counter() - start
+    lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f"Startup run failed:\n{proc.stdout[-2000:]}\n{proc.stderr[-2000:]}")
+    result = json.loads(lines[-1][len(RESULT_PREFIX):])
+    result["time_to_first_prediction_s"] = wall
+    return result
+
+
+def summarize(runs: list) -> dict:
+    return {key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]}
+
+
+def make_checkpoint(directory: str, arch: str) -> str:
+    sys.path.insert(0, BACKEND_DIR)
+    import torch
+    from benchmarks.common import build_model
+
+    path = os.path.join(directory, f"random_{arch}.pth")
+    torch.save(build_model(arch=arch).state_dict(), path)
+    return path
+
+
+def make_image(directory: str) -> str:
+    from benchmarks.common import encode, synthetic_image
+
+    path = os.path.join(directory, "sample.jpg")
+    with open(path, "wb") as f:
+        f.write(encode(synthetic_image("spliced", (1024, 768))))
+    return path
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Checkpoint to load (default: random checkpoint of --arch)")
+    parser.add_argument("--arch", default="resnet18", choices=["generic", "resnet18"])
+    parser.add_argument("--runtime", default="eager", help="VERIFRAME_RUNTIME for the child processes")
+    parser.add_argument("--quantize", default="none", help="VERIFRAME_QUANTIZE for the child processes")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario (median is reported)")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.abspath(args.model) if args.model else make_checkpoint(tmp, args.arch)
+        image_path = make_image(tmp)
+        base_env = dict(
+            os.environ,
+            VERIFRAME_RUNTIME=args.runtime,
+            VERIFRAME_QUANTIZE=args.quantize,
+            VERIFRAME_ELA_WORKERS="0",
+        )
+
+        report = {"benchmark": "startup", "model": args.model or f"random-{args.arch}", "runtime": args.runtime,
+                  "quantize": args.quantize, "scenarios": {}}
+
+        runs = [run_child(model_path, image_path, dict(base_env, VERIFRAME_MODEL_CACHE="0"))
+                for _ in range(args.repeat)]
+        report["scenarios"]["no_cache"] = summarize(runs)
+
+        cold, warm = [], []
+        for i in range(args.repeat):
+            cache_dir = os.path.join(tmp, f"cache{i}")
+            env = dict(base_env, VERIFRAME_MODEL_CACHE="1", VERIFRAME_MODEL_CACHE_DIR=cache_dir)
+            cold.append(run_child(model_path, image_path, env))
+            warm.append(run_child(model_path, image_path, env))
+        report["scenarios"]["cold"] = summarize(cold)
+        report["scenarios"]["warm"] = summarize(warm)
+
+    print(f"{'scenario':<10} {'ttfp_s':>8} {'import_s':>9} {'load_s':>8} {'first_pred_s':>13}")
+    for name, entry in report["scenarios"].items():
+        print(f"{name:<10} {entry['time_to_first_prediction_s']:>8.3f} {entry['import_s']:>9.3f} "
+              f"{entry['load_model_s']:>8.3f} {entry['first_prediction_s']:>13.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
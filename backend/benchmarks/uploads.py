@@ -0,0 +1,192 @@
+"""
+Peak memory of the API under concurrent large uploads, with and without upload limits.
+
+Every scenario runs in a fresh process serving the real app (in-process ASGI client,
+ELA in threads so decoding is counted in the measured process). ``--concurrency``
+clients upload the same file at once, ``--requests`` times in total:
+
+- ``valid``: a large JPEG that every configuration accepts;
+- ``oversized``: the same JPEG padded to ``--oversized-mb`` (decodable, but above the
+  byte limit);
+- ``pixel_bomb``: a small PNG of ``--bomb-megapixels`` (above the pixel limit).
+
+With ``limits=on`` the upload limits are set to ``--max-mb`` and ``--max-megapixels``;
+with ``limits=off`` they are disabled, which buffers and decodes every upload like the
+API did before uploads were checked up front. The report has the peak RSS increase
+over the idle server (VmHWM, reset after startup), status codes and latencies.
+
+Usage (from the backend directory):
+    python -m benchmarks.uploads [--concurrency 4] [--requests 8] [--output uploads.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_PREFIX = "UPLOADS_RESULT "
+SCENARIOS = ("valid", "oversized", "pixel_bomb")
+
+
+def memory_mb(field: str) -> float:
+    """VmRSS / VmHWM of this process in MB."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError(f"{field} not available")
+
+
+def reset_peak_rss() -> bool:
+    """Reset VmHWM to the current RSS (Linux 4.0+)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+async def child(args):
+    import httpx
+
+    import main as app_main
+    from benchmarks.common import latency_summary
+
+    app_main.MODEL_PATH = args.model_path
+    with open(args.payload, "rb") as f:
+        payload = f.read()
+    content_type = "image/png" if args.payload.endswith(".png") else "image/jpeg"
+
+    async with app_main.app.router.lifespan_context(app_main.app):
+        if app_main.registry.active is None:
+            raise RuntimeError("Model failed to load")
+        transport = httpx.ASGITransport(app=app_main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            baseline = memory_mb("VmRSS")
+            exact = reset_peak_rss()
+            latencies, statuses = [], {}
+            remaining = args.requests
+
+            async def worker():
+                nonlocal remaining
+                while remaining > 0:
+                    remaining -= 1
+                    start = time.perf_counter()
+                    response = await client.post("/predict", files={"file": ("upload", payload, content_type)})
+                    latencies.append(time.perf_counter() - start)
+                    statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            peak = memory_mb("VmHWM")
+
+    print(RESULT_PREFIX + json.dumps({
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(peak, 1),
+        "peak_increase_mb": round(peak - baseline, 1),
+        "peak_is_exact": exact,
+        "status_codes": statuses,
+        "latency": latency_summary(latencies),
+    }))
+
+
+def make_payloads(directory: str, args) -> dict:
+    from PIL import Image
+
+    from benchmarks.common import encode, image_for_megapixels
+
+    valid = encode(image_for_megapixels(args.megapixels), "JPEG")
+    paths = {name: os.path.join(directory, f"{name}.{'png' if name == 'pixel_bomb' else 'jpg'}") for name in SCENARIOS}
+    with open(paths["valid"], "wb") as f:
+        f.write(valid)
+    with open(paths["oversized"], "wb") as f:
+        # Decoders ignore data after the end of the image
+        f.write(valid + os.urandom(max(0, int(args.oversized_mb * 1024 * 1024) - len(valid))))
+    side = int((args.bomb_megapixels * 1e6) ** 0.5)
+    Image.new("L", (side, side)).save(paths["pixel_bomb"], optimize=True)
+    return paths
+
+
+def run_child(args, scenario: str, payload: str, model_path: str, limits: bool) -> dict:
+    env = dict(
+        os.environ,
+        VERIFRAME_ELA_WORKERS="0",
+        VERIFRAME_CACHE_MAX_MB="0",
+        VERIFRAME_JOB_DB="",
+        VERIFRAME_MODEL_WARMUP_ROUNDS="1",
+        VERIFRAME_UPLOAD_MAX_MB=str(args.max_mb if limits else 0),
+        VERIFRAME_MAX_IMAGE_PIXELS=str(int(args.max_megapixels * 1e6) if limits else 0),
+    )
+    env.pop("VERIFRAME_CACHE_DB", None)
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.uploads", "--child", "--payload", payload, "--model-path", model_path,
+         "--concurrency", str(args.concurrency), "--requests", str(args.requests)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f"Upload run failed ({scenario}):\n{proc.stdout[-2000:]}\n{proc.stderr[-2000:]}")
+    result = json.loads(lines[-1][len(RESULT_PREFIX):])
+    return dict(case=f"{scenario}-limits_{'on' if limits else 'off'}", scenario=scenario, limits=limits, **result)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent uploads")
+    parser.add_argument("--requests", type=int, default=8, help="Uploads per scenario")
+    parser.add_argument("--megapixels", type=float, default=12, help="Size of the valid JPEG")
+    parser.add_argument("--oversized-mb", type=float, default=60, help="File size of the oversized upload")
+    parser.add_argument("--bomb-megapixels", type=float, default=40, help="Dimensions of the pixel bomb")
+    parser.add_argument("--max-mb", type=float, default=20, help="Upload size limit with limits on")
+    parser.add_argument("--max-megapixels", type=float, default=25, help="Pixel limit with limits on")
+    parser.add_argument("--model", help="Model checkpoint (default: randomly initialized model)")
+    parser.add_argument("--arch", default="generic", choices=["generic", "resnet18"],
+                        help="Architecture of the random model when --model is not given")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    # Internal: run one scenario in this process
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--payload", help=argparse.SUPPRESS)
+    parser.add_argument("--model-path", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        asyncio.run(child(args))
+        return 0
+
+    import torch
+
+    from benchmarks.common import build_model, environment, write_report
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.model:
+            model_path = os.path.abspath(args.model)
+        else:
+            model_path = os.path.join(tmp, f"random_{args.arch}.pth")
+            torch.save(build_model(arch=args.arch).state_dict(), model_path)
+        payloads = make_payloads(tmp, args)
+
+        report = {
+            "benchmark": "uploads",
+            "environment": environment(),
+            "config": {key: getattr(args, key) for key in (
+                "concurrency", "requests", "megapixels", "oversized_mb", "bomb_megapixels", "max_mb", "max_megapixels")},
+            "cases": [],
+        }
+        print(f"{'case':<28} {'peak_increase_mb':>17} {'p50_ms':>9}  status")
+        for scenario in args.scenarios.split(","):
+            for limits in (False, True):
+                case = run_child(args, scenario, payloads[scenario], model_path, limits)
+                report["cases"].append(case)
+                print(f"{case['case']:<28} {case['peak_increase_mb']:>17.1f} {case['latency']['p50_ms']:>9.1f}  "
+                      f"{case['status_codes']}", flush=True)
+    write_report(report, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
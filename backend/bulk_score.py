@@ -0,0 +1,340 @@
+"""
+Offline bulk scoring of image corpora.
+
+Walks one or more directories (or reads a manifest of paths), computes ELA in a pool
+of worker processes, runs the model in batches and writes one row per image to CSV,
+JSONL or Parquet. Progress is checkpointed so an interrupted run can be resumed.
+
+Usage (from the backend directory):
+    python bulk_score.py /data/images --output scores.csv
+    python bulk_score.py --manifest paths.txt --output scores.jsonl --workers 8 --batch-size 64
+    python bulk_score.py /data/images --output scores.parquet --resume
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from archives import is_image_name
+
+OUTPUT_FIELDS = [
+    "path", "prediction", "class", "confidence",
+    "prob_authentic", "prob_tampered", "logit_0", "logit_1", "phash", "error", "namespace",
+]
+
+
+def iter_directory(root: str) -> Iterator[str]:
+    """Yield image paths under ``root`` in a deterministic (sorted) order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if is_image_name(name):
+                yield os.path.join(dirpath, name)
+
+
+def iter_manifest(manifest_path: str) -> Iterator[str]:
+    """
+    Yield paths from a manifest: a CSV with a ``path`` column, or a text file with one
+    path per line (blank lines and ``#`` comments are ignored). Relative paths are
+    resolved against the manifest's directory.
+    """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline="") as f:
+        if manifest_path.lower().endswith(".csv"):
+            paths = (row["path"] for row in csv.DictReader(f))
+        else:
+            paths = (line.strip() for line in f)
+        for path in paths:
+            if path and not path.startswith("#"):
+                yield path if os.path.isabs(path) else os.path.join(base, path)
+
+
+def _ela_worker(path: str) -> Tuple[str, object, Optional[str]]:
+    """
+    Read and preprocess one image in a worker process. Returns (path, (ela_array,
+    perceptual hash), error); the hash lets near_duplicates.py index the results.
+    """
+    from ela_worker import compute_ela_timed
+    try:
+        with open(path, "rb") as f:
+            ela_array, _, _, image_hash = compute_ela_timed(f.read(), perceptual=True)
+        return path, (ela_array, image_hash), None
+    except Exception as e:
+        return path, None, f"Error preprocessing image: {str(e)}"
+
+
+def result_row(path: str, result: Optional[dict] = None, error: Optional[str] = None,
+               image_hash: Optional[int] = None, namespace: Optional[str] = None) -> dict:
+    """
+    Flatten a predict_image result into an output row. ``namespace`` is the model
+    fingerprint and settings the scores were computed under (``cache.result_namespace``),
+    which near_duplicates.py keys the rows' index entries by.
+    """
+    row = dict.fromkeys(OUTPUT_FIELDS)
+    row["path"] = path
+    row["error"] = error
+    row["namespace"] = namespace
+    if image_hash is not None:
+        row["phash"] = f"{image_hash:016x}"
+    if result is not None:
+        row.update({
+            "prediction": result["prediction"],
+            "class": result["class"],
+            "confidence": result["confidence"],
+            "prob_authentic": result["probabilities"]["authentic"],
+            "prob_tampered": result["probabilities"]["tampered"],
+            "logit_0": result["raw_logits"]["class_0"],
+            "logit_1": result["raw_logits"]["class_1"],
+        })
+    return row
+
+
+class CsvWriter:
+    def __init__(self, path: str, append: bool):
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        fields = OUTPUT_FIELDS
+        if exists:
+            # Keep the columns of a file written by an older version when resuming
+            with open(path, newline="") as f:
+                fields = next(csv.reader(f))
+        self._file = open(path, "a" if append else "w", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=fields, extrasaction="ignore")
+        if not exists:
+            self._writer.writeheader()
+
+    def write(self, rows: List[dict]):
+        self._writer.writerows(rows)
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter:
+    def __init__(self, path: str, append: bool):
+        self._file = open(path, "a" if append else "w")
+
+    def write(self, rows: List[dict]):
+        self._file.writelines(json.dumps(row) + "\n" for row in rows)
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    Write Parquet part files into a directory (``part-00000.parquet``, ...).
+
+    Parquet files cannot be appended to, so every flush produces a new part; a resumed
+    run simply continues numbering after the existing parts.
+    """
+
+    def __init__(self, path: str, append: bool):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("Parquet output requires pyarrow (pip install pyarrow)")
+        os.makedirs(path, exist_ok=True)
+        existing = [name for name in os.listdir(path) if name.startswith("part-") and name.endswith(".parquet")]
+        if existing and not append:
+            raise SystemExit(f"{path} already contains Parquet parts; use --resume or a new output path")
+        self._dir = path
+        self._part = len(existing)
+        self._rows = []
+
+    def write(self, rows: List[dict]):
+        self._rows.extend(rows)
+
+    def flush(self):
+        if not self._rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pylist(self._rows, schema=pa.schema([
+            ("path", pa.string()), ("prediction", pa.string()), ("class", pa.int8()),
+            ("confidence", pa.float32()), ("prob_authentic", pa.float32()), ("prob_tampered", pa.float32()),
+            ("logit_0", pa.float32()), ("logit_1", pa.float32()), ("phash", pa.string()), ("error", pa.string()),
+            ("namespace", pa.string()),
+        ]))
+        pq.write_table(table, os.path.join(self._dir, f"part-{self._part:05d}.parquet"))
+        self._part += 1
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+def infer_format(output: str) -> str:
+    ext = os.path.splitext(output.rstrip("/"))[1].lower().lstrip(".")
+    if ext in ("json", "ndjson"):
+        return "jsonl"
+    if ext in WRITERS:
+        return ext
+    raise SystemExit(f"Cannot infer output format from {output!r}; pass --format")
+
+
+class Checkpoint:
+    """Append-only list of paths whose results have been durably written."""
+
+    def __init__(self, path: str, resume: bool):
+        self.path = path
+        self.done = set()
+        if resume and os.path.exists(path):
+            with open(path) as f:
+                self.done = {line.rstrip("\n") for line in f if line.strip()}
+        self._file = open(path, "a" if resume else "w")
+
+    def mark(self, paths: Iterable[str]):
+        self._file.writelines(p + "\n" for p in paths)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def score(
+    paths: Iterable[str],
+    writer,
+    checkpoint: Checkpoint,
+    workers: int,
+    batch_size: int,
+    flush_every: int = 1024,
+    report_every: float = 10.0,
+) -> dict:
+    """
+    Score every path not yet in the checkpoint and write the results.
+
+    ELA runs in ``workers`` processes (in this process if 0) while the model runs here,
+    in batches of ``batch_size``. Results are flushed, then checkpointed, every
+    ``flush_every`` images, so after a crash at most that many images are rescored.
+    """
+    import ela_worker
+    from main import ELA_WORKER_SETTINGS, cache_fingerprint, ela_arrays_to_batch, predict_batch
+    namespace = cache_fingerprint()
+
+    todo = (p for p in paths if p not in checkpoint.done)
+    pool = None
+    if workers > 0:
+        # Workers only import ela_worker, configured like the API's ELA workers
+        pool = multiprocessing.get_context("spawn").Pool(
+            workers, initializer=ela_worker.configure, initargs=(ELA_WORKER_SETTINGS,)
+        )
+        preprocessed = pool.imap(_ela_worker, todo, chunksize=8)
+    else:
+        preprocessed = map(_ela_worker, todo)
+
+    stats = {"scored": 0, "failed": 0, "skipped": len(checkpoint.done)}
+    pending_rows, pending_paths, batch = [], [], []
+    start = last_report = time.perf_counter()
+
+    def run_batch():
+        results = predict_batch(ela_arrays_to_batch([ela for _, (ela, _) in batch]))
+        for (path, (_, image_hash)), result in zip(batch, results):
+            pending_rows.append(result_row(path, result, image_hash=image_hash, namespace=namespace))
+            pending_paths.append(path)
+        stats["scored"] += len(batch)
+        batch.clear()
+
+    def flush():
+        writer.write(pending_rows)
+        writer.flush()
+        checkpoint.mark(pending_paths)
+        pending_rows.clear()
+        pending_paths.clear()
+
+    try:
+        for path, ela, error in preprocessed:
+            if error is not None:
+                pending_rows.append(result_row(path, error=error))
+                pending_paths.append(path)
+                stats["failed"] += 1
+            else:
+                batch.append((path, ela))
+                if len(batch) >= batch_size:
+                    run_batch()
+            if len(pending_rows) >= flush_every:
+                flush()
+
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                done = stats["scored"] + stats["failed"]
+                print(f"{done} images, {done / (now - start):.1f} images/sec", flush=True)
+                last_report = now
+        if batch:
+            run_batch()
+        flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = round(elapsed, 2)
+    stats["images_per_sec"] = round((stats["scored"] + stats["failed"]) / elapsed, 2) if elapsed > 0 else 0.0
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="*", help="Directories to scan for images")
+    parser.add_argument("--manifest", action="append", default=[], help="File listing image paths (repeatable)")
+    parser.add_argument("--output", required=True, help="Output file (.csv, .jsonl) or directory (.parquet)")
+    parser.add_argument("--format", choices=sorted(WRITERS), help="Output format (inferred from --output)")
+    parser.add_argument("--model", default=None, help="Model checkpoint (defaults to backend/model.pth)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ELA worker processes (0 = in-process)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per forward pass")
+    parser.add_argument("--checkpoint", help="Checkpoint file (defaults to <output>.checkpoint)")
+    parser.add_argument("--resume", action="store_true", help="Skip images recorded in the checkpoint and append")
+    parser.add_argument("--calibration", default=os.environ.get("VERIFRAME_SCORE_CALIBRATION") or None,
+                        help="Score calibration file applied as by the API (default: VERIFRAME_SCORE_CALIBRATION)")
+    args = parser.parse_args(argv)
+
+    if not args.inputs and not args.manifest:
+        parser.error("give at least one directory or --manifest")
+
+    import main as app_main
+    app_main.load_model(args.model or app_main.MODEL_PATH)
+    if args.calibration:
+        # Scores and verdicts are then calibrated exactly like the API's
+        from calibration import load_calibrations
+        app_main.score_calibrations = load_calibrations(args.calibration)
+
+    def all_paths():
+        for manifest in args.manifest:
+            yield from iter_manifest(manifest)
+        for root in args.inputs:
+            yield from iter_directory(root)
+
+    output_format = args.format or infer_format(args.output)
+    checkpoint = Checkpoint(args.checkpoint or args.output.rstrip("/") + ".checkpoint", args.resume)
+    writer = WRITERS[output_format](args.output, append=args.resume)
+    try:
+        stats = score(all_paths(), writer, checkpoint, args.workers, max(1, args.batch_size))
+    except KeyboardInterrupt:
+        print("Interrupted; rerun with --resume to continue", file=sys.stderr)
+        return 130
+    finally:
+        writer.close()
+        checkpoint.close()
+
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+Content-addressed prediction cache.
+
+Results are keyed by the SHA-256 of the raw upload bytes plus a fingerprint of the
+loaded model, so re-submitted images skip decoding, ELA and inference entirely while
+a model reload naturally invalidates everything computed by the previous model.
+
+There are two tiers: an in-memory LRU bounded by a byte budget (with optional TTL)
+and an optional SQLite file that survives restarts and is shared by workers. The disk
+tier may be shared by processes serving other model versions, so it is only ever
+pruned by age (TTL) and row count, never by fingerprint. Disk reads run in a thread
+(``lookup``) and disk writes in a dedicated write-behind thread, so the event loop
+never waits for SQLite.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+logger = logging.getLogger("veriframe.cache")
+
+
+def content_hash(data: bytes) -> str:
+    """SHA-256 hex digest of raw upload bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def result_namespace(fingerprint: str, runtime_info: Optional[dict] = None, working_size: int = 0,
+                     calibration=None) -> str:
+    """
+    Namespace of stored results: a model fingerprint plus every setting that changes
+    the scores it produces. Cache keys and near-duplicate index entries both use it,
+    so results computed under other settings are never served.
+
+    Args:
+        fingerprint: SHA-256 of the checkpoint.
+        runtime_info: Inference runtime description (see runtime.prepare_model).
+        working_size: ELA working size (0 = full resolution).
+        calibration: calibration.ScoreCalibration of the model, if any.
+    """
+    if runtime_info and not runtime_info["fallback"] and runtime_info["quantize"] != "none":
+        # Quantized models produce (slightly) different scores
+        fingerprint = f"{fingerprint}-{runtime_info['runtime']}-{runtime_info['quantize']}"
+    if working_size:
+        fingerprint = f"{fingerprint}-ws{working_size}"
+    if calibration is not None:
+        fingerprint = f"{fingerprint}-{calibration.tag()}"
+    return fingerprint
+
+
+class PredictionCache:
+    """
+    Two-tier LRU/TTL cache of prediction results.
+
+    Args:
+        max_bytes: Memory budget for cached results (serialized size). 0 disables the
+            memory tier.
+        ttl_seconds: Entries older than this are treated as misses. 0 means no expiry.
+        db_path: Optional SQLite file for the on-disk tier.
+        db_max_entries: Rows kept in the on-disk tier; the oldest are deleted beyond
+            this (0 = no limit).
+    """
+
+    # Seconds between prunes of expired / excess rows in the disk tier
+    PRUNE_INTERVAL = 60.0
+    # Disk writes waiting for the write-behind thread; further writes are dropped
+    WRITE_QUEUE_MAX = 10000
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 3600, db_path: Optional[str] = None,
+                 db_max_entries: int = 0):
+        self.max_bytes = max(0, int(max_bytes))
+        self.ttl_seconds = max(0.0, float(ttl_seconds))
+        self.db_path = db_path
+        self.db_max_entries = max(0, int(db_max_entries))
+        self._last_prune = 0.0
+        self._entries = OrderedDict()  # key -> (created_at, size, payload)
+        self._bytes = 0
+        self._lock = threading.Lock()  # Memory tier and _unwritten
+        self._db_lock = threading.Lock()  # SQLite connection
+        self._db = None
+        # Disk writes queued for the write-behind thread, and their rows by key (so
+        # lookups find them before they are committed)
+        self._writes: "queue.Queue" = queue.Queue()
+        self._unwritten = {}
+        self._writer: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.dropped_writes = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT, created_at REAL, payload TEXT)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS predictions_created_at ON predictions (created_at)")
+            self._db.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self._db is not None
+
+    @staticmethod
+    def make_key(digest: str, model_fingerprint: str) -> str:
+        return f"{model_fingerprint}:{digest}"
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def _get_memory(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created_at, size, payload = entry
+                if not self._expired(created_at):
+                    self._entries.move_to_end(key)
+                    return json.loads(payload)
+                del self._entries[key]
+                self._bytes -= size
+            return None
+
+    def _get_disk(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._unwritten.get(key)
+        if row is None:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT created_at, payload FROM predictions WHERE key = ?", (key,)
+                ).fetchone()
+        if row is None or self._expired(row[0]):
+            return None
+        with self._lock:
+            self._remember(key, row[0], row[1])
+        return json.loads(row[1])
+
+    def _count(self, result: Optional[dict], disk: bool = False) -> Optional[dict]:
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.disk_hits += disk
+        return result
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached result for ``key`` or None on a miss (blocks on the disk tier)."""
+        result = self._get_memory(key)
+        if result is not None or self._db is None:
+            return self._count(result)
+        return self._count(self._get_disk(key), disk=True)
+
+    async def lookup(self, key: str) -> Optional[dict]:
+        """``get`` for the event loop: the disk tier is read in a thread."""
+        result = self._get_memory(key)
+        if result is not None or self._db is None:
+            return self._count(result)
+        return self._count(await asyncio.to_thread(self._get_disk, key), disk=True)
+
+    def put(self, key: str, result: dict):
+        """
+        Store a result in both tiers. Only the memory tier is written here; the disk
+        row is written by the write-behind thread.
+        """
+        payload = json.dumps(result, separators=(",", ":"))
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, payload)
+            if self._db is None:
+                return
+            if self._writes.qsize() >= self.WRITE_QUEUE_MAX:
+                self.dropped_writes += 1
+                return
+            self._unwritten[key] = (created_at, payload)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_behind, name="cache-writer", daemon=True)
+                self._writer.start()
+        self._writes.put((key, created_at, payload))
+
+    def _write_behind(self):
+        """Write queued rows to the disk tier, one transaction per batch, until ``close``."""
+        while True:
+            rows = [self._writes.get()]
+            while not self._writes.empty() and len(rows) < 1000:
+                rows.append(self._writes.get_nowait())
+            stop = None in rows
+            rows = [row for row in rows if row is not None]
+            try:
+                with self._db_lock:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO predictions (key, fingerprint, created_at, payload) VALUES (?, ?, ?, ?)",
+                        [(key, key.split(":", 1)[0], created_at, payload) for key, created_at, payload in rows],
+                    )
+                    now = time.time()
+                    if now - self._last_prune >= self.PRUNE_INTERVAL:
+                        self._prune_disk(now)
+                    self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not write {len(rows)} results to the disk cache: {e}")
+            with self._lock:
+                for key, created_at, _ in rows:
+                    if self._unwritten.get(key, (None,))[0] == created_at:
+                        del self._unwritten[key]
+            if stop:
+                return
+
+    def close(self):
+        """Write the queued disk rows and stop the write-behind thread."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._writes.put(None)
+            writer.join()
+
+    def _prune_disk(self, now: float):
+        """Delete expired rows and the oldest rows beyond db_max_entries (_db_lock held)."""
+        self._last_prune = now
+        if self.ttl_seconds > 0:
+            self._db.execute("DELETE FROM predictions WHERE created_at < ?", (now - self.ttl_seconds,))
+        if self.db_max_entries:
+            excess = self._db.execute("SELECT COUNT(*) FROM predictions").fetchone()[0] - self.db_max_entries
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM predictions WHERE key IN (SELECT key FROM predictions ORDER BY created_at LIMIT ?)",
+                    (excess,),
+                )
+
+    def _remember(self, key: str, created_at: float, payload: str):
+        size = len(payload) + len(key)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (created_at, size, payload)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def invalidate(self, keep_fingerprints: Optional[Iterable[str]] = None):
+        """
+        Drop memory-tier entries from other model versions (all entries if no
+        fingerprint is kept).
+
+        The disk tier is left alone: other workers or deployments sharing it may still
+        serve those versions, and its rows age out by TTL and row count instead.
+        """
+        keep = set(keep_fingerprints or ())
+        with self._lock:
+            for key in [k for k in self._entries if k.split(":", 1)[0] not in keep]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "disk_tier": self.db_path is not None,
+            "disk_queue": self._writes.qsize(),
+            "dropped_writes": self.dropped_writes,
+        }
@@ -0,0 +1,245 @@
+"""
+Score calibration: ROC analysis, temperature scaling and decision thresholds.
+
+The model's softmax probabilities are not necessarily calibrated, and 0.5 is not
+necessarily the best operating point. ``evaluate.py`` scores a model version on a
+labeled set and fits:
+
+- a temperature ``T``: logits are divided by ``T`` before the softmax, which keeps the
+  ranking of images (and so the ROC curve and AUC) unchanged but makes the tampered
+  probability match observed frequencies (minimum negative log-likelihood);
+- a decision threshold on the calibrated tampered probability, chosen for an objective
+  (Youden's J, F1 or accuracy), optionally subject to a maximum false positive rate.
+
+Both are stored in a calibration file keyed by model fingerprint (the checkpoint's
+SHA-256), which the API loads at startup (``VERIFRAME_SCORE_CALIBRATION``). Versions
+without an entry keep temperature 1 and threshold 0.5.
+"""
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+OBJECTIVES = ("youden", "f1", "accuracy")
+
+# Search range of the temperature
+MIN_TEMPERATURE = 0.05
+MAX_TEMPERATURE = 20.0
+
+
+class ScoreCalibration:
+    """
+    Temperature and decision threshold of one model version.
+
+    Args:
+        temperature: Logits are divided by this before the softmax.
+        threshold: Images are predicted tampered when their (calibrated) tampered
+            probability is above this.
+        fingerprint: Fingerprint of the model the calibration was fitted for.
+        info: How the calibration was fitted (objective, metrics, sample counts).
+    """
+
+    def __init__(self, temperature: float = 1.0, threshold: float = 0.5, fingerprint: Optional[str] = None,
+                 info: Optional[dict] = None):
+        if not temperature > 0:
+            raise ValueError(f"Temperature must be positive, got {temperature}")
+        if not 0.0 <= threshold <= 1.0:
+            raise ValueError(f"Threshold must be between 0 and 1, got {threshold}")
+        self.temperature = float(temperature)
+        self.threshold = float(threshold)
+        self.fingerprint = fingerprint
+        self.info = info or {}
+
+    def tag(self) -> str:
+        """Short identifier of the parameters, for cache keys."""
+        return f"t{self.temperature:.6g}-th{self.threshold:.6g}"
+
+    def describe(self) -> dict:
+        return {"temperature": round(self.temperature, 4), "threshold": round(self.threshold, 4)}
+
+    def to_dict(self) -> dict:
+        return dict(self.info, temperature=self.temperature, threshold=self.threshold)
+
+
+def load_calibrations(path: str) -> Dict[str, ScoreCalibration]:
+    """Read a calibration file written by ``save_calibration``: fingerprint -> calibration."""
+    with open(path) as f:
+        data = json.load(f)
+    calibrations = {}
+    for fingerprint, entry in data.get("models", {}).items():
+        info = {k: v for k, v in entry.items() if k not in ("temperature", "threshold")}
+        calibrations[fingerprint] = ScoreCalibration(entry["temperature"], entry["threshold"], fingerprint, info)
+    return calibrations
+
+
+def save_calibration(path: str, calibration: ScoreCalibration):
+    """
+    Add (or replace) the entry of ``calibration.fingerprint`` in a calibration file,
+    keeping the entries of other models. The file is replaced atomically.
+    """
+    data = {"models": {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+    data.setdefault("models", {})[calibration.fingerprint] = calibration.to_dict()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def tampered_probability(logits: np.ndarray, temperature: float = 1.0) -> np.ndarray:
+    """
+    Softmax probability of class 1 (tampered) for (N, 2) logits scaled by
+    ``1 / temperature``, as the API computes it.
+    """
+    margin = (logits[:, 1] - logits[:, 0]) / temperature
+    # sigmoid(m) = (1 + tanh(m / 2)) / 2 without overflow for large margins
+    return 0.5 * (1.0 + np.tanh(margin / 2.0))
+
+
+def log_loss(labels: np.ndarray, logits: np.ndarray, temperature: float = 1.0) -> float:
+    """Mean negative log-likelihood of the labels under the temperature-scaled softmax."""
+    margin = (logits[:, 1] - logits[:, 0]) / temperature
+    signs = np.where(labels == 1, 1.0, -1.0)
+    return float(np.mean(np.logaddexp(0.0, -signs * margin)))
+
+
+def fit_temperature(labels: np.ndarray, logits: np.ndarray, iterations: int = 100) -> float:
+    """
+    Temperature minimizing the log loss (golden-section search over log T).
+
+    The log loss is convex in ``1 / T``, so it has a single minimum; perfectly
+    separable data pushes it to the lower bound of the search range.
+    """
+    ratio = (np.sqrt(5.0) - 1.0) / 2.0
+    lo, hi = np.log(MIN_TEMPERATURE), np.log(MAX_TEMPERATURE)
+    a, b = hi - ratio * (hi - lo), lo + ratio * (hi - lo)
+    fa, fb = log_loss(labels, logits, np.exp(a)), log_loss(labels, logits, np.exp(b))
+    for _ in range(iterations):
+        if fa < fb:
+            hi, b, fb = b, a, fa
+            a = hi - ratio * (hi - lo)
+            fa = log_loss(labels, logits, np.exp(a))
+        else:
+            lo, a, fa = a, b, fb
+            b = lo + ratio * (hi - lo)
+            fb = log_loss(labels, logits, np.exp(b))
+    return float(np.exp((lo + hi) / 2.0))
+
+
+def _check_labels(labels: np.ndarray):
+    positives = int(np.sum(labels == 1))
+    if positives == 0 or positives == len(labels):
+        raise ValueError("Both authentic and tampered images are needed")
+
+
+def roc_curve(labels: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    ROC curve of ``scores`` (higher = more likely tampered).
+
+    Returns:
+        (false positive rates, true positive rates, thresholds): point ``i`` predicts
+        tampered for scores >= ``thresholds[i]``; the first point (threshold inf)
+        predicts nothing tampered.
+    """
+    _check_labels(labels)
+    order = np.argsort(-scores, kind="stable")
+    scores, labels = scores[order], labels[order]
+    # Last position of every distinct score
+    ends = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tps = np.cumsum(labels == 1)[ends]
+    fps = ends + 1 - tps
+    fpr = np.r_[0.0, fps / fps[-1]]
+    tpr = np.r_[0.0, tps / tps[-1]]
+    return fpr, tpr, np.r_[np.inf, scores[ends]]
+
+
+def roc_auc(labels: np.ndarray, scores: np.ndarray) -> float:
+    """Area under the ROC curve (ties count half)."""
+    fpr, tpr, _ = roc_curve(labels, scores)
+    return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2.0))
+
+
+def confusion(labels: np.ndarray, probabilities: np.ndarray, threshold: float) -> dict:
+    """Counts and rates when images with probability above ``threshold`` are predicted tampered."""
+    predicted = probabilities > threshold
+    actual = labels == 1
+    tp = int(np.sum(predicted & actual))
+    fp = int(np.sum(predicted & ~actual))
+    fn = int(np.sum(~predicted & actual))
+    tn = int(np.sum(~predicted & ~actual))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return {
+        "threshold": round(float(threshold), 6),
+        "tp": tp, "fp": fp, "tn": tn, "fn": fn,
+        "accuracy": round((tp + tn) / len(labels), 4),
+        "precision": round(precision, 4),
+        "tpr": round(recall, 4),
+        "fpr": round(fp / (fp + tn) if fp + tn else 0.0, 4),
+        "f1": round(2 * precision * recall / (precision + recall) if precision + recall else 0.0, 4),
+    }
+
+
+def best_threshold(labels: np.ndarray, probabilities: np.ndarray, objective: str = "youden",
+                   max_fpr: Optional[float] = None) -> float:
+    """
+    Decision threshold maximizing ``objective`` over all distinct operating points.
+
+    Args:
+        labels: 0 (authentic) / 1 (tampered) per image.
+        probabilities: Tampered probability per image.
+        objective: "youden" (TPR - FPR), "f1" or "accuracy".
+        max_fpr: Only consider thresholds with at most this false positive rate.
+
+    Returns:
+        A threshold halfway between neighbouring probabilities, so that small
+        changes in scores do not flip the images it separates.
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective!r} (choose from {', '.join(OBJECTIVES)})")
+    fpr, tpr, thresholds = roc_curve(labels, probabilities)
+    positives = int(np.sum(labels == 1))
+    negatives = len(labels) - positives
+    tp, fp = tpr * positives, fpr * negatives
+
+    # Point i predicts tampered for p >= thresholds[i], i.e. p > cut between it and the
+    # next lower distinct probability; point 0 (nothing tampered) cuts at the maximum
+    distinct = thresholds[1:]
+    cuts = np.r_[distinct[0], (distinct[:-1] + distinct[1:]) / 2.0, distinct[-1] / 2.0]
+    if objective == "youden":
+        values = tpr - fpr
+    elif objective == "f1":
+        values = np.divide(2 * tp, 2 * tp + fp + (positives - tp), out=np.zeros_like(tp), where=tp > 0)
+    else:
+        values = (tp + negatives - fp) / len(labels)
+    if max_fpr is not None:
+        values = np.where(fpr <= max_fpr, values, -np.inf)
+    if distinct[-1] <= 0.0:
+        # Probabilities of exactly 0 cannot be predicted tampered with p > threshold
+        values[-1] = -np.inf
+    return float(np.clip(cuts[int(np.argmax(values))], 0.0, 1.0))
+
+
+def reliability(labels: np.ndarray, probabilities: np.ndarray, bins: int = 10) -> Tuple[float, list]:
+    """
+    Expected calibration error of the tampered probability over ``bins`` equal-width
+    bins, and the per-bin reliability table (mean probability vs. observed rate).
+    """
+    index = np.minimum((probabilities * bins).astype(int), bins - 1)
+    table, error = [], 0.0
+    for b in range(bins):
+        members = index == b
+        count = int(np.sum(members))
+        if not count:
+            continue
+        mean_probability = float(np.mean(probabilities[members]))
+        observed = float(np.mean(labels[members] == 1))
+        error += count / len(labels) * abs(mean_probability - observed)
+        table.append({
+            "bin": [b / bins, (b + 1) / bins], "count": count,
+            "mean_probability": round(mean_probability, 4), "observed_rate": round(observed, 4),
+        })
+    return float(error), table
@@ -0,0 +1,192 @@
+"""
+CPU-bound preprocessing run by the ELA worker pool.
+
+ELA worker processes are spawned and import only this module and what it needs
+(Pillow, NumPy, fast_ela, decoding, localization and the perceptual hashes), never
+``main``: no torch, FastAPI, model registry or caches. An idle worker costs tens of MB
+instead of the few hundred an import of the API costs.
+
+Workers cannot read the API's configuration, so the process owning the pool passes it
+to ``configure`` (the pool initializer); it applies to every function below. Functions
+are module-level so that they can be sent to worker processes.
+"""
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageChops, ImageEnhance
+
+import fast_ela
+import localization
+from decoding import open_image
+from near_duplicates import perceptual_hash
+
+# Preprocessing settings of this process (see main.ELA_WORKER_SETTINGS)
+settings = {
+    "impl": "fast",  # "fast" (fast_ela) or "reference" (apply_ela)
+    "working_size": 0,  # Longest side to downscale to before ELA (0 = full resolution)
+    "max_pixels": 100_000_000,  # Reject larger images (0 = no limit)
+    "perceptual_hash": "phash",
+    "ensemble_threads": 0,  # Threads per ensemble (0 = this process's share of the CPUs)
+    "pool_workers": 0,  # Processes in the pool (0 = ELA runs in threads of the API process)
+    "localize_max_side": 4096,
+    "localize_overlap": 0.5,
+    "localize_max_patches": 256,
+}
+
+
+def configure(overrides: dict):
+    """Set preprocessing settings (the pool initializer of ELA worker processes)."""
+    settings.update(overrides)
+
+
+def apply_ela(image, quality=90):
+    """
+    Apply Error Level Analysis (ELA) preprocessing to the image.
+    Matches the training pipeline exactly:
+    1. Save image to JPEG with specified quality
+    2. Reload the compressed JPEG
+    3. Calculate pixel-wise difference using ImageChops.difference
+    4. Amplify differences using ImageEnhance.Brightness
+    5. Resize to (224, 224)
+
+    Args:
+        image: PIL Image object (RGB)
+        quality: JPEG quality for recompression (default 90, matching training)
+
+    Returns:
+        ELA processed PIL Image resized to (224, 224)
+    """
+    # Save original image to temporary buffer as JPEG with specified quality
+    temp_buffer = io.BytesIO()
+    image.save(temp_buffer, format='JPEG', quality=quality)
+    temp_buffer.seek(0)
+
+    # Reload the compressed JPEG image
+    reloaded_image = Image.open(temp_buffer)
+
+    # Calculate pixel-wise difference between original and re-compressed image
+    # Using ImageChops.difference (matches training code)
+    diff_image = ImageChops.difference(image, reloaded_image)
+
+    # Amplify the differences to make artifacts more visible
+    # Using ImageEnhance.Brightness (matches training code)
+    enhancer = ImageEnhance.Brightness(diff_image)
+    ela_image = enhancer.enhance(10.0)  # Amplify by 10x (common value, adjust if needed)
+
+    # Resize to (224, 224) - matching training pipeline
+    ela_image = ela_image.resize((224, 224), Image.Resampling.LANCZOS)
+
+    return ela_image
+
+
+def compute_ela_array(image_bytes: bytes, working_size: Optional[int] = None, max_pixels: Optional[int] = None,
+                      qualities: Optional[tuple] = None) -> np.ndarray:
+    """
+    CPU-bound part of preprocessing: decode the upload and compute its ELA image.
+
+    Runs in an ELA worker process, so it only returns plain NumPy data and raises
+    ordinary exceptions (callers turn them into HTTP errors).
+
+    Args:
+        image_bytes: Raw image file contents
+        working_size: Longest side to downscale to before ELA (default: the configured one, 0 = full resolution)
+        max_pixels: Reject images with more pixels than this (default: the configured limit, 0 = no limit)
+        qualities: JPEG qualities for a multi-quality ELA ensemble (default: the single
+            training quality 90)
+
+    Returns a uint8 array of shape (224, 224, 3), or (len(qualities), 224, 224, 3)
+    when ``qualities`` is given.
+    """
+    return compute_ela_timed(image_bytes, working_size, max_pixels, qualities)[0]
+
+
+_ensemble_executor = None
+
+
+def ensemble_executor(qualities: int) -> Optional[ThreadPoolExecutor]:
+    """
+    Thread pool recompressing the qualities of an ELA ensemble concurrently, created
+    on first use in each (ELA worker) process. None when there is nothing to overlap.
+    """
+    global _ensemble_executor
+    threads = settings["ensemble_threads"]
+    if not threads:
+        cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        # Without worker processes ELA runs in a pool of one thread per CPU, which already fills them
+        threads = cpus // (settings["pool_workers"] or cpus)
+    if threads <= 1 or qualities <= 1:
+        return None
+    if _ensemble_executor is None:
+        _ensemble_executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="ela-ensemble")
+    return _ensemble_executor
+
+
+def compute_ela_timed(image_bytes: bytes, working_size: Optional[int] = None, max_pixels: Optional[int] = None,
+                      qualities: Optional[tuple] = None, perceptual: bool = False):
+    """
+    compute_ela_array that also reports how long decoding and ELA took, measured inside
+    the worker process, and optionally the perceptual hash of the decoded image.
+
+    Returns:
+        (ELA array, decode seconds, ELA seconds, perceptual hash or None)
+    """
+    start = time.perf_counter()
+    # Step 1: Load original image and convert to RGB (optionally at reduced size)
+    image = open_image(
+        image_bytes,
+        working_size=settings["working_size"] if working_size is None else working_size,
+        max_pixels=settings["max_pixels"] if max_pixels is None else max_pixels,
+    )
+    decoded = time.perf_counter()
+
+    # Step 2: Compute ELA (includes resize to 224x224)
+    fast = settings["impl"] == "fast"
+    if qualities:
+        # Every quality reuses the single decode above
+        if fast:
+            ela_array = fast_ela.ela_sweep(image, qualities, executor=ensemble_executor(len(qualities)))
+        else:
+            ela_array = np.stack([np.array(apply_ela(image, quality=q)) for q in qualities])
+    elif fast:
+        ela_array = fast_ela.ela_array(image, quality=90)  # Quality 90 matches training
+    else:
+        ela_array = np.array(apply_ela(image, quality=90))
+    elapsed = time.perf_counter() - decoded
+
+    # The hash reuses the decode above (a 32x32 thumbnail of the decoded image)
+    image_hash = perceptual_hash(image, settings["perceptual_hash"]) if perceptual else None
+    return ela_array, decoded - start, elapsed, image_hash
+
+
+def compute_patches(image_bytes: bytes):
+    """
+    Decode an upload and cut its ELA map into overlapping 224x224 patches for
+    localization (runs in an ELA worker process).
+
+    Returns:
+        (uint8 patches of shape (N, 224, 224, 3), grid plan, original (width, height));
+        the plan's scale is relative to the original image.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as header:
+        original_size = header.size
+    image = open_image(image_bytes, working_size=settings["localize_max_side"], max_pixels=settings["max_pixels"])
+    grid = localization.plan_grid(image.size, settings["localize_overlap"], settings["localize_max_patches"])
+    if grid["size"] != image.size:
+        image = image.resize(grid["size"], Image.Resampling.LANCZOS, reducing_gap=3.0)
+    grid["scale"] = grid["size"][0] / original_size[0]
+    return localization.ela_patches(image, grid, quality=90), grid, original_size
+
+
+def compute_frame_ela(frame: np.ndarray) -> np.ndarray:
+    """
+    ELA of one decoded video frame (uint8 RGB array), for the ELA worker pool.
+
+    Returns a uint8 array of shape (224, 224, 3).
+    """
+    if settings["impl"] == "fast":
+        return fast_ela.ela_array(frame, quality=90)  # Diffs the frame buffer in place of PIL
+    return np.array(apply_ela(Image.fromarray(frame), quality=90))
@@ -0,0 +1,323 @@
+"""
+Evaluation and calibration of model versions on a labeled image set.
+
+``extract`` computes the ELA features of a labeled set once, in a pool of worker
+processes, into a memory-mapped feature store (see feature_store.py). ``run`` scores
+the store with one or more model checkpoints, without recomputing ELA, and reports
+per model:
+
+- ROC curve and AUC;
+- calibration before and after temperature scaling (log loss, Brier score, expected
+  calibration error and a reliability table);
+- the best decision threshold for an objective, with its confusion counts, next to
+  those of the default threshold 0.5.
+
+The temperature and threshold are fitted on part of the set and measured on the held
+out rest (``--holdout``). With ``--calibration`` they are written to a calibration file
+that the API applies at startup (``VERIFRAME_SCORE_CALIBRATION``).
+
+Labels come from a CSV manifest with ``path`` and ``label`` columns (``0``/``1``,
+``authentic``/``tampered``, ``real``/``fake`` or CASIA-style ``au``/``tp``; relative
+paths are resolved against the manifest's directory) and/or from directories of
+authentic and tampered images.
+
+Usage (from the backend directory):
+    python evaluate.py extract --store features/ --manifest labels.csv
+    python evaluate.py extract --store features/ --authentic data/Au --tampered data/Tp --workers 8
+    python evaluate.py run --store features/ --model model.pth --calibration calibration.json
+    python evaluate.py run --store features/ --model a.pth --model b.pth --objective f1 --max-fpr 0.05 --output report.json
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+import calibration
+from bulk_score import iter_directory
+from feature_store import FeatureStore
+
+LABELS = {
+    "0": 0, "authentic": 0, "real": 0, "au": 0,
+    "1": 1, "tampered": 1, "fake": 1, "tp": 1,
+}
+
+
+def parse_label(value: str) -> int:
+    try:
+        return LABELS[value.strip().lower()]
+    except KeyError:
+        raise ValueError(f"Unknown label {value!r} (use 0/1, authentic/tampered, real/fake or au/tp)")
+
+
+def iter_labeled_manifest(manifest_path: str) -> Iterator[Tuple[str, int]]:
+    """Yield (path, label) from a CSV manifest with ``path`` and ``label`` columns."""
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, newline="") as f:
+        for row in csv.DictReader(f):
+            path = row["path"].strip()
+            if path:
+                yield (path if os.path.isabs(path) else os.path.join(base, path)), parse_label(row["label"])
+
+
+def _ela_worker(item: Tuple[str, int]) -> Tuple[str, int, Optional[np.ndarray], Optional[str]]:
+    """Read one image and compute its ELA array in a worker process."""
+    from ela_worker import compute_ela_array
+    path, label = item
+    try:
+        with open(path, "rb") as f:
+            return path, label, compute_ela_array(f.read()), None
+    except Exception as e:
+        return path, label, None, f"Error preprocessing image: {str(e)}"
+
+
+def ela_settings() -> dict:
+    """Preprocessing settings that change ELA features (a store only holds one combination)."""
+    import main
+    return {"ela_quality": 90, "working_size": main.ELA_WORKING_SIZE}
+
+
+def extract(items: Iterator[Tuple[str, int]], store: FeatureStore, workers: int,
+            report_every: float = 10.0) -> dict:
+    """
+    Compute and store the ELA features of every labeled image not yet in the store.
+
+    ELA runs in ``workers`` processes (in this process if 0). Images that cannot be
+    decoded are reported and left out.
+    """
+    done = set(store.paths())
+    todo = ((path, label) for path, label in items if path not in done)
+    pool = None
+    if workers > 0:
+        # Workers only import ela_worker, configured like the API's ELA workers
+        import ela_worker
+        from main import ELA_WORKER_SETTINGS
+        pool = multiprocessing.get_context("spawn").Pool(
+            workers, initializer=ela_worker.configure, initargs=(ELA_WORKER_SETTINGS,)
+        )
+        computed = pool.imap(_ela_worker, todo, chunksize=8)
+    else:
+        computed = map(_ela_worker, todo)
+
+    stats = {"extracted": 0, "failed": 0, "skipped": len(done)}
+    start = last_report = time.perf_counter()
+    try:
+        for path, label, ela_array, error in computed:
+            if error is not None:
+                print(f"{path}: {error}", file=sys.stderr)
+                stats["failed"] += 1
+            else:
+                store.append(path, label, ela_array)
+                stats["extracted"] += 1
+            now = time.perf_counter()
+            if now - last_report >= report_every:
+                count = stats["extracted"] + stats["failed"]
+                print(f"{count} images, {count / (now - start):.1f} images/sec", flush=True)
+                last_report = now
+    finally:
+        store.close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    stats["stored"] = len(store)
+    return stats
+
+
+def score_store(store: FeatureStore, model, batch_size: int) -> np.ndarray:
+    """Raw (N, 2) logits of ``model`` for every image in the store, in store order."""
+    import torch
+
+    from main import ela_arrays_to_batch
+
+    logits = np.empty((len(store), 2), dtype=np.float64)
+    if hasattr(model, "eval"):
+        model.eval()
+    with torch.no_grad():
+        for offset, rows in store.batches(batch_size):
+            outputs = model(ela_arrays_to_batch(rows))
+            logits[offset:offset + len(rows)] = outputs.float().cpu().numpy()
+    return logits
+
+
+def split(labels: np.ndarray, holdout: float, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Indices of the fitting and held-out parts, stratified by label so both parts keep
+    the class balance of the set.
+    """
+    rng = np.random.default_rng(seed)
+    fit, held = [], []
+    for label in (0, 1):
+        members = rng.permutation(np.flatnonzero(labels == label))
+        count = int(round(len(members) * holdout))
+        held.append(members[:count])
+        fit.append(members[count:])
+    return np.sort(np.concatenate(fit)), np.sort(np.concatenate(held))
+
+
+def measure(labels: np.ndarray, logits: np.ndarray, temperature: float, threshold: float, bins: int) -> dict:
+    """Ranking, calibration and decision metrics of one part of the set."""
+    raw = calibration.tampered_probability(logits)
+    calibrated = calibration.tampered_probability(logits, temperature)
+    fpr, tpr, thresholds = calibration.roc_curve(labels, raw)
+    # At most ~100 points of the curve, always including both ends
+    keep = np.unique(np.r_[np.linspace(0, len(fpr) - 1, min(len(fpr), 101)).astype(int), len(fpr) - 1])
+    ece_before, _ = calibration.reliability(labels, raw, bins)
+    ece_after, table = calibration.reliability(labels, calibrated, bins)
+    return {
+        "samples": len(labels),
+        "tampered": int(np.sum(labels == 1)),
+        "auc": round(calibration.roc_auc(labels, raw), 4),
+        "roc": {
+            "fpr": np.round(fpr[keep], 4).tolist(),
+            "tpr": np.round(tpr[keep], 4).tolist(),
+            "threshold": [None if np.isinf(t) else round(float(t), 6) for t in thresholds[keep]],
+        },
+        "uncalibrated": {
+            "log_loss": round(calibration.log_loss(labels, logits), 4),
+            "brier": round(float(np.mean((raw - labels) ** 2)), 4),
+            "ece": round(ece_before, 4),
+            "decision": calibration.confusion(labels, raw, 0.5),
+        },
+        "calibrated": {
+            "log_loss": round(calibration.log_loss(labels, logits, temperature), 4),
+            "brier": round(float(np.mean((calibrated - labels) ** 2)), 4),
+            "ece": round(ece_after, 4),
+            "decision": calibration.confusion(labels, calibrated, threshold),
+            "reliability": table,
+        },
+    }
+
+
+def evaluate_model(store: FeatureStore, model_path: str, args) -> Tuple[dict, calibration.ScoreCalibration]:
+    """Score the store with one checkpoint, fit its calibration and measure both parts."""
+    import main
+
+    model, fingerprint, runtime = main.build_model(model_path)
+    start = time.perf_counter()
+    logits = score_store(store, model, args.batch_size)
+    elapsed = time.perf_counter() - start
+
+    labels = store.labels()
+    fit, held = split(labels, args.holdout, args.seed)
+    temperature = calibration.fit_temperature(labels[fit], logits[fit])
+    threshold = calibration.best_threshold(
+        labels[fit], calibration.tampered_probability(logits[fit], temperature), args.objective, args.max_fpr
+    )
+    report = {
+        "model": model_path,
+        "fingerprint": fingerprint,
+        "runtime": runtime,
+        "inference_seconds": round(elapsed, 2),
+        "images_per_sec": round(len(labels) / elapsed, 1) if elapsed > 0 else None,
+        "temperature": round(temperature, 4),
+        "threshold": round(threshold, 6),
+        "fit": measure(labels[fit], logits[fit], temperature, threshold, args.bins),
+        "holdout": measure(labels[held], logits[held], temperature, threshold, args.bins) if len(held) else None,
+    }
+    # Metrics recorded with the calibration come from the held-out part when there is one
+    measured = report["holdout"] or report["fit"]
+    fitted = calibration.ScoreCalibration(temperature, threshold, fingerprint, {
+        "model": os.path.basename(model_path),
+        "objective": args.objective,
+        "max_fpr": args.max_fpr,
+        "ela_working_size": store.settings.get("working_size", 0),
+        "samples": {"fit": len(fit), "holdout": len(held)},
+        "auc": measured["auc"],
+        "ece": {"before": measured["uncalibrated"]["ece"], "after": measured["calibrated"]["ece"]},
+        "decision": measured["calibrated"]["decision"],
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    })
+    return report, fitted
+
+
+def print_summary(report: dict):
+    part = report["holdout"] or report["fit"]
+    name = "held-out" if report["holdout"] else "fitting (no holdout)"
+    before, after = part["uncalibrated"], part["calibrated"]
+    print(f"{report['model']} ({report['fingerprint'][:12]}), {name} set of {part['samples']} images:")
+    print(f"  AUC {part['auc']:.4f}, temperature {report['temperature']:.3f}, threshold {report['threshold']:.4f}")
+    print(f"  log loss {before['log_loss']:.4f} -> {after['log_loss']:.4f}, ECE {before['ece']:.4f} -> {after['ece']:.4f}")
+    for label, decision in (("threshold 0.5", before["decision"]), ("tuned", after["decision"])):
+        print(f"  {label:<14} accuracy {decision['accuracy']:.4f}, TPR {decision['tpr']:.4f}, "
+              f"FPR {decision['fpr']:.4f}, F1 {decision['f1']:.4f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = commands.add_parser("extract", help="Compute ELA features of a labeled set into a store")
+    extract_parser.add_argument("--store", required=True, help="Feature store directory (created if missing)")
+    extract_parser.add_argument("--manifest", action="append", default=[], help="CSV with path and label columns (repeatable)")
+    extract_parser.add_argument("--authentic", action="append", default=[], help="Directory of authentic images (repeatable)")
+    extract_parser.add_argument("--tampered", action="append", default=[], help="Directory of tampered images (repeatable)")
+    extract_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ELA worker processes (0 = in-process)")
+    extract_parser.add_argument("--shard-size", type=int, default=1024, help="Images per shard file (new stores)")
+
+    run_parser = commands.add_parser("run", help="Score a feature store with model checkpoints and fit calibrations")
+    run_parser.add_argument("--store", required=True, help="Feature store directory")
+    run_parser.add_argument("--model", action="append", default=[], help="Model checkpoint (repeatable; defaults to backend/model.pth)")
+    run_parser.add_argument("--batch-size", type=int, default=64, help="Images per forward pass")
+    run_parser.add_argument("--objective", choices=calibration.OBJECTIVES, default="youden", help="Threshold objective")
+    run_parser.add_argument("--max-fpr", type=float, help="Only consider thresholds with at most this false positive rate")
+    run_parser.add_argument("--holdout", type=float, default=0.3, help="Share of the set held out to measure the fitted calibration")
+    run_parser.add_argument("--seed", type=int, default=0, help="Seed of the holdout split")
+    run_parser.add_argument("--bins", type=int, default=10, help="Bins of the expected calibration error")
+    run_parser.add_argument("--calibration", help="Calibration file to add the fitted models to (for VERIFRAME_SCORE_CALIBRATION)")
+    run_parser.add_argument("--output", help="Write the full report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.command == "extract":
+        if not (args.manifest or args.authentic or args.tampered):
+            parser.error("give at least one --manifest, --authentic or --tampered")
+
+        def all_items():
+            for manifest in args.manifest:
+                yield from iter_labeled_manifest(manifest)
+            for label, roots in ((0, args.authentic), (1, args.tampered)):
+                for root in roots:
+                    yield from ((path, label) for path in iter_directory(root))
+
+        store = FeatureStore(args.store, ela_settings(), shard_size=max(1, args.shard_size))
+        try:
+            stats = extract(all_items(), store, args.workers)
+        except KeyboardInterrupt:
+            print("Interrupted; rerun to continue where extraction stopped", file=sys.stderr)
+            return 130
+        print(json.dumps(stats))
+        return 0
+
+    import main as app_main
+
+    store = FeatureStore(args.store)
+    if not 0.0 <= args.holdout < 1.0:
+        parser.error("--holdout must be at least 0 and below 1")
+    if store.settings.get("working_size", 0) != app_main.ELA_WORKING_SIZE:
+        print(f"Warning: features were computed with working size {store.settings.get('working_size', 0)}, "
+              f"the API is configured with {app_main.ELA_WORKING_SIZE}", file=sys.stderr)
+    reports = []
+    for model_path in args.model or [app_main.MODEL_PATH]:
+        try:
+            report, fitted = evaluate_model(store, model_path, args)
+        except ValueError as e:
+            raise SystemExit(f"Cannot evaluate {model_path}: {e}")
+        print_summary(report)
+        reports.append(report)
+        if args.calibration:
+            calibration.save_calibration(args.calibration, fitted)
+    if args.calibration:
+        print(f"Calibration written to {args.calibration}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"store": args.store, "settings": store.settings, "models": reports}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
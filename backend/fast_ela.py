@@ -0,0 +1,189 @@
+"""
+Fast Error Level Analysis.
+
+Produces the same output as ``ela_worker.apply_ela`` followed by ``transforms.ToTensor()``
+with fewer full-resolution passes and copies:
+
+- the ``ImageEnhance.Brightness`` blend (which allocates a black image and blends in
+  floating point) is replaced by a single 256-entry lookup table applied to the
+  difference image;
+- images that are already NumPy arrays (e.g. decoded video frames) are diffed and
+  amplified in place on uint8 buffers instead of round-tripping through PIL;
+- the final conversion writes straight into a (optionally preallocated) float tensor
+  instead of going through ToTensor's intermediate copies;
+- ``ela_sweep`` computes the ELA images for several JPEG qualities from one decoded
+  source, running the recompressions concurrently (Pillow releases the GIL while
+  encoding, decoding and resizing) and writing into one preallocated output array.
+
+The output is bit-identical to the reference; ``python -m benchmarks.ela_parity``
+checks this over a matrix of sizes, formats and qualities.
+"""
+import io
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Sequence, Union
+
+import numpy as np
+from PIL import Image, ImageChops
+
+if TYPE_CHECKING:
+    import torch
+
+ELA_SIZE = (224, 224)
+
+
+@lru_cache(maxsize=8)
+def brightness_lut(factor: float = 10.0) -> np.ndarray:
+    """
+    Lookup table reproducing ``ImageEnhance.Brightness(img).enhance(factor)`` on uint8 data.
+
+    Brightness blends with a black image, i.e. ``clip(int(value * factor), 0, 255)``
+    per channel, which for 8-bit input is exactly a 256-entry table.
+    """
+    values = np.arange(256, dtype=np.float32) * np.float32(factor)
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+@lru_cache(maxsize=8)
+def _point_table(factor: float) -> list:
+    # Image.point expects one table per band
+    return brightness_lut(factor).tolist() * 3
+
+
+def ela_difference(original: np.ndarray, recompressed: np.ndarray, factor: float = 10.0) -> np.ndarray:
+    """
+    Amplified absolute difference of two uint8 arrays, computed in place.
+
+    ``original`` is used as scratch space and must be a writable array the caller owns.
+
+    Returns the amplified difference (a new uint8 array of the same shape).
+    """
+    diff = np.maximum(original, recompressed)
+    np.minimum(original, recompressed, out=original)
+    np.subtract(diff, original, out=diff)
+
+    if float(factor).is_integer() and factor >= 1:
+        # Saturating integer multiply: values above 255 // factor become 255, the rest
+        # are multiplied exactly. Much cheaper than a fancy-indexed table lookup.
+        saturated = original.view(np.bool_)
+        np.greater(diff, 255 // int(factor), out=saturated)
+        np.multiply(diff, np.uint8(factor), out=diff)
+        np.negative(original, out=original)  # True (1) -> 255, False -> 0
+        np.bitwise_or(diff, original, out=diff)
+    else:
+        np.take(brightness_lut(float(factor)), diff, out=diff)
+    return diff
+
+
+def ela_full(image: Union[Image.Image, np.ndarray], quality: int = 90, brightness: float = 10.0) -> Image.Image:
+    """
+    Compute the full-resolution (not yet resized) amplified ELA image.
+    """
+    source = Image.fromarray(image) if isinstance(image, np.ndarray) else image
+    buffer = io.BytesIO()
+    source.save(buffer, format='JPEG', quality=quality)
+    buffer.seek(0)
+    reloaded = Image.open(buffer)
+    if reloaded.mode != 'RGB':
+        reloaded = reloaded.convert('RGB')
+
+    if isinstance(image, np.ndarray):
+        diff = ela_difference(np.array(image), np.asarray(reloaded), brightness)
+        return Image.fromarray(diff)
+
+    # For PIL input, diffing in PIL avoids two full-resolution array conversions
+    return ImageChops.difference(image, reloaded).point(_point_table(float(brightness)))
+
+
+def ela_array(image: Union[Image.Image, np.ndarray], quality: int = 90, brightness: float = 10.0) -> np.ndarray:
+    """
+    Compute the ELA image of an RGB image.
+
+    Args:
+        image: PIL Image object (RGB) or uint8 array of shape (H, W, 3)
+        quality: JPEG quality for recompression (default 90, matching training)
+        brightness: Amplification factor (default 10.0, matching training)
+
+    Returns:
+        uint8 array of shape (224, 224, 3), identical to ``np.array(apply_ela(image))``.
+    """
+    return np.array(ela_full(image, quality, brightness).resize(ELA_SIZE, Image.Resampling.LANCZOS))
+
+
+_buffers = threading.local()
+
+
+def _ela_into(source: Image.Image, quality: int, brightness: float, out: np.ndarray):
+    """
+    Write the (224, 224, 3) ELA image of ``source`` at ``quality`` into ``out``.
+
+    The JPEG buffer is reused across calls in the same thread.
+    """
+    buffer = getattr(_buffers, "jpeg", None)
+    if buffer is None:
+        buffer = _buffers.jpeg = io.BytesIO()
+    buffer.seek(0)
+    buffer.truncate()
+    source.save(buffer, format='JPEG', quality=quality)
+    buffer.seek(0)
+    reloaded = Image.open(buffer)
+    if reloaded.mode != 'RGB':
+        reloaded = reloaded.convert('RGB')
+    ela = ImageChops.difference(source, reloaded).point(_point_table(float(brightness)))
+    out[...] = np.asarray(ela.resize(ELA_SIZE, Image.Resampling.LANCZOS))
+
+
+def ela_sweep(
+    image: Union[Image.Image, np.ndarray],
+    qualities: Sequence[int],
+    brightness: float = 10.0,
+    executor=None,
+) -> np.ndarray:
+    """
+    Compute the ELA images of one RGB image for several JPEG qualities.
+
+    The source is decoded and converted once for all recompressions; with an
+    ``executor`` they run concurrently.
+
+    Args:
+        image: PIL Image object (RGB) or uint8 array of shape (H, W, 3)
+        qualities: JPEG qualities to recompress at
+        brightness: Amplification factor (default 10.0, matching training)
+        executor: Optional ``concurrent.futures`` executor for the recompressions
+
+    Returns:
+        uint8 array of shape (len(qualities), 224, 224, 3); row ``i`` is identical to
+        ``ela_array(image, qualities[i], brightness)``.
+    """
+    source = Image.fromarray(image) if isinstance(image, np.ndarray) else image
+    source.load()
+    out = np.empty((len(qualities), ELA_SIZE[1], ELA_SIZE[0], 3), dtype=np.uint8)
+    if executor is None or len(qualities) == 1:
+        for row, quality in zip(out, qualities):
+            _ela_into(source, quality, brightness, row)
+    else:
+        # Image.save stores its options on the image object, so concurrent saves each
+        # need their own image (a flat pixel copy, cheap next to the JPEG round trip)
+        futures = [
+            executor.submit(_ela_into, source if i == 0 else source.copy(), quality, brightness, row)
+            for i, (row, quality) in enumerate(zip(out, qualities))
+        ]
+        for future in futures:
+            future.result()
+    return out
+
+
+def to_tensor(ela: np.ndarray, out: Optional["torch.Tensor"] = None) -> "torch.Tensor":
+    """
+    Convert a (224, 224, 3) uint8 ELA array to a (3, 224, 224) float tensor in [0, 1].
+
+    Matches ``transforms.ToTensor()`` bit for bit. If ``out`` is given (for example a
+    row of a preallocated batch tensor) the result is written into it. torch is only
+    imported here, so that ELA worker processes never load it.
+    """
+    import torch
+    source = torch.from_numpy(np.ascontiguousarray(ela)).permute(2, 0, 1)
+    if out is None:
+        out = torch.empty(source.shape, dtype=torch.float32)
+    out.copy_(source)
+    return out.div_(255)
@@ -0,0 +1,129 @@
+"""
+On-disk store of ELA features for evaluation runs.
+
+Decoding and ELA dominate the cost of scoring an image, but their output does not
+depend on the model. ``FeatureStore`` keeps the 224x224 ELA arrays of a labeled set in
+shards of NumPy ``.npy`` files, so every later evaluation (of any model version, any
+runtime) memory-maps them and only runs the forward passes. The store is a directory:
+
+    store.json          ELA settings the features were computed with
+    shard-00000.npy     uint8 (shard_size, 224, 224, 3) ELA arrays
+    shard-00000.json    path and label of every row written to the shard
+    ...
+
+Rows are written straight into the memory-mapped shard. A shard counts once its
+``.json`` record exists, so an interrupted extraction loses at most the shard it was
+writing, and extracting into an existing store skips images it already holds.
+"""
+import json
+import os
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+FEATURE_SHAPE = (224, 224, 3)
+
+
+def _write_json(path: str, obj):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+class FeatureStore:
+    """
+    A directory of ELA feature shards.
+
+    Args:
+        path: Store directory.
+        settings: ELA settings of the features written (e.g. working size). Creates the
+            store if it does not exist; an existing store must have been written with
+            the same settings. None opens an existing store read-only.
+        shard_size: Rows per shard file.
+
+    Raises:
+        FileNotFoundError: If ``settings`` is None and there is no store at ``path``.
+        ValueError: If the store was written with different settings.
+    """
+
+    def __init__(self, path: str, settings: Optional[dict] = None, shard_size: int = 1024):
+        self.path = path
+        meta_path = os.path.join(path, "store.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if settings is not None and meta["settings"] != settings:
+                raise ValueError(f"{path} holds features computed with {meta['settings']}, not {settings}")
+        elif settings is None:
+            raise FileNotFoundError(f"No feature store at {path}")
+        else:
+            os.makedirs(path, exist_ok=True)
+            meta = {"settings": settings, "shard_size": shard_size}
+            _write_json(meta_path, meta)
+        self.settings = meta["settings"]
+        self.shard_size = meta["shard_size"]
+
+        self._records = []
+        while os.path.exists(self._shard_path(len(self._records), ".json")):
+            with open(self._shard_path(len(self._records), ".json")) as f:
+                self._records.append(json.load(f))
+        self._writing = None
+        self._rows = []
+
+    def _shard_path(self, shard: int, suffix: str) -> str:
+        return os.path.join(self.path, f"shard-{shard:05d}{suffix}")
+
+    def __len__(self) -> int:
+        return sum(len(r["paths"]) for r in self._records)
+
+    def paths(self) -> List[str]:
+        return [p for r in self._records for p in r["paths"]]
+
+    def labels(self) -> np.ndarray:
+        return np.array([label for r in self._records for label in r["labels"]], dtype=np.int64)
+
+    def batches(self, batch_size: int) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Yield (offset of the first row, rows) over the whole store; rows are
+        copy-on-write views of the memory-mapped shards (the files are never modified),
+        never more than ``batch_size`` of them.
+        """
+        offset = 0
+        for shard, record in enumerate(self._records):
+            count = len(record["paths"])
+            features = np.load(self._shard_path(shard, ".npy"), mmap_mode="c")
+            for start in range(0, count, batch_size):
+                rows = features[start:min(start + batch_size, count)]
+                yield offset + start, rows
+            offset += count
+            del features
+
+    def append(self, path: str, label: int, ela_array: np.ndarray):
+        """Add one image's ELA array; committed when its shard is full or on ``flush``."""
+        if ela_array.shape != FEATURE_SHAPE:
+            raise ValueError(f"ELA array has shape {ela_array.shape}, expected {FEATURE_SHAPE}")
+        if self._writing is None:
+            self._writing = np.lib.format.open_memmap(
+                self._shard_path(len(self._records), ".npy"), mode="w+", dtype=np.uint8,
+                shape=(self.shard_size,) + FEATURE_SHAPE,
+            )
+        self._writing[len(self._rows)] = ela_array
+        self._rows.append((path, int(label)))
+        if len(self._rows) == self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Commit the shard being written (possibly partly filled); later rows start a new one."""
+        if self._writing is None:
+            return
+        self._writing.flush()
+        self._writing = None
+        if self._rows:
+            record = {"paths": [p for p, _ in self._rows], "labels": [label for _, label in self._rows]}
+            _write_json(self._shard_path(len(self._records), ".json"), record)
+            self._records.append(record)
+        self._rows = []
+
+    def close(self):
+        self.flush()
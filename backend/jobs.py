@@ -0,0 +1,485 @@
+"""
+Asynchronous scoring jobs.
+
+Large submissions are stored as jobs in a local SQLite file and scored in the
+background, so clients do not hold an HTTP connection open for the whole run: they
+submit, get a job id back immediately and poll (or long-poll) for the results.
+
+Scheduling happens in SQLite, one claim of up to ``claim_size`` images at a time:
+
+- higher priority jobs are served first;
+- within a priority, the client served least recently goes next (round robin), so a
+  client with one huge job and a client with many small ones progress at the same
+  pace;
+- within a client, jobs are served in submission order.
+
+Claims record the process that owns them. Images claimed by a process that no longer
+exists (crash, restart, killed worker) are put back in the queue, so jobs survive
+restarts and several API workers can share one job file.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger("veriframe.jobs")
+
+PRIORITIES = {"low": 0, "normal": 1, "high": 2}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+TERMINAL_STATUSES = ("completed", "cancelled")
+# Attempts at recording the outcome of a claim before putting it back in the queue
+COMPLETE_ATTEMPTS = 3
+
+
+class ClaimDeferred(Exception):
+    """Raised by a claim's scoring coroutine when it cannot run now (e.g. the pipeline is
+    full); the claimed images go back in the queue."""
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY, client TEXT, priority INTEGER, status TEXT, model_version TEXT, options TEXT,
+    total INTEGER, pending INTEGER, running INTEGER, succeeded INTEGER, failed INTEGER,
+    created_at REAL, started_at REAL, finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_runnable ON jobs (pending, priority, created_at);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT, idx INTEGER, filename TEXT, data BLOB, state TEXT, owner INTEGER, claimed_at REAL,
+    result TEXT, error TEXT, PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS items_running ON items (state, owner);
+CREATE TABLE IF NOT EXISTS clients (client TEXT PRIMARY KEY, served INTEGER);
+"""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    SQLite-backed job queue. Thread-safe; several processes may share one file.
+
+    Args:
+        db_path: SQLite file holding jobs, their images and results.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction that takes the database lock up front (BEGIN IMMEDIATE)."""
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self._db
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def submit(self, client: str, priority: int, items: list, model_version: Optional[str] = None,
+               options: Optional[dict] = None) -> str:
+        """
+        Queue a job.
+
+        Args:
+            client: Client identity used for fair scheduling
+            priority: One of PRIORITIES' values (higher is served first)
+            items: (filename, image bytes) pairs
+            model_version: Model version to score with (None = the active version)
+            options: Scoring options stored with the job (e.g. ELA qualities)
+
+        Returns:
+            The job id.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            db.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, 0, 0, 0, ?, NULL, NULL)",
+                (job_id, client, priority, model_version, json.dumps(options or {}), len(items), len(items), now),
+            )
+            db.executemany(
+                "INSERT INTO items (job_id, idx, filename, data, state) VALUES (?, ?, ?, ?, 'queued')",
+                ((job_id, i, name, data) for i, (name, data) in enumerate(items)),
+            )
+            db.execute("INSERT OR IGNORE INTO clients VALUES (?, 0)", (client,))
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Status of a job, or None if it does not exist."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, client, priority, status, model_version, options, total, pending, running, succeeded,"
+                " failed, created_at, started_at, finished_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        (job_id, client, priority, status, model_version, options, total, pending, running, succeeded,
+         failed, created_at, started_at, finished_at) = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "client": client,
+            "priority": PRIORITY_NAMES.get(priority, priority),
+            "model_version": model_version,
+            "options": json.loads(options),
+            "total": total,
+            "pending": pending,
+            "running": running,
+            "succeeded": succeeded,
+            "failed": failed,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+        }
+
+    def results(self, job_id: str) -> list:
+        """Per-image entries in submission order: filename plus "result" or "error" once scored."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT filename, state, result, error FROM items WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+        entries = []
+        for filename, state, result, error in rows:
+            if state == "done":
+                entries.append({"filename": filename, "result": json.loads(result)})
+            elif state == "failed":
+                entries.append({"filename": filename, "error": error})
+            else:
+                entries.append({"filename": filename, "status": state})
+        return entries
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job: images not yet claimed are dropped, images being scored finish.
+        Returns False if the job does not exist.
+        """
+        with self._lock, self._transaction() as db:
+            if db.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone() is None:
+                return False
+            db.execute("UPDATE items SET state = 'cancelled', data = NULL WHERE job_id = ? AND state = 'queued'",
+                       (job_id,))
+            db.execute(
+                "UPDATE jobs SET status = 'cancelled', pending = 0, finished_at = ? WHERE id = ? AND status NOT IN (?, ?)",
+                (time.time(), job_id) + TERMINAL_STATUSES,
+            )
+        return True
+
+    def claim(self, owner: int, limit: int) -> Optional[dict]:
+        """
+        Claim the next images to score for process ``owner`` (see the module docstring
+        for the order).
+
+        Returns:
+            None if nothing is queued, else {"job": job id, "model_version", "options",
+            "items": [(index, filename, image bytes), ...]} with at most ``limit`` items,
+            all from one job.
+        """
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            row = db.execute(
+                "SELECT j.id, j.client, j.model_version, j.options FROM jobs j JOIN clients c ON c.client = j.client"
+                " WHERE j.pending > 0 ORDER BY j.priority DESC, c.served ASC, j.created_at ASC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, client, model_version, options = row
+            items = db.execute(
+                "SELECT idx, filename, data FROM items WHERE job_id = ? AND state = 'queued' ORDER BY idx LIMIT ?",
+                (job_id, limit),
+            ).fetchall()
+            db.execute(
+                f"UPDATE items SET state = 'running', owner = ?, claimed_at = ? WHERE job_id = ? AND idx IN"
+                f" ({','.join('?' * len(items))})",
+                (owner, now, job_id, *(idx for idx, _, _ in items)),
+            )
+            db.execute(
+                "UPDATE jobs SET status = 'running', pending = pending - ?, running = running + ?,"
+                " started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (len(items), len(items), now, job_id),
+            )
+            db.execute("UPDATE clients SET served = (SELECT MAX(served) FROM clients) + 1 WHERE client = ?", (client,))
+        return {
+            "job": job_id,
+            "model_version": model_version,
+            "options": json.loads(options),
+            "items": [(idx, filename, bytes(data)) for idx, filename, data in items],
+        }
+
+    def complete(self, job_id: str, outcomes: list):
+        """
+        Record the outcome of claimed images and finish the job when none are left.
+
+        Args:
+            outcomes: (index, result dict or None, error message or None) triples
+        """
+        now = time.time()
+        with self._lock, self._transaction() as db:
+            succeeded = failed = 0
+            for idx, result, error in outcomes:
+                updated = db.execute(
+                    "UPDATE items SET state = ?, result = ?, error = ?, data = NULL"
+                    " WHERE job_id = ? AND idx = ? AND state = 'running'",
+                    ("failed" if error is not None else "done",
+                     json.dumps(result, separators=(",", ":")) if error is None else None,
+                     error, job_id, idx),
+                ).rowcount
+                if updated:
+                    succeeded += error is None
+                    failed += error is not None
+            db.execute(
+                "UPDATE jobs SET running = running - ?, succeeded = succeeded + ?, failed = failed + ? WHERE id = ?",
+                (succeeded + failed, succeeded, failed, job_id),
+            )
+            db.execute(
+                "UPDATE jobs SET status = 'completed', finished_at = ?"
+                " WHERE id = ? AND status = 'running' AND pending = 0 AND running = 0",
+                (now, job_id),
+            )
+
+    def requeue_orphans(self, include_self: bool = False) -> int:
+        """
+        Put images claimed by processes that no longer exist back in the queue (images
+        of cancelled jobs are dropped instead).
+
+        Args:
+            include_self: Also requeue claims recorded under this process's pid, which
+                are left over from an earlier process with the same pid when called
+                before this process claims anything.
+        """
+        with self._lock, self._transaction() as db:
+            owners = [owner for (owner,) in db.execute("SELECT DISTINCT owner FROM items WHERE state = 'running'")]
+            dead = [owner for owner in owners
+                    if (owner == os.getpid() and include_self) or (owner != os.getpid() and not _pid_alive(owner))]
+            requeued = 0
+            for owner in dead:
+                jobs = db.execute("SELECT DISTINCT job_id FROM items WHERE state = 'running' AND owner = ?", (owner,))
+                for (job_id,) in jobs.fetchall():
+                    requeued += self._requeue(db, job_id, owner)
+        return requeued
+
+    def release(self, job_id: str, owner: int, indexes: list) -> int:
+        """
+        Put claimed images that could not be completed back in the queue (images of
+        cancelled jobs are dropped instead). Returns the number requeued.
+        """
+        with self._lock, self._transaction() as db:
+            return self._requeue(db, job_id, owner, indexes)
+
+    @staticmethod
+    def _requeue(db, job_id: str, owner: int, indexes: Optional[list] = None) -> int:
+        """Requeue the running items of ``owner`` in a job (only ``indexes`` if given)."""
+        row = db.execute("SELECT status = 'cancelled' FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return 0
+        cancelled = row[0]
+        selected = "" if indexes is None else f" AND idx IN ({','.join('?' * len(indexes))})"
+        count = db.execute(
+            "UPDATE items SET state = ?, owner = NULL, data = CASE WHEN ? THEN NULL ELSE data END"
+            " WHERE job_id = ? AND state = 'running' AND owner = ?" + selected,
+            ("cancelled" if cancelled else "queued", cancelled, job_id, owner, *(indexes or ())),
+        ).rowcount
+        db.execute("UPDATE jobs SET running = running - ?, pending = pending + ? WHERE id = ?",
+                   (count, 0 if cancelled else count, job_id))
+        return 0 if cancelled else count
+
+    def purge(self, max_age_seconds: float) -> int:
+        """Delete jobs that finished more than ``max_age_seconds`` ago. Returns the number deleted."""
+        cutoff = time.time() - max_age_seconds
+        with self._lock, self._transaction() as db:
+            db.execute("DELETE FROM items WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)", (cutoff,))
+            return db.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,)).rowcount
+
+    def active_jobs(self, client: str) -> int:
+        """Number of unfinished jobs of a client."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE client = ? AND status IN ('queued', 'running')", (client,)
+            ).fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            by_status = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            pending, running = self._db.execute(
+                "SELECT COALESCE(SUM(pending), 0), COALESCE(SUM(running), 0) FROM jobs"
+            ).fetchone()
+        return {"jobs": by_status, "pending_items": pending, "running_items": running}
+
+
+class JobWorkers:
+    """
+    Background tasks that claim and score queued images.
+
+    Args:
+        store: The job store.
+        process: Coroutine scoring one claim (as returned by ``JobStore.claim``) and
+            returning (index, result or None, error or None) triples; it raises
+            ClaimDeferred to put the claim back in the queue.
+        workers: Number of claims scored concurrently.
+        claim_size: Maximum images per claim.
+        can_run: Admission check; workers only claim new images while it returns True
+            (e.g. while interactive traffic leaves room).
+        poll_interval: Seconds between checks for work submitted by other processes.
+        max_age_seconds: Finished jobs are deleted after this long (0 = kept forever).
+    """
+
+    def __init__(self, store: JobStore, process: Callable[[dict], Awaitable[list]], workers: int = 2,
+                 claim_size: int = 8, can_run: Callable[[], bool] = lambda: True, poll_interval: float = 1.0,
+                 max_age_seconds: float = 86400):
+        self.store = store
+        self.process = process
+        self.workers = max(1, int(workers))
+        self.claim_size = max(1, int(claim_size))
+        self.can_run = can_run
+        self.poll_interval = poll_interval
+        self.max_age_seconds = max_age_seconds
+        self.scored = 0
+        self._tasks = []
+        # (job id, item indexes) of claims that could be neither completed nor requeued
+        self._unreleased = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._progress: Optional[asyncio.Event] = None
+
+    async def start(self):
+        """Requeue orphaned claims and start the worker tasks."""
+        requeued = await asyncio.to_thread(self.store.requeue_orphans, True)
+        if requeued:
+            logger.info(f"Requeued {requeued} images of interrupted jobs")
+        self._wakeup, self._progress = asyncio.Event(), asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+
+    async def shutdown(self):
+        """Stop the workers. Images they were scoring are requeued on the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers (call after submitting a job)."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """
+        Long-poll: return the job's status once it is finished or ``timeout`` seconds
+        have passed, whichever comes first (None if the job does not exist).
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in TERMINAL_STATUSES or remaining <= 0:
+                return job
+            # Woken early by local progress; jobs scored by other processes are seen
+            # at the next poll
+            progress = self._progress or asyncio.Event()
+            try:
+                await asyncio.wait_for(progress.wait(), min(remaining, self.poll_interval))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self):
+        owner = os.getpid()
+        while True:
+            if not self.can_run():
+                await asyncio.sleep(0.05)
+                continue
+            self._wakeup.clear()
+            try:
+                claim = await asyncio.to_thread(self.store.claim, owner, self.claim_size)
+            except Exception as e:
+                logger.warning(f"Could not claim job items: {e}")
+                claim = None
+            if claim is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                outcomes = await self.process(claim)
+            except ClaimDeferred:
+                indexes = [idx for idx, _, _ in claim["items"]]
+                try:
+                    await asyncio.to_thread(self.store.release, claim["job"], owner, indexes)
+                except Exception as e:
+                    logger.warning(f"Could not requeue deferred images of job {claim['job']}, retrying later: {e}")
+                    self._unreleased.append((claim["job"], indexes))
+                await asyncio.sleep(self.poll_interval)
+                continue
+            except Exception as e:
+                logger.error(f"Error scoring job {claim['job']}: {e}")
+                outcomes = [(idx, None, f"Error during prediction: {str(getattr(e, 'detail', e))}")
+                            for idx, _, _ in claim["items"]]
+            if await self._complete(claim, outcomes):
+                self.scored += len(outcomes)
+            # Release long-polls waiting on this process
+            self._progress.set()
+            self._progress = asyncio.Event()
+
+    async def _complete(self, claim: dict, outcomes: list) -> bool:
+        """
+        Record the outcomes of a claim, retrying transient failures (e.g. the database
+        staying locked). If they cannot be recorded the claim is put back in the queue,
+        or, failing that too, left for ``_maintain`` to requeue. Never raises.
+        """
+        for attempt in range(COMPLETE_ATTEMPTS):
+            try:
+                await asyncio.to_thread(self.store.complete, claim["job"], outcomes)
+                return True
+            except Exception as e:
+                logger.warning(f"Could not record results of job {claim['job']} "
+                               f"(attempt {attempt + 1} of {COMPLETE_ATTEMPTS}): {e}")
+            if attempt + 1 < COMPLETE_ATTEMPTS:
+                await asyncio.sleep(self.poll_interval * 2 ** attempt)
+        self._unreleased.append((claim["job"], [idx for idx, _, _ in claim["items"]]))
+        await self._release_unrecorded()
+        return False
+
+    async def _release_unrecorded(self):
+        """Requeue claims whose outcomes could not be recorded; keep those that still fail."""
+        owner = os.getpid()
+        unreleased, self._unreleased = self._unreleased, []
+        for job_id, indexes in unreleased:
+            try:
+                requeued = await asyncio.to_thread(self.store.release, job_id, owner, indexes)
+                logger.error(f"Requeued {requeued} images of job {job_id} whose results could not be recorded")
+            except Exception as e:
+                logger.error(f"Could not requeue images of job {job_id}, retrying later: {e}")
+                self._unreleased.append((job_id, indexes))
+
+    async def _maintain(self):
+        """Periodically delete old jobs and requeue claims of processes that died."""
+        while True:
+            await asyncio.sleep(60)
+            await self._release_unrecorded()
+            try:
+                if self.max_age_seconds > 0:
+                    await asyncio.to_thread(self.store.purge, self.max_age_seconds)
+                await asyncio.to_thread(self.store.requeue_orphans)
+            except sqlite3.Error as e:
+                logger.warning(f"Job store maintenance failed: {e}")
@@ -0,0 +1,156 @@
+"""
+Patch-level tamper localization.
+
+The global prediction squashes the whole ELA image to 224x224, which averages away
+small splices on large images. Localization instead cuts the full-resolution ELA map
+into overlapping 224x224 patches, scores every patch and returns the grid of patch
+scores as a coarse heatmap, plus the most suspicious regions.
+
+Cost and memory stay bounded on large images:
+
+- the patch grid is planned up front to hold at most ``max_patches`` patches, first
+  by reducing the overlap and then by downscaling the image;
+- ELA is computed one band of patch rows at a time. JPEG works on 16x16 macroblocks,
+  so recompressing a 16-aligned band (plus a 16 pixel margin for chroma upsampling)
+  reproduces the whole-image recompression there, and the full-resolution ELA map is
+  never held in memory;
+- patches are scored in fixed-size batches by the caller.
+"""
+import math
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+import fast_ela
+
+PATCH_SIZE = 224
+# JPEG macroblock size (4:2:0 chroma subsampling), the alignment of ELA bands
+BLOCK = 16
+
+
+def _positions(length: int, stride: int) -> List[int]:
+    """Patch offsets along one axis, always covering the far edge."""
+    if length <= PATCH_SIZE:
+        return [0]
+    positions = list(range(0, length - PATCH_SIZE + 1, stride))
+    if positions[-1] != length - PATCH_SIZE:
+        positions.append(length - PATCH_SIZE)
+    return positions
+
+
+def plan_grid(size: tuple, overlap: float = 0.5, max_patches: int = 256) -> dict:
+    """
+    Plan the patch grid of an image.
+
+    Args:
+        size: (width, height) of the image.
+        overlap: Preferred overlap of neighbouring patches (0 to < 1).
+        max_patches: Upper bound on the number of patches.
+
+    Returns:
+        {"scale", "size" (scaled (width, height)), "stride", "xs", "ys"}: the image is
+        resized by ``scale`` (1.0 = not at all) and patches start at every (x, y) of
+        ``xs`` x ``ys`` in the resized image.
+    """
+    width, height = size
+    stride = max(1, round(PATCH_SIZE * (1.0 - min(max(overlap, 0.0), 0.95))))
+    # Coarser strides first: less overlap costs less than losing resolution
+    while stride < PATCH_SIZE and len(_positions(width, stride)) * len(_positions(height, stride)) > max_patches:
+        stride = min(PATCH_SIZE, stride * 2)
+
+    scale = 1.0
+    while len(_positions(width, stride)) * len(_positions(height, stride)) > max_patches:
+        # Even without overlap there are too many patches: shrink until they fit
+        factor = math.sqrt(max_patches / (len(_positions(width, stride)) * len(_positions(height, stride))))
+        scale *= min(factor, 0.95)
+        width, height = max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+    return {
+        "scale": scale,
+        "size": (width, height),
+        "stride": stride,
+        "xs": _positions(width, stride),
+        "ys": _positions(height, stride),
+    }
+
+
+def ela_patches(image: Image.Image, grid: dict, quality: int = 90, brightness: float = 10.0) -> np.ndarray:
+    """
+    Compute the ELA patches of ``image`` (already resized to ``grid["size"]``).
+
+    Returns:
+        uint8 array of shape (len(ys) * len(xs), 224, 224, 3), row-major over the grid.
+        Parts of a patch outside a small image are zero (no compression error).
+    """
+    width, height = image.size
+    xs, ys = grid["xs"], grid["ys"]
+    patches = np.zeros((len(ys) * len(xs), PATCH_SIZE, PATCH_SIZE, 3), dtype=np.uint8)
+    for row, y in enumerate(ys):
+        # Recompress only this band of rows, aligned to the JPEG block grid
+        top = max(0, (y - BLOCK) // BLOCK * BLOCK)
+        bottom = min(height, y + PATCH_SIZE + BLOCK)
+        band = np.asarray(fast_ela.ela_full(image.crop((0, top, width, bottom)), quality, brightness))
+        band = band[y - top:y - top + PATCH_SIZE]
+        for col, x in enumerate(xs):
+            tile = band[:, x:x + PATCH_SIZE]
+            patches[row * len(xs) + col, :tile.shape[0], :tile.shape[1]] = tile
+    return patches
+
+
+def summarize(tampered: List[float], grid: dict, original_size: tuple, top_k: int = 5) -> dict:
+    """
+    Build the localization result from per-patch tampered probabilities.
+
+    Returns:
+        - heatmap: rows x cols grid of patch probabilities (row-major, top to bottom)
+        - grid: patch size, stride and patch offsets, in original image pixels
+        - regions: up to ``top_k`` most suspicious, mostly non-overlapping patches as
+          boxes (x, y, width, height) in original image pixels, highest score first
+        - max_tampered / mean_tampered over all patches
+    """
+    xs, ys = grid["xs"], grid["ys"]
+    scale = grid["scale"]
+    to_original = lambda v: int(round(v / scale))
+    boxes = [
+        (to_original(x), to_original(y), to_original(min(PATCH_SIZE, grid["size"][0] - x)),
+         to_original(min(PATCH_SIZE, grid["size"][1] - y)))
+        for y in ys for x in xs
+    ]
+
+    regions = []
+    for i in sorted(range(len(tampered)), key=lambda i: tampered[i], reverse=True):
+        if len(regions) >= top_k:
+            break
+        if any(_overlap(boxes[i], boxes[j]) > 0.25 for j in regions):
+            continue
+        regions.append(i)
+
+    return {
+        "heatmap": [[round(tampered[r * len(xs) + c], 4) for c in range(len(xs))] for r in range(len(ys))],
+        "grid": {
+            "rows": len(ys),
+            "cols": len(xs),
+            "patch_size": to_original(PATCH_SIZE),
+            "stride": to_original(grid["stride"]),
+            "xs": [to_original(x) for x in xs],
+            "ys": [to_original(y) for y in ys],
+            "image_size": list(original_size),
+            "scale": round(scale, 4),
+        },
+        "regions": [
+            {"box": list(boxes[i]), "tampered": round(tampered[i], 4), "row": i // len(xs), "col": i % len(xs)}
+            for i in regions
+        ],
+        "max_tampered": round(max(tampered), 4),
+        "mean_tampered": round(sum(tampered) / len(tampered), 4),
+    }
+
+
+def _overlap(a: tuple, b: tuple) -> float:
+    """Intersection over the smaller of two (x, y, width, height) boxes."""
+    width = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    height = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    return width * height / min(a[2] * a[3], b[2] * b[3])
@@ -1,18 +1,57 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, File, Header, Request, UploadFile, HTTPException
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image, ImageChops, ImageEnhance
-import io
 import torch
 import torch.nn as nn
-import torchvision.transforms as transforms
-from typing import Optional
+from typing import Iterator, List, Optional
 import traceback
+import logging
 import os
+import asyncio
+import functools
+import hmac
+import itertools
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
 import numpy as np
 
+import ela_worker
+import fast_ela
+import metrics
+from archives import ArchiveLimitExceeded, extract_images, is_archive
+from ela_worker import apply_ela, compute_ela_array, compute_ela_timed, compute_frame_ela, compute_patches
+from batching import MicroBatcher
+from cache import PredictionCache, content_hash, file_sha256, result_namespace
+from calibration import ScoreCalibration, load_calibrations
+from uploads import RequestSizeLimit, check_image, read_upload
+from jobs import PRIORITIES, TERMINAL_STATUSES, ClaimDeferred, JobStore, JobWorkers
+from pipeline import InferencePipeline
+from model_cache import ModelArtifactCache
+from near_duplicates import NearDuplicateIndex
+from registry import ModelRegistry
+import video
+import localization
+from runtime import calibration_batch, config_key, configure_threads, prepare_model
+
+# Logging: per-request diagnostics are DEBUG level and skipped entirely unless
+# VERIFRAME_LOG_LEVEL=DEBUG; model loading and errors are logged at INFO and above
+LOG_LEVEL = os.environ.get("VERIFRAME_LOG_LEVEL", "INFO").upper()
+logger = logging.getLogger("veriframe")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(levelname)s - %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.propagate = False
+logger.setLevel(LOG_LEVEL)
+
 app = FastAPI(title="VeriFrame API", version="1.0.0", description="AI-powered deepfake detection")
 
+# Reject oversized request bodies while they stream in (added before CORS so that
+# browsers still see the 413 response)
+app.add_middleware(RequestSizeLimit, limit_for=lambda path: request_body_limit(path))
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -27,111 +66,299 @@ model = None
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "model.pth")
 _last_logits = None  # Track last prediction to detect constant outputs
+model_fingerprint = None  # SHA-256 of the loaded checkpoint, used to key the prediction cache
+model_runtime = None  # Inference runtime description (see runtime.prepare_model)
+
+# ELA implementation: "fast" (vectorized, see fast_ela.py) or "reference" (apply_ela + ToTensor)
+ELA_IMPL = os.environ.get("VERIFRAME_ELA_IMPL", "fast")
+
+# Inference runtime: eager | torchscript | onnx, optional INT8 quantization (none | dynamic | static),
+# channels-last memory format and intra-op thread count. Non-eager runtimes are checked
+# against the eager model on a calibration set (VERIFRAME_CALIBRATION_DIR or synthetic images).
+RUNTIME = os.environ.get("VERIFRAME_RUNTIME", "eager")
+RUNTIME_QUANTIZE = os.environ.get("VERIFRAME_QUANTIZE", "none")
+RUNTIME_CHANNELS_LAST = os.environ.get("VERIFRAME_CHANNELS_LAST", "0") == "1"
+RUNTIME_NUM_THREADS = int(os.environ.get("VERIFRAME_NUM_THREADS", "0"))
+RUNTIME_CALIBRATION_DIR = os.environ.get("VERIFRAME_CALIBRATION_DIR") or None
+RUNTIME_PARITY_TOLERANCE = float(os.environ.get("VERIFRAME_PARITY_TOLERANCE", "0.02"))
+
+# Model artifact cache: resolved architecture + weights (and TorchScript/ONNX artifacts)
+# keyed by checkpoint hash, so warm boots skip architecture inference and conversion
+MODEL_CACHE_ENABLED = os.environ.get("VERIFRAME_MODEL_CACHE", "1") == "1"
+MODEL_CACHE_DIR = os.environ.get("VERIFRAME_MODEL_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".model_cache"))
+MODEL_CACHE_MMAP = os.environ.get("VERIFRAME_MODEL_MMAP", "1") == "1"
+# Random-input forward passes after building a model from a state dict (debug aid)
+MODEL_SELF_TEST = os.environ.get("VERIFRAME_MODEL_SELF_TEST", "1") == "1"
+
+# Model registry: checkpoints /load-model may read (os.pathsep-separated directories),
+# resident version limit, name of the version loaded at startup and warmup rounds run
+# with real ELA batches before a new version is swapped in
+MODEL_DIRS = [os.path.realpath(d) for d in os.environ.get(
+    "VERIFRAME_MODEL_DIRS", os.path.dirname(os.path.abspath(MODEL_PATH))).split(os.pathsep) if d]
+MAX_MODEL_VERSIONS = int(os.environ.get("VERIFRAME_MAX_MODEL_VERSIONS", "2"))
+DEFAULT_MODEL_VERSION = os.environ.get("VERIFRAME_MODEL_VERSION") or os.path.splitext(os.path.basename(MODEL_PATH))[0]
+MODEL_WARMUP_ROUNDS = int(os.environ.get("VERIFRAME_MODEL_WARMUP_ROUNDS", "2"))
+
+# Multi-worker serving (serve.py): file this worker periodically writes its health
+# snapshot to, for the supervisor's aggregate health endpoint
+WORKER_STATUS_FILE = os.environ.get("VERIFRAME_WORKER_STATUS_FILE") or None
+WORKER_STATUS_INTERVAL = float(os.environ.get("VERIFRAME_WORKER_STATUS_INTERVAL", "2"))
+# Under serve.py, model admin endpoints (/load-model, /models/...) only accept requests
+# carrying this token, which the supervisor sends when it fans a request out to every
+# worker; a request reaching a single worker through the shared socket is rejected, so
+# workers never end up serving different model versions
+ADMIN_TOKEN = os.environ.get("VERIFRAME_ADMIN_TOKEN") or None
+
+# Decode-time limits: reject images above a pixel budget and, optionally, downscale
+# large images (JPEG draft decode + resize) to a working resolution before ELA.
+# 0 disables each limit; a working size of 0 keeps the full-resolution training pipeline.
+MAX_IMAGE_PIXELS = int(os.environ.get("VERIFRAME_MAX_IMAGE_PIXELS", "100000000"))
+ELA_WORKING_SIZE = int(os.environ.get("VERIFRAME_ELA_WORKING_SIZE", "0"))
+
+# Upload limits: maximum size of one image file (and of a /predict request), maximum
+# request size of /predict/batch and /jobs, and accepted formats (sniffed from the
+# file's magic bytes). Files are checked from their first chunk, together with
+# MAX_IMAGE_PIXELS against the header's dimensions, before they are read into memory.
+UPLOAD_MAX_MB = float(os.environ.get("VERIFRAME_UPLOAD_MAX_MB", "50"))
+UPLOAD_REQUEST_MAX_MB = float(os.environ.get("VERIFRAME_UPLOAD_REQUEST_MAX_MB", "1024"))
+UPLOAD_FORMATS = tuple(f.strip().upper() for f in os.environ.get(
+    "VERIFRAME_UPLOAD_FORMATS", "JPEG,PNG,WEBP,GIF,BMP,TIFF").split(",") if f.strip())
+
+# Score calibration: file of per-model temperatures and decision thresholds fitted on a
+# labeled set by evaluate.py (see calibration.py), loaded at startup. Model versions
+# whose checkpoint fingerprint has no entry keep temperature 1 and threshold 0.5.
+SCORE_CALIBRATION = os.environ.get("VERIFRAME_SCORE_CALIBRATION") or None
+
+# Multi-quality ELA ensemble (opt-in per request with ela_qualities): maximum number of
+# qualities per request and threads recompressing them concurrently in each ELA worker
+# (0 = the process's CPUs divided among the ELA workers, so that busy workers do not
+# oversubscribe the cores; at least 1, i.e. no extra threads)
+ELA_ENSEMBLE_MAX_QUALITIES = int(os.environ.get("VERIFRAME_ELA_ENSEMBLE_MAX_QUALITIES", "8"))
+ELA_ENSEMBLE_THREADS = int(os.environ.get("VERIFRAME_ELA_ENSEMBLE_THREADS", "0"))
+
+# Prediction cache settings (memory tier budget, TTL, optional SQLite disk tier and its
+# row limit)
+CACHE_MAX_MB = float(os.environ.get("VERIFRAME_CACHE_MAX_MB", "64"))
+CACHE_TTL_SECONDS = float(os.environ.get("VERIFRAME_CACHE_TTL_SECONDS", "3600"))
+CACHE_DB_PATH = os.environ.get("VERIFRAME_CACHE_DB") or None
+CACHE_DB_MAX_ENTRIES = int(os.environ.get("VERIFRAME_CACHE_DB_MAX_ENTRIES", "1000000"))
+
+# Dynamic micro-batching settings for /predict
+BATCH_MAX_SIZE = int(os.environ.get("VERIFRAME_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("VERIFRAME_BATCH_MAX_WAIT_MS", "5"))
+
+# /predict/batch limits: images per request (including archive members) and archive size
+BATCH_MAX_FILES = int(os.environ.get("VERIFRAME_BATCH_MAX_FILES", "512"))
+ARCHIVE_MAX_MB = float(os.environ.get("VERIFRAME_ARCHIVE_MAX_MB", "1024"))
+
+# Near-duplicate detection: "off", "flag" (report the nearest known image and its
+# stored verdict) or "reuse" (answer with the stored verdict of the same model instead
+# of running the model). Matches are within NEAR_DUP_DISTANCE bits of the perceptual
+# hash; the index is persisted to NEAR_DUP_INDEX on shutdown (memory only if unset).
+NEAR_DUP_MODE = os.environ.get("VERIFRAME_NEAR_DUP_MODE", "off")
+NEAR_DUP_DISTANCE = int(os.environ.get("VERIFRAME_NEAR_DUP_DISTANCE", "6"))
+NEAR_DUP_HASH = os.environ.get("VERIFRAME_NEAR_DUP_HASH", "phash")
+NEAR_DUP_INDEX = os.environ.get("VERIFRAME_NEAR_DUP_INDEX") or None
+
+# Tamper localization (opt-in per request with localize=true): longest side the image
+# is decoded at, preferred patch overlap, patch budget and number of regions returned
+LOCALIZE_MAX_SIDE = int(os.environ.get("VERIFRAME_LOCALIZE_MAX_SIDE", "4096"))
+LOCALIZE_OVERLAP = float(os.environ.get("VERIFRAME_LOCALIZE_OVERLAP", "0.5"))
+LOCALIZE_MAX_PATCHES = int(os.environ.get("VERIFRAME_LOCALIZE_MAX_PATCHES", "256"))
+LOCALIZE_TOP_REGIONS = int(os.environ.get("VERIFRAME_LOCALIZE_TOP_REGIONS", "5"))
+
+# Video scoring (/predict/video): default sampling, cost bounds (maximum sampled frames,
+# upload size) and early exit once the mean score of at least VIDEO_MIN_FRAMES frames
+# is decisive (>= VIDEO_DECISIVE or <= 1 - VIDEO_DECISIVE)
+VIDEO_SAMPLING = os.environ.get("VERIFRAME_VIDEO_SAMPLING", "stride")
+VIDEO_STRIDE = int(os.environ.get("VERIFRAME_VIDEO_STRIDE", "10"))
+VIDEO_SCENE_THRESHOLD = float(os.environ.get("VERIFRAME_VIDEO_SCENE_THRESHOLD", "0.15"))
+VIDEO_MAX_FRAMES = int(os.environ.get("VERIFRAME_VIDEO_MAX_FRAMES", "64"))
+VIDEO_MIN_FRAMES = int(os.environ.get("VERIFRAME_VIDEO_MIN_FRAMES", "8"))
+VIDEO_DECISIVE = float(os.environ.get("VERIFRAME_VIDEO_DECISIVE", "0.9"))
+VIDEO_MAX_MB = float(os.environ.get("VERIFRAME_VIDEO_MAX_MB", "512"))
+
+# Asynchronous jobs (/jobs, opt-in): submissions are stored in the SQLite file JOB_DB and
+# scored in the background by JOB_WORKERS workers, JOB_CLAIM_SIZE images at a time.
+# Workers only take new images while fewer than JOB_YIELD_IN_FLIGHT interactive
+# requests are in the pipeline, so jobs never crowd out /predict traffic; a claim being
+# scored holds a pipeline slot and its batches go through the version's batcher at low
+# priority, behind waiting /predict requests. Submissions
+# are limited per job, per client (unfinished jobs) and in total (queued images).
+JOB_DB = os.environ.get("VERIFRAME_JOB_DB") or None
+JOB_WORKERS = int(os.environ.get("VERIFRAME_JOB_WORKERS", "2"))
+JOB_CLAIM_SIZE = int(os.environ.get("VERIFRAME_JOB_CLAIM_SIZE", "8"))
+JOB_YIELD_IN_FLIGHT = int(os.environ.get("VERIFRAME_JOB_YIELD_IN_FLIGHT", "4"))
+JOB_MAX_FILES = int(os.environ.get("VERIFRAME_JOB_MAX_FILES", "10000"))
+JOB_MAX_ACTIVE_PER_CLIENT = int(os.environ.get("VERIFRAME_JOB_MAX_ACTIVE_PER_CLIENT", "16"))
+JOB_MAX_PENDING_ITEMS = int(os.environ.get("VERIFRAME_JOB_MAX_PENDING_ITEMS", "100000"))
+JOB_MAX_WAIT_SECONDS = float(os.environ.get("VERIFRAME_JOB_MAX_WAIT_SECONDS", "30"))
+JOB_RETENTION_SECONDS = float(os.environ.get("VERIFRAME_JOB_RETENTION_SECONDS", "86400"))
+
+# Worker pool settings: ELA runs in worker processes, inference in a dedicated executor.
+# ELA workers only import ela_worker.py (tens of MB each); by default there is one per
+# available CPU, at most ELA_WORKERS_DEFAULT_MAX
+ELA_WORKERS_DEFAULT_MAX = 8
+_available_cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+ELA_WORKERS = int(os.environ.get("VERIFRAME_ELA_WORKERS", str(min(_available_cpus, ELA_WORKERS_DEFAULT_MAX))))
+INFERENCE_WORKERS = int(os.environ.get("VERIFRAME_INFERENCE_WORKERS", "1"))
+MAX_QUEUE_DEPTH = int(os.environ.get("VERIFRAME_MAX_QUEUE_DEPTH", "64"))
+
+# Settings of the preprocessing functions in ela_worker.py, which run in processes that
+# do not import this module (passed to each worker when the pool starts)
+ELA_WORKER_SETTINGS = {
+    "impl": ELA_IMPL,
+    "working_size": ELA_WORKING_SIZE,
+    "max_pixels": MAX_IMAGE_PIXELS,
+    "perceptual_hash": NEAR_DUP_HASH,
+    "ensemble_threads": ELA_ENSEMBLE_THREADS,
+    "pool_workers": ELA_WORKERS,
+    "localize_max_side": LOCALIZE_MAX_SIDE,
+    "localize_overlap": LOCALIZE_OVERLAP,
+    "localize_max_patches": LOCALIZE_MAX_PATCHES,
+}
+ela_worker.configure(ELA_WORKER_SETTINGS)
+
+_transform = None
 
-def apply_ela(image, quality=90):
+def get_transform():
     """
-    Apply Error Level Analysis (ELA) preprocessing to the image.
-    Matches the training pipeline exactly:
-    1. Save image to JPEG with specified quality
-    2. Reload the compressed JPEG
-    3. Calculate pixel-wise difference using ImageChops.difference
-    4. Amplify differences using ImageEnhance.Brightness
-    5. Resize to (224, 224)
+    Image preprocessing pipeline - matches training exactly.
+    After ELA (which already resizes to 224x224), just convert to tensor.
+    ToTensor() normalizes pixel values to [0, 1] range.
     
-    Args:
-        image: PIL Image object (RGB)
-        quality: JPEG quality for recompression (default 90, matching training)
-    
-    Returns:
-        ELA processed PIL Image resized to (224, 224)
+    Built on first use: torchvision takes seconds to import and is only needed by the
+    reference ELA path (the fast path produces identical tensors without it).
     """
-    # Save original image to temporary buffer as JPEG with specified quality
-    temp_buffer = io.BytesIO()
-    image.save(temp_buffer, format='JPEG', quality=quality)
-    temp_buffer.seek(0)
-    
-    # Reload the compressed JPEG image
-    reloaded_image = Image.open(temp_buffer)
-    
-    # Calculate pixel-wise difference between original and re-compressed image
-    # Using ImageChops.difference (matches training code)
-    diff_image = ImageChops.difference(image, reloaded_image)
-    
-    # Amplify the differences to make artifacts more visible
-    # Using ImageEnhance.Brightness (matches training code)
-    enhancer = ImageEnhance.Brightness(diff_image)
-    ela_image = enhancer.enhance(10.0)  # Amplify by 10x (common value, adjust if needed)
-    
-    # Resize to (224, 224) - matching training pipeline
-    ela_image = ela_image.resize((224, 224), Image.Resampling.LANCZOS)
-    
-    return ela_image
+    global _transform
+    if _transform is None:
+        import torchvision.transforms as transforms
+        _transform = transforms.Compose([
+            transforms.ToTensor()  # Converts PIL Image to tensor and normalizes to [0, 1]
+            # No resize needed - ELA already resizes to (224, 224)
+            # No ImageNet normalization - training only uses ToTensor()
+        ])
+    return _transform
 
-# Image preprocessing pipeline - matches training exactly
-# After ELA (which already resizes to 224x224), just convert to tensor
-# ToTensor() normalizes pixel values to [0, 1] range
-transform = transforms.Compose([
-    transforms.ToTensor()  # Converts PIL Image to tensor and normalizes to [0, 1]
-    # No resize needed - ELA already resizes to (224, 224)
-    # No ImageNet normalization - training only uses ToTensor()
-])
+def model_from_checkpoint(checkpoint):
+    """
+    Build an eval-mode model on the inference device from a loaded checkpoint.
+    """
+    # Try to determine the model structure
+    # Check if it's a state dict or a full model
+    if isinstance(checkpoint, dict):
+        # Check if it contains 'state_dict' or 'model_state_dict'
+        if 'state_dict' in checkpoint:
+            # Try to infer model architecture from state dict keys
+            return create_model_from_state_dict(checkpoint['state_dict'])
+        elif 'model_state_dict' in checkpoint:
+            return create_model_from_state_dict(checkpoint['model_state_dict'])
+        elif 'model' in checkpoint:
+            # Full model object
+            loaded = checkpoint['model']
+        else:
+            # Assume the entire dict is the state dict
+            return create_model_from_state_dict(checkpoint)
+    else:
+        # Assume it's a full model
+        loaded = checkpoint
+    
+    if isinstance(loaded, nn.Module):
+        loaded.eval()
+        loaded.to(device)
+    return loaded
 
-def load_model(model_path: str = MODEL_PATH):
+def load_checkpoint(model_path: str = MODEL_PATH):
     """
-    Load the PyTorch model from a .pth file.
+    Load the eager PyTorch model from a .pth file without touching the served model.
+    """
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found at: {model_path}")
+    checkpoint = torch.load(model_path, map_location=device)
+    return model_from_checkpoint(checkpoint)
+
+# Cache of resolved model artifacts (see model_cache.py)
+model_artifacts = ModelArtifactCache(MODEL_CACHE_DIR, mmap=MODEL_CACHE_MMAP)
+
+def _save_artifact(save, *args):
+    """Write a model cache entry; a read-only or full disk must not break loading."""
+    try:
+        save(*args)
+    except Exception as e:
+        logger.warning(f"Could not write model cache entry: {e}")
+
+def build_model(model_path: str = MODEL_PATH):
     """
-    global model
+    Load a checkpoint and prepare it for serving without touching the served model.
     
+    Returns:
+        (model, checkpoint fingerprint, runtime info dict)
+    """
     try:
-        print(f"Loading model from: {model_path}")
-        print(f"Device: {device}")
+        logger.info(f"Loading model from: {model_path}")
+        logger.info(f"Device: {device}")
         
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model file not found at: {model_path}")
         
-        # Load the checkpoint
-        checkpoint = torch.load(model_path, map_location=device)
+        if MODEL_CACHE_ENABLED:
+            fingerprint = model_artifacts.checkpoint_hash(model_path)
+        else:
+            fingerprint = file_sha256(model_path)
+        runtime_key = config_key(RUNTIME, RUNTIME_QUANTIZE, RUNTIME_CHANNELS_LAST, RUNTIME_CALIBRATION_DIR)
         
-        # Try to determine the model structure
-        # Check if it's a state dict or a full model
-        if isinstance(checkpoint, dict):
-            # Check if it contains 'state_dict' or 'model_state_dict'
-            if 'state_dict' in checkpoint:
-                state_dict = checkpoint['state_dict']
-                # Try to infer model architecture from state dict keys
-                model = create_model_from_state_dict(state_dict)
-            elif 'model_state_dict' in checkpoint:
-                state_dict = checkpoint['model_state_dict']
-                model = create_model_from_state_dict(state_dict)
-            elif 'model' in checkpoint:
-                # Full model object
-                model = checkpoint['model']
-                if isinstance(model, nn.Module):
-                    model.eval()
-                    model.to(device)
-                    print(f"Model loaded successfully on {device}")
-                    return model
-            else:
-                # Assume the entire dict is the state dict
-                model = create_model_from_state_dict(checkpoint)
+        # Fastest path: a cached, already converted and verified runtime artifact
+        cached = None
+        if MODEL_CACHE_ENABLED and RUNTIME != "eager":
+            cached = model_artifacts.load_runtime(fingerprint, runtime_key, device)
+        if cached is not None:
+            configure_threads(RUNTIME_NUM_THREADS)
+            loaded, runtime_info = cached
+            logger.info(f"Loaded cached {runtime_key} model artifact")
         else:
-            # Assume it's a full model
-            model = checkpoint
-            if isinstance(model, nn.Module):
-                model.eval()
-                model.to(device)
-                print(f"Model loaded successfully on {device}")
-                return model
+            loaded = None
+            if MODEL_CACHE_ENABLED:
+                hit = model_artifacts.load_eager(fingerprint, MODEL_ARCHITECTURES, device)
+                if hit is not None:
+                    loaded = hit[0]
+                    logger.info(f"Loaded cached {hit[1]} model artifact")
+            if loaded is None:
+                loaded = load_checkpoint(model_path)
+                arch = model_architecture(loaded)
+                if MODEL_CACHE_ENABLED and arch is not None:
+                    _save_artifact(model_artifacts.save_eager, fingerprint, arch, loaded)
+            
+            # Convert to the configured inference runtime (verified against the eager model)
+            loaded, runtime_info = prepare_model(
+                loaded,
+                runtime=RUNTIME,
+                quantize=RUNTIME_QUANTIZE,
+                channels_last=RUNTIME_CHANNELS_LAST,
+                num_threads=RUNTIME_NUM_THREADS,
+                calibration_dir=RUNTIME_CALIBRATION_DIR,
+                tolerance=RUNTIME_PARITY_TOLERANCE,
+            )
+            if MODEL_CACHE_ENABLED and not runtime_info["fallback"]:
+                _save_artifact(model_artifacts.save_runtime, fingerprint, runtime_key, loaded, runtime_info)
         
-        print(f"Model loaded successfully on {device}")
-        return model
+        logger.info(f"Model loaded successfully on {device}")
+        return loaded, fingerprint, runtime_info
         
     except Exception as e:
         error_trace = traceback.format_exc()
-        print(f"Error loading model: {str(e)}")
-        print(f"Traceback: {error_trace}")
+        logger.error(f"Error loading model: {str(e)}")
+        logger.error(f"Traceback: {error_trace}")
         raise Exception(f"Error loading model: {str(e)}")
 
+def load_model(model_path: str = MODEL_PATH):
+    """
+    Load the PyTorch model from a .pth file and make it the module-level model
+    (used by the CLI tools; the API loads versions through the registry).
+    """
+    global model, model_fingerprint, model_runtime
+    model, model_fingerprint, model_runtime = build_model(model_path)
+    return model
+
 def create_model_from_state_dict(state_dict):
     """
     Create a model architecture from state dict by inferring the structure.
@@ -139,74 +366,84 @@ def create_model_from_state_dict(state_dict):
     # Get the keys to understand the architecture
     keys = list(state_dict.keys())
     
-    print(f"DEBUG - State dict has {len(keys)} keys")
-    print(f"DEBUG - First 10 keys: {keys[:10]}")
+    logger.debug(f"State dict has {len(keys)} keys")
+    logger.debug(f"First 10 keys: {keys[:10]}")
     
     # Try to determine if it's a ResNet, EfficientNet, or custom CNN
     # For now, we'll try to load it as a generic model or use a common architecture
     
     # Check if it looks like a ResNet
     if any('resnet' in k.lower() or 'layer' in k.lower() for k in keys):
-        print("DEBUG - Detected ResNet-like architecture")
+        logger.debug("Detected ResNet-like architecture")
         try:
             # Try ResNet18 as a common architecture
-            from torchvision.models import resnet18
-            model = resnet18(pretrained=False)
-            # Modify the final layer for binary classification
-            model.fc = nn.Linear(model.fc.in_features, 2)
+            model = create_resnet18()
             missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=False)
-            print(f"DEBUG - ResNet18: Missing {len(missing_keys)} keys, Unexpected {len(unexpected_keys)} keys")
+            logger.debug(f"ResNet18: Missing {len(missing_keys)} keys, Unexpected {len(unexpected_keys)} keys")
             if len(missing_keys) > 0:
-                print(f"DEBUG - First 5 missing keys: {missing_keys[:5]}")
+                logger.debug(f"First 5 missing keys: {missing_keys[:5]}")
         except Exception as e:
-            print(f"DEBUG - ResNet18 loading failed: {e}")
+            logger.debug(f"ResNet18 loading failed: {e}")
             model = create_generic_cnn()
             try:
                 missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=False)
-                print(f"DEBUG - Generic CNN: Missing {len(missing_keys)} keys, Unexpected {len(unexpected_keys)} keys")
+                logger.debug(f"Generic CNN: Missing {len(missing_keys)} keys, Unexpected {len(unexpected_keys)} keys")
             except Exception as e2:
-                print(f"DEBUG - Generic CNN loading failed: {e2}")
-                print("WARNING: Could not load state dict. Using default architecture with random weights!")
+                logger.debug(f"Generic CNN loading failed: {e2}")
+                logger.warning("Could not load state dict. Using default architecture with random weights!")
     else:
         # Try to create a generic CNN
-        print("DEBUG - Using generic CNN architecture")
+        logger.debug("Using generic CNN architecture")
         model = create_generic_cnn()
         try:
             missing_keys, unexpected_keys = model.load_state_dict(state_dict, strict=False)
-            print(f"DEBUG - Generic CNN: Missing {len(missing_keys)} keys, Unexpected {len(unexpected_keys)} keys")
+            logger.debug(f"Generic CNN: Missing {len(missing_keys)} keys, Unexpected {len(unexpected_keys)} keys")
             if len(missing_keys) > len(keys) * 0.3:  # If more than 30% keys are missing
-                print(f"WARNING: {len(missing_keys)} out of {len(keys)} keys failed to load ({len(missing_keys)/len(keys)*100:.1f}%)!")
-                print("WARNING: Model may not work correctly with random weights!")
+                logger.warning(f"{len(missing_keys)} out of {len(keys)} keys failed to load ({len(missing_keys)/len(keys)*100:.1f}%)!")
+                logger.warning("Model may not work correctly with random weights!")
         except Exception as e:
-            print(f"WARNING: Could not load state dict exactly: {e}")
-            print("WARNING: Using default architecture with random weights!")
+            logger.warning(f"Could not load state dict exactly: {e}")
+            logger.warning("Using default architecture with random weights!")
     
     model.eval()
     model.to(device)
     
     # Test the model with dummy inputs to verify it works and varies outputs
+    if not MODEL_SELF_TEST:
+        return model
     try:
-        print("DEBUG - Testing model with random inputs...")
+        logger.debug("Testing model with random inputs...")
         test_input1 = torch.randn(1, 3, 224, 224).to(device)
         test_input2 = torch.randn(1, 3, 224, 224).to(device)
         with torch.no_grad():
             test_output1 = model(test_input1)
             test_output2 = model(test_input2)
-        print(f"DEBUG - Model test output 1: {test_output1[0].tolist()}")
-        print(f"DEBUG - Model test output 2: {test_output2[0].tolist()}")
+        logger.debug(f"Model test output 1: {test_output1[0].tolist()}")
+        logger.debug(f"Model test output 2: {test_output2[0].tolist()}")
         
         # Check if outputs are different (model should vary)
         diff = torch.abs(test_output1 - test_output2).sum().item()
         if diff < 0.01:
-            print(f"WARNING: Model outputs are identical for different inputs! Model may not be working.")
-            print(f"WARNING: This suggests model weights may not be loaded correctly.")
+            logger.warning("Model outputs are identical for different inputs! Model may not be working.")
+            logger.warning("This suggests model weights may not be loaded correctly.")
         else:
-            print(f"DEBUG - Model outputs vary (difference: {diff:.4f}), model appears to be working.")
+            logger.debug(f"Model outputs vary (difference: {diff:.4f}), model appears to be working.")
     except Exception as e:
-        print(f"DEBUG - Model test failed: {e}")
+        logger.debug(f"Model test failed: {e}")
     
     return model
 
+def create_resnet18():
+    """
+    Create a ResNet18 with a two-class head (torchvision is imported lazily).
+    """
+    # Try ResNet18 as a common architecture
+    from torchvision.models import resnet18
+    model = resnet18(weights=None)
+    # Modify the final layer for binary classification
+    model.fc = nn.Linear(model.fc.in_features, 2)
+    return model
+
 def create_generic_cnn():
     """
     Create a generic CNN architecture for binary image classification.
@@ -257,6 +494,136 @@ def create_generic_cnn():
     
     return DeepfakeCNN()
 
+async def localize_image(image_bytes: bytes, version) -> dict:
+    """
+    Patch-level localization: patch ELA in the ELA pool, then the patches in
+    BATCH_MAX_SIZE forward passes. Returns localization.summarize's result.
+    """
+    with metrics.STAGE_SECONDS.labels("ela").time():
+        patches, grid, original_size = await pipeline.run_ela(compute_patches, image_bytes)
+    tampered = []
+    for start in range(0, len(patches), BATCH_MAX_SIZE):
+        with metrics.STAGE_SECONDS.labels("to_tensor").time():
+            batch = ela_arrays_to_batch(patches[start:start + BATCH_MAX_SIZE])
+        results = await pipeline.run_inference(predict_batch, batch, version)
+        tampered.extend(r["probabilities"]["tampered"] for r in results)
+    return localization.summarize(tampered, grid, original_size, LOCALIZE_TOP_REGIONS)
+
+def parse_ela_qualities(spec: Optional[str]) -> Optional[tuple]:
+    """
+    Parse the ``ela_qualities`` request parameter ("75,85,90,95").
+    
+    Returns a tuple of distinct qualities in the given order, or None if not requested.
+    
+    Raises:
+        HTTPException: 400 for invalid or too many qualities.
+    """
+    if not spec:
+        return None
+    try:
+        qualities = tuple(dict.fromkeys(int(q) for q in spec.split(",") if q.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ela_qualities must be comma-separated integers")
+    if not qualities or any(not 1 <= q <= 100 for q in qualities):
+        raise HTTPException(status_code=400, detail="ela_qualities must be between 1 and 100")
+    if len(qualities) > ELA_ENSEMBLE_MAX_QUALITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many ela_qualities (maximum {ELA_ENSEMBLE_MAX_QUALITIES})"
+        )
+    return qualities
+
+def request_digest(digest: str, qualities: Optional[tuple] = None, localized: bool = False) -> str:
+    """
+    Cache digest of an upload, distinguishing results computed with request options
+    (ensemble qualities, localization) from plain ones.
+    """
+    if qualities:
+        digest = f"{digest}-q{'.'.join(map(str, qualities))}"
+    if localized:
+        digest = f"{digest}-loc"
+    return digest
+
+def find_near_duplicate(image_hash: int, version) -> Optional[dict]:
+    """
+    Look up an upload's perceptual hash in the near-duplicate index.
+    
+    Entries are keyed by ``cache_fingerprint``, so in "reuse" mode only verdicts of
+    ``version``'s model under the same quantization, ELA working size and calibration
+    are considered, and a match is marked ``reused``; in "flag" mode the nearest image
+    scored by any model is reported. The stored "logits"/"probabilities" are included
+    for reuse.
+    """
+    reuse = NEAR_DUP_MODE == "reuse"
+    fingerprint = cache_fingerprint(version)
+    match = near_duplicate_index.lookup(image_hash, NEAR_DUP_DISTANCE, model=fingerprint if reuse else None)
+    if match is None:
+        metrics.NEAR_DUPLICATES.labels("miss").inc()
+        return None
+    metrics.NEAR_DUPLICATES.labels("reused" if reuse else "flagged").inc()
+    tampered = match["probabilities"][1]
+    entry = {
+        "distance": match["distance"],
+        "ref": match["ref"],
+        "same_model": match["model"] == fingerprint,
+        "stored_prediction": "Tampered" if tampered > decision_threshold(version) else "Authentic",
+        "stored_tampered": round(tampered, 4),
+        "reused": reuse,
+    }
+    if reuse:
+        entry.update(logits=match["logits"], probabilities=match["probabilities"])
+    return entry
+
+def ela_to_tensor(ela_array: np.ndarray) -> torch.Tensor:
+    """
+    Convert an ELA array from compute_ela_array into a model input tensor.
+    
+    Returns a tensor of shape (1, 3, 224, 224) on the inference device.
+    """
+    # Normalize pixel values to [0, 1] and convert to (C, H, W) = (3, 224, 224)
+    if ELA_IMPL == "fast":
+        image_tensor = fast_ela.to_tensor(ela_array)  # Same values as ToTensor(), fewer copies
+    else:
+        image_tensor = get_transform()(ela_array)
+    
+    # Verify tensor shape: should be (3, 224, 224)
+    if image_tensor.shape != (3, 224, 224):
+        logger.warning(f"Tensor shape is {image_tensor.shape}, expected (3, 224, 224)")
+    
+    # Add batch dimension and move to device (CPU/GPU)
+    return image_tensor.unsqueeze(0).to(device)
+
+def ela_arrays_to_batch(ela_arrays: list) -> torch.Tensor:
+    """
+    Stack ELA arrays from compute_ela_array (a list, or one (N, 224, 224, 3) array such
+    as an ELA ensemble) into a single (N, 3, 224, 224) batch tensor.
+    """
+    if ELA_IMPL == "fast":
+        # Each row is written straight into the preallocated batch tensor
+        batch = torch.empty((len(ela_arrays), 3, 224, 224), dtype=torch.float32)
+        for row, ela_array in zip(batch, ela_arrays):
+            fast_ela.to_tensor(ela_array, out=row)
+    else:
+        batch = torch.stack([get_transform()(ela_array) for ela_array in ela_arrays])
+    return batch.to(device)
+
+# Architectures create_model_from_state_dict can resolve to, by artifact name
+MODEL_ARCHITECTURES = {
+    "resnet18": create_resnet18,
+    "generic_cnn": create_generic_cnn,
+}
+
+def model_architecture(model) -> Optional[str]:
+    """
+    Name of the MODEL_ARCHITECTURES entry that builds ``model``, or None if unknown.
+    """
+    name = type(model).__name__
+    if name == "DeepfakeCNN":
+        return "generic_cnn"
+    if name == "ResNet" and [len(getattr(model, f"layer{i}")) for i in range(1, 5)] == [2, 2, 2, 2]:
+        return "resnet18"
+    return None
+
 def preprocess_image(image_bytes: bytes) -> torch.Tensor:
     """
     Preprocess the uploaded image to match the exact training pipeline.
@@ -276,145 +643,717 @@ def preprocess_image(image_bytes: bytes) -> torch.Tensor:
     Returns a tensor of shape (1, 3, 224, 224).
     """
     try:
-        # Step 1: Load original image and convert to RGB
-        image = Image.open(io.BytesIO(image_bytes))
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Step 2: Compute ELA (includes resize to 224x224)
-        print("DEBUG - Computing ELA...")
-        ela_image = apply_ela(image, quality=90)  # Quality 90 matches training
-        
-        # Step 3: Convert to PyTorch tensor
-        # ToTensor() normalizes pixel values to [0, 1] and converts to (C, H, W) = (3, 224, 224)
-        image_tensor = transform(ela_image)
-        
-        # Verify tensor shape: should be (3, 224, 224)
-        if image_tensor.shape != (3, 224, 224):
-            print(f"WARNING: Tensor shape is {image_tensor.shape}, expected (3, 224, 224)")
-        
-        # Step 4: Add batch dimension: (3, 224, 224) -> (1, 3, 224, 224)
-        image_tensor = image_tensor.unsqueeze(0)
-        
-        # Step 5: Move to device (CPU/GPU)
-        image_tensor = image_tensor.to(device)
-        
-        print(f"DEBUG - Final tensor shape: {image_tensor.shape}, device: {device}")
-        
+        logger.debug("Computing ELA...")
+        image_tensor = ela_to_tensor(compute_ela_array(image_bytes))
+        logger.debug("Final tensor shape: %s, device: %s", tuple(image_tensor.shape), device)
         return image_tensor
     
     except Exception as e:
         error_trace = traceback.format_exc()
-        print(f"Error in preprocessing: {str(e)}")
-        print(f"Traceback: {error_trace}")
+        logger.error(f"Error in preprocessing: {str(e)}")
+        logger.error(f"Traceback: {error_trace}")
         raise HTTPException(status_code=400, detail=f"Error preprocessing image: {str(e)}")
 
-def predict_image(image_tensor: torch.Tensor) -> dict:
+def _log_prediction_diagnostics(raw_logit_0, raw_logit_1, prob_class_0, prob_class_1, prediction, confidence,
+                                threshold=0.5):
     """
-    Run inference on the preprocessed image tensor.
-    Returns prediction results.
+    Debug-level sanity checks for a single prediction (constant or degenerate outputs).
     """
-    global model
+    global _last_logits
+    logger.debug("Raw logits: Class 0 = %.4f, Class 1 = %.4f", raw_logit_0, raw_logit_1)
     
-    if model is None:
+    # Check if model is outputting constant values
+    if _last_logits is not None:
+        if abs(_last_logits[0] - raw_logit_0) < 0.01 and abs(_last_logits[1] - raw_logit_1) < 0.01:
+            logger.debug("Model output is constant! Same logits as previous prediction.")
+            logger.debug("This suggests model weights may not be loading correctly or model is broken.")
+    _last_logits = (raw_logit_0, raw_logit_1)
+    
+    logger.debug("Probabilities: Class 0 (AUTHENTIC) = %.4f, Class 1 (TAMPERED) = %.4f", prob_class_0, prob_class_1)
+    logger.debug("Prediction: %s (prob_class_1 = %.4f, threshold = %.4f)", prediction, prob_class_1, threshold)
+    logger.debug("Confidence: %.4f", confidence)
+    
+    # Check if logits are suspicious
+    if abs(raw_logit_0 - raw_logit_1) < 0.1:
+        logger.debug("Logits are very close! Model may not be working correctly.")
+    
+    # Check if model always predicts the same class
+    if prob_class_1 > 0.99:
+        logger.debug("Model always predicting TAMPERED with very high confidence!")
+    elif prob_class_0 > 0.99:
+        logger.debug("Model always predicting AUTHENTIC with very high confidence!")
+
+def _format_prediction(logits: list, probs: list, calibration: Optional[ScoreCalibration] = None) -> dict:
+    """
+    Build the response dict for a single image from its logits and softmax probabilities.
+    
+    With a ``calibration``, ``probs`` are the temperature-scaled probabilities, its
+    threshold decides the prediction and the response has a "calibration" entry.
+    """
+    raw_logit_0, raw_logit_1 = logits[0], logits[1]
+    
+    # Match the training code pattern exactly:
+    # prob = torch.softmax(output, dim=1)[0, 1].item()
+    # label = "FAKE" if prob > 0.5 else "AUTHENTIC"
+    # So: Class 0 = AUTHENTIC, Class 1 = FAKE/TAMPERED
+    prob_class_1 = probs[1]  # Probability of FAKE/TAMPERED
+    prob_class_0 = probs[0]  # Probability of AUTHENTIC
+    
+    # Determine prediction using same logic as training code
+    # label = "FAKE" if prob > 0.5 else "AUTHENTIC" (or the calibrated threshold)
+    threshold = calibration.threshold if calibration is not None else 0.5
+    if prob_class_1 > threshold:
+        prediction = "Tampered"  # FAKE
+        predicted_class_idx = 1
+        confidence = prob_class_1
+    else:
+        prediction = "Authentic"  # AUTHENTIC
+        predicted_class_idx = 0
+        confidence = prob_class_0
+    
+    # Per-prediction diagnostics are skipped entirely unless debug logging is on
+    if logger.isEnabledFor(logging.DEBUG):
+        _log_prediction_diagnostics(raw_logit_0, raw_logit_1, prob_class_0, prob_class_1, prediction, confidence,
+                                    threshold)
+    
+    result = {
+        "prediction": prediction,
+        "class": predicted_class_idx,
+        "confidence": round(confidence, 4),
+        "probabilities": {
+            "authentic": round(prob_class_0, 4),  # Class 0 = AUTHENTIC
+            "tampered": round(prob_class_1, 4)    # Class 1 = TAMPERED/FAKE
+        },
+        "raw_logits": {
+            "class_0": round(raw_logit_0, 4),  # Class 0 = AUTHENTIC
+            "class_1": round(raw_logit_1, 4)   # Class 1 = TAMPERED/FAKE
+        }
+    }
+    if calibration is not None:
+        result["calibration"] = calibration.describe()
+    return result
+
+def predict_batch(batch_tensor: torch.Tensor, version=None) -> list:
+    """
+    Run a single forward pass over a batch of preprocessed images.
+    
+    Args:
+        batch_tensor: Tensor of shape (N, 3, 224, 224)
+        version: registry.ModelVersion to run (default: the module-level model)
+    
+    Returns:
+        List of N prediction dicts, one per row, in the same format as predict_image.
+    """
+    served_model = version.model if version is not None else model
+    calibration = score_calibration(version)
+    
+    if served_model is None:
         raise HTTPException(status_code=500, detail="Model not loaded. Please load the model first.")
     
     try:
         # Set model to evaluation mode
-        model.eval()
+        served_model.eval()
         
         # Disable gradient computation for inference
-        with torch.no_grad():
+        metrics.BATCH_SIZE.observe(batch_tensor.shape[0])
+        with torch.no_grad(), metrics.STAGE_SECONDS.labels("forward").time():
             # Forward pass
-            outputs = model(image_tensor)
-            
-            # DEBUG: Print raw logits
-            global _last_logits
-            raw_logit_0 = outputs[0][0].item()
-            raw_logit_1 = outputs[0][1].item()
-            print(f"DEBUG - Raw logits: Class 0 = {raw_logit_0:.4f}, Class 1 = {raw_logit_1:.4f}")
-            
-            # Check if model is outputting constant values
-            if _last_logits is not None:
-                if abs(_last_logits[0] - raw_logit_0) < 0.01 and abs(_last_logits[1] - raw_logit_1) < 0.01:
-                    print(f"WARNING: Model output is constant! Same logits as previous prediction.")
-                    print(f"WARNING: This suggests model weights may not be loading correctly or model is broken.")
-            _last_logits = (raw_logit_0, raw_logit_1)
-            
-            # Match the training code pattern exactly:
-            # prob = torch.softmax(output, dim=1)[0, 1].item()
-            # label = "FAKE" if prob > 0.5 else "AUTHENTIC"
-            # So: Class 0 = AUTHENTIC, Class 1 = FAKE/TAMPERED
+            outputs = served_model(batch_tensor)
             
-            # Get probabilities using softmax (same as training code)
-            probabilities = torch.softmax(outputs, dim=1)
-            
-            # Get probability of class 1 (FAKE/TAMPERED) - matching training code
-            prob_class_1 = probabilities[0, 1].item()  # Probability of FAKE/TAMPERED
-            prob_class_0 = probabilities[0, 0].item()  # Probability of AUTHENTIC
-            
-            print(f"DEBUG - Probabilities: Class 0 (AUTHENTIC) = {prob_class_0:.4f}, Class 1 (TAMPERED) = {prob_class_1:.4f}")
-            
-            # Determine prediction using same logic as training code
-            # label = "FAKE" if prob > 0.5 else "AUTHENTIC"
-            if prob_class_1 > 0.5:
-                prediction = "Tampered"  # FAKE
-                predicted_class_idx = 1
-                confidence = prob_class_1
-            else:
-                prediction = "Authentic"  # AUTHENTIC
-                predicted_class_idx = 0
-                confidence = prob_class_0
-            
-            print(f"DEBUG - Prediction: {prediction} (prob_class_1 = {prob_class_1:.4f}, threshold = 0.5)")
-            print(f"DEBUG - Confidence: {confidence:.4f}")
-            
-            # Check if logits are suspicious
-            if abs(raw_logit_0 - raw_logit_1) < 0.1:
-                print(f"WARNING: Logits are very close! Model may not be working correctly.")
-            
-            # Check if model always predicts the same class
-            if prob_class_1 > 0.99:
-                print(f"WARNING: Model always predicting TAMPERED with very high confidence!")
-            elif prob_class_0 > 0.99:
-                print(f"WARNING: Model always predicting AUTHENTIC with very high confidence!")
-            
-            return {
-                "prediction": prediction,
-                "class": predicted_class_idx,
-                "confidence": round(confidence, 4),
-                "probabilities": {
-                    "authentic": round(prob_class_0, 4),  # Class 0 = AUTHENTIC
-                    "tampered": round(prob_class_1, 4)    # Class 1 = TAMPERED/FAKE
-                },
-                "raw_logits": {
-                    "class_0": round(raw_logit_0, 4),  # Class 0 = AUTHENTIC
-                    "class_1": round(raw_logit_1, 4)   # Class 1 = TAMPERED/FAKE
-                }
-            }
+            # Get probabilities using softmax (same as training code), temperature-scaled
+            # when the version is calibrated; raw_logits stay unscaled
+            probabilities = torch.softmax(outputs / calibration.temperature if calibration else outputs, dim=1)
+        
+        # One device->host copy for the whole batch instead of per-value .item() calls
+        logits = outputs.tolist()
+        probs = probabilities.tolist()
+        
+        return [_format_prediction(row_logits, row_probs, calibration) for row_logits, row_probs in zip(logits, probs)]
     
     except Exception as e:
         error_trace = traceback.format_exc()
-        print(f"Error during prediction: {str(e)}")
-        print(f"Traceback: {error_trace}")
+        logger.error(f"Error during prediction: {str(e)}")
+        logger.error(f"Traceback: {error_trace}")
         raise HTTPException(status_code=500, detail=f"Error during prediction: {str(e)}")
 
+def combine_ensemble(results: list, qualities: tuple, calibration: Optional[ScoreCalibration] = None) -> dict:
+    """
+    Merge the per-quality predictions of a multi-quality ELA ensemble (test-time
+    augmentation): logits and probabilities are averaged over the qualities.
+    
+    Returns a prediction dict in the /predict format plus an "ela_ensemble" entry with
+    the per-quality probabilities of the tampered class.
+    """
+    logits = [sum(r["raw_logits"][f"class_{c}"] for r in results) / len(results) for c in (0, 1)]
+    probs = [
+        sum(r["probabilities"]["authentic"] for r in results) / len(results),
+        sum(r["probabilities"]["tampered"] for r in results) / len(results),
+    ]
+    tampered = [r["probabilities"]["tampered"] for r in results]
+    return dict(_format_prediction(logits, probs, calibration), ela_ensemble={
+        "qualities": list(qualities),
+        "tampered_probabilities": dict(zip((str(q) for q in qualities), tampered)),
+        "spread": round(max(tampered) - min(tampered), 4),
+    })
+
+def predict_image(image_tensor: torch.Tensor) -> dict:
+    """
+    Run inference on the preprocessed image tensor.
+    Returns prediction results.
+    """
+    return predict_batch(image_tensor)[0]
+
+# Results cache keyed by upload hash + model fingerprint
+cache = PredictionCache(
+    max_bytes=int(CACHE_MAX_MB * 1024 * 1024),
+    ttl_seconds=CACHE_TTL_SECONDS,
+    db_path=CACHE_DB_PATH,
+    db_max_entries=CACHE_DB_MAX_ENTRIES,
+)
+
+# Per-model score calibrations by checkpoint fingerprint (see SCORE_CALIBRATION)
+score_calibrations = {}
+
+def score_calibration(version=None) -> Optional[ScoreCalibration]:
+    """
+    Calibration of a model version, or None if it has none.
+    
+    Args:
+        version: registry.ModelVersion (default: the module-level model)
+    """
+    return score_calibrations.get(version.fingerprint if version is not None else model_fingerprint)
+
+def decision_threshold(version=None) -> float:
+    """Tampered-probability threshold of a model version (0.5 unless calibrated)."""
+    calibration = score_calibration(version)
+    return calibration.threshold if calibration is not None else 0.5
+
+def cache_fingerprint(version=None) -> str:
+    """
+    Namespace for cache keys: the model fingerprint plus any preprocessing setting that
+    changes results, so deployments sharing a disk tier never mix their entries.
+    
+    Args:
+        version: registry.ModelVersion (default: the module-level model)
+    """
+    fingerprint = version.fingerprint if version is not None else model_fingerprint
+    runtime_info = version.runtime if version is not None else model_runtime
+    return result_namespace(fingerprint, runtime_info, ELA_WORKING_SIZE, score_calibration(version))
+
+# Perceptual-hash index of scored images (see NEAR_DUP_MODE), and how many of its
+# entries were loaded from NEAR_DUP_INDEX (the rest were added by this process)
+near_duplicate_index = NearDuplicateIndex()
+near_duplicate_loaded = 0
+
+# Executors for ELA preprocessing and inference, plus admission control
+pipeline = InferencePipeline(
+    ela_workers=ELA_WORKERS,
+    ela_initializer=ela_worker.configure,
+    ela_initargs=(ELA_WORKER_SETTINGS,),
+    inference_workers=INFERENCE_WORKERS,
+    max_queue_depth=MAX_QUEUE_DEPTH,
+)
+
+def warmup_version(version):
+    """
+    Run real ELA batches (calibration images or synthetic photos) through a new model
+    version before it takes traffic, at the sizes the batcher produces, so first
+    requests do not pay for lazy initialization, allocator growth or TorchScript
+    profiling runs. A version producing non-finite outputs is rejected.
+    """
+    batch = calibration_batch(RUNTIME_CALIBRATION_DIR, size=BATCH_MAX_SIZE).to(device)
+    with torch.no_grad():
+        for _ in range(MODEL_WARMUP_ROUNDS):
+            for rows in sorted({1, len(batch)}):
+                outputs = version.model(batch[:rows])
+                if not torch.isfinite(outputs).all():
+                    raise ValueError("Model produced non-finite outputs during warmup")
+
+def make_version_batcher(version):
+    """Micro-batcher for one model version: concurrent /predict requests share a forward pass."""
+    return MicroBatcher(
+        functools.partial(predict_batch, version=version),
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        executor=pipeline.inference_executor,
+    )
+
+def on_registry_change(changed):
+    """Mirror the active version into the module-level globals and drop stale cache entries."""
+    global model, model_fingerprint, model_runtime
+    active = changed.versions.get(changed.active)
+    if active is not None:
+        model, model_fingerprint, model_runtime = active.model, active.fingerprint, active.runtime
+    # Memory-tier entries of versions that are no longer resident can never be hit here
+    # again (the shared disk tier is pruned by age only)
+    cache.invalidate(keep_fingerprints={cache_fingerprint(v) for v in changed.versions.values()})
+
+# Named model versions, loaded and swapped in the background
+registry = ModelRegistry(
+    build=build_model,
+    warmup=warmup_version,
+    make_batcher=make_version_batcher,
+    max_versions=MAX_MODEL_VERSIONS,
+    on_change=on_registry_change,
+)
+
+def resolve_model_path(model_path: str) -> str:
+    """
+    Resolve a client-supplied checkpoint path, which must name an existing file inside
+    one of MODEL_DIRS (relative paths are taken relative to the first one).
+    """
+    path = os.path.realpath(os.path.join(MODEL_DIRS[0], model_path))
+    if not any(os.path.commonpath([path, d]) == d for d in MODEL_DIRS):
+        raise HTTPException(status_code=403, detail="model_path must be inside the configured model directories")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Model file not found: {model_path}")
+    return path
+
+# Background shadow-scoring tasks (kept referenced until they finish)
+_shadow_tasks = set()
+
+async def shadow_score(image_tensor: torch.Tensor, served: dict, shadow: str):
+    """Score an image with the shadow version ``shadow`` and compare it with the served result."""
+    try:
+        async with registry.acquire(shadow) as version:
+            result = (await version.batcher.submit(image_tensor))[0]
+        registry.record_shadow(served, result)
+        if result["class"] != served["class"]:
+            logger.debug(f"Shadow version {version.name} disagrees: {result['prediction']} vs {served['prediction']}")
+    except Exception as e:
+        logger.warning(f"Shadow scoring failed: {str(getattr(e, 'detail', e))}")
+
+def start_shadow_score(image_tensor: torch.Tensor, served: dict, shadow: Optional[str]):
+    """
+    Start shadow scoring of a served image.
+
+    Args:
+        shadow: Shadow version when the request was admitted (None = no shadow
+            traffic, even if one was set since)
+    """
+    # Shadow traffic is best effort: skip it when the pipeline is saturated
+    if shadow is None or pipeline.in_flight >= pipeline.max_queue_depth:
+        return
+    task = asyncio.create_task(shadow_score(image_tensor, served, shadow))
+    _shadow_tasks.add(task)
+    task.add_done_callback(_shadow_tasks.discard)
+
+async def run_ela_timed(image_bytes: bytes, qualities: Optional[tuple] = None, perceptual: bool = False):
+    """
+    Run compute_ela_array in the ELA pool and record decode, ELA and pool overhead
+    (queueing plus transfer to and from the worker) latencies.
+    
+    Returns:
+        (ELA array, perceptual hash or None)
+    """
+    start = time.perf_counter()
+    ela_array, decode_s, ela_s, image_hash = await pipeline.run_ela(
+        compute_ela_timed, image_bytes, None, None, qualities, perceptual
+    )
+    metrics.STAGE_SECONDS.labels("decode").observe(decode_s)
+    metrics.STAGE_SECONDS.labels("ela").observe(ela_s)
+    metrics.STAGE_SECONDS.labels("ela_queue").observe(max(0.0, time.perf_counter() - start - decode_s - ela_s))
+    return ela_array, image_hash
+
+# Room for multipart boundaries and part headers on top of the file size limits
+MULTIPART_OVERHEAD = 64 * 1024
+
+def _megabytes(mb: float) -> int:
+    return int(mb * 1024 * 1024)
+
+def request_body_limit(path: str) -> Optional[int]:
+    """Maximum request body size of an endpoint in bytes (None = no limit)."""
+    if path == "/predict" and UPLOAD_MAX_MB:
+        return _megabytes(UPLOAD_MAX_MB) + MULTIPART_OVERHEAD
+    if path in ("/predict/batch", "/jobs") and UPLOAD_REQUEST_MAX_MB:
+        return _megabytes(UPLOAD_REQUEST_MAX_MB)
+    if path == "/predict/video" and VIDEO_MAX_MB:
+        return _megabytes(VIDEO_MAX_MB) + MULTIPART_OVERHEAD
+    return None
+
+async def read_image_upload(file: UploadFile) -> memoryview:
+    """Read one uploaded image through the upload checks (see uploads.read_upload)."""
+    return await read_upload(file, _megabytes(UPLOAD_MAX_MB), MAX_IMAGE_PIXELS, UPLOAD_FORMATS)
+
+async def collect_uploads(files: List[UploadFile], max_files: int):
+    """
+    Read uploaded files into (filename, bytes) items, expanding zip/tar archives.
+    
+    Returns:
+        (items, errors): errors maps the index of each upload (or archive member) that
+        is not an acceptable image to a message
+    
+    Raises:
+        HTTPException: 400 for an archive whose directory or first header is
+            unreadable (unreadable members are per-item errors), 413 above
+            ``max_files`` images (counting unreadable archive members) or above
+            ARCHIVE_MAX_MB uncompressed
+    """
+    items = []
+    errors = {}
+    for file in files:
+        if is_archive(file.filename, file.content_type):
+            try:
+                members = await asyncio.to_thread(
+                    extract_images, file.file, max_files - len(items), int(ARCHIVE_MAX_MB * 1024 * 1024)
+                )
+            except ArchiveLimitExceeded as e:
+                raise HTTPException(status_code=413, detail=f"Error reading archive {file.filename}: {str(e)}")
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Error reading archive {file.filename}: {str(e)}")
+            for name, data, error in members:
+                if error is not None:
+                    errors[len(items)] = error
+                else:
+                    try:
+                        check_image(data, UPLOAD_FORMATS, MAX_IMAGE_PIXELS)
+                    except HTTPException as e:
+                        errors[len(items)] = e.detail
+                        data = b""
+                items.append((name, data))
+        elif not file.content_type or not file.content_type.startswith('image/'):
+            errors[len(items)] = "File must be an image"
+            items.append((file.filename, b""))
+        else:
+            try:
+                items.append((file.filename, await read_image_upload(file)))
+            except HTTPException as e:
+                errors[len(items)] = e.detail
+                items.append((file.filename, b""))
+        
+        if len(items) > max_files:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Too many images in one request (maximum {max_files})"
+            )
+    return items, errors
+
+async def score_images(images: List[bytes], version, qualities: Optional[tuple] = None,
+                       ela_slots: Optional[asyncio.Semaphore] = None, background: bool = False) -> list:
+    """
+    Score many uploaded images with one model version: repeated images are answered
+    from the cache, the rest are preprocessed in parallel in the ELA pool and run
+    through the model in fixed-size batches.
+    
+    Args:
+        images: Raw image bytes
+        version: registry.ModelVersion (pinned by the caller)
+        qualities: Optional multi-quality ELA ensemble, as for /predict
+        ela_slots: Optional bound on this caller's images queued in the ELA pool at
+            once, so background work never builds a backlog ahead of interactive
+            requests
+        background: Run the batches through the version's batcher at low priority
+            (after any waiting /predict request) instead of the inference executor
+    
+    Returns:
+        One (result, error message) pair per image, in order; exactly one is None.
+    """
+    results = [None] * len(images)
+    errors = {}
+    cache_keys = [None] * len(images)
+    
+    # Answer repeated images from the cache
+    for i, image_bytes in enumerate(images):
+        if len(image_bytes) == 0:
+            errors[i] = "Empty file uploaded"
+            continue
+        if cache.enabled:
+            digest = await asyncio.to_thread(content_hash, image_bytes)
+            cache_keys[i] = cache.make_key(request_digest(digest, qualities), cache_fingerprint(version))
+            results[i] = await cache.lookup(cache_keys[i])
+    
+    # Preprocess the remaining images in parallel in the ELA pool
+    async def preprocess(image_bytes):
+        if ela_slots is None:
+            return await run_ela_timed(image_bytes, qualities)
+        async with ela_slots:
+            return await run_ela_timed(image_bytes, qualities)
+    
+    pending = [i for i in range(len(images)) if i not in errors and results[i] is None]
+    ela_results = await asyncio.gather(
+        *(preprocess(images[i]) for i in pending),
+        return_exceptions=True
+    )
+    ready = []
+    for i, ela_result in zip(pending, ela_results):
+        if isinstance(ela_result, Exception):
+            errors[i] = f"Error preprocessing image: {str(getattr(ela_result, 'detail', ela_result))}"
+        else:
+            ready.append((i, ela_result[0]))
+    
+    # Run the model in fixed-size batches (of images; an ensemble image contributes
+    # one row per quality)
+    variants = len(qualities) if qualities else 1
+    images_per_batch = max(1, BATCH_MAX_SIZE // variants)
+    for start in range(0, len(ready), images_per_batch):
+        chunk = ready[start:start + images_per_batch]
+        try:
+            with metrics.STAGE_SECONDS.labels("to_tensor").time():
+                if qualities:
+                    batch = ela_arrays_to_batch(np.concatenate([ela_array for _, ela_array in chunk]))
+                else:
+                    batch = ela_arrays_to_batch([ela_array for _, ela_array in chunk])
+            if background:
+                chunk_results = await version.batcher.submit(batch, low_priority=True)
+            else:
+                chunk_results = await pipeline.run_inference(predict_batch, batch, version)
+        except Exception as e:
+            for i, _ in chunk:
+                errors[i] = f"Error during prediction: {str(getattr(e, 'detail', e))}"
+            continue
+        if qualities:
+            chunk_results = [
+                combine_ensemble(chunk_results[k * variants:(k + 1) * variants], qualities, score_calibration(version))
+                for k in range(len(chunk))
+            ]
+        for (i, _), result in zip(chunk, chunk_results):
+            results[i] = result
+            if cache_keys[i] is not None:
+                cache.put(cache_keys[i], result)
+    
+    return [(None, errors[i]) if i in errors else (results[i], None) for i in range(len(images))]
+
+async def score_job_claim(claim: dict) -> list:
+    """
+    Score images claimed from the job queue (see jobs.JobWorkers). The claim holds a
+    pipeline slot like a request; when none is free it goes back in the queue.
+    """
+    qualities = tuple(claim["options"].get("ela_qualities") or ()) or None
+    if pipeline.in_flight >= pipeline.max_queue_depth:
+        raise ClaimDeferred()
+    async with pipeline.admit(background=True), registry.acquire(claim["model_version"]) as version:
+        outcomes = await score_images([data for _, _, data in claim["items"]], version, qualities,
+                                      job_ela_slots, background=True)
+    return [
+        (idx, dict(result, model_version=version.name) if error is None else None, error)
+        for (idx, _, _), (result, error) in zip(claim["items"], outcomes)
+    ]
+
+def job_capacity() -> bool:
+    """Job workers only take new images while a model is loaded and interactive load is light."""
+    return registry.active is not None and pipeline.interactive_in_flight < JOB_YIELD_IN_FLIGHT
+
+# Job queue and its background workers (created at startup when JOB_DB is set); job
+# images queued in the ELA pool are limited to one per ELA worker
+job_store = None
+job_workers = None
+job_ela_slots = None
+
+def _take(frames: Iterator, count: int) -> list:
+    return list(itertools.islice(frames, count))
+
+async def score_video(
+    sampler: "video.FrameSampler",
+    version=None,
+    early_exit: bool = True,
+    min_frames: int = VIDEO_MIN_FRAMES,
+    decisive: float = VIDEO_DECISIVE,
+) -> dict:
+    """
+    Score the frames of a clip and aggregate them into a verdict.
+    
+    Frames are decoded in windows of BATCH_MAX_SIZE sampled frames: while one window
+    goes through the ELA pool (in parallel) and a single forward pass, the next one is
+    already being decoded, so at most two windows of frames are in memory. With
+    ``early_exit``, decoding stops as soon as the mean score is decisive.
+    
+    Args:
+        sampler: video.FrameSampler over the clip
+        version: registry.ModelVersion to run (default: the module-level model)
+    
+    Returns:
+        {"verdict", "frames", "sampling", "early_exit"}; every entry of "frames" has
+        the frame index, its timestamp and the prediction (as for /predict).
+    
+    Raises:
+        ValueError: If the clip cannot be decoded or no frame was scored.
+        video.VideoBackendUnavailable: If the clip needs PyAV and it is not installed.
+    """
+    frames = iter(sampler)
+    results = []
+    stopped_early = False
+    next_window = asyncio.ensure_future(asyncio.to_thread(_take, frames, BATCH_MAX_SIZE))
+    try:
+        while True:
+            window = await next_window
+            if not window:
+                break
+            # Decode the next window while this one is scored
+            next_window = asyncio.ensure_future(asyncio.to_thread(_take, frames, BATCH_MAX_SIZE))
+            with metrics.STAGE_SECONDS.labels("ela").time():
+                ela_arrays = await asyncio.gather(*(pipeline.run_ela(compute_frame_ela, rgb) for _, _, rgb in window))
+            with metrics.STAGE_SECONDS.labels("to_tensor").time():
+                batch = ela_arrays_to_batch(ela_arrays)
+            window_results = await pipeline.run_inference(predict_batch, batch, version)
+            results.extend(
+                dict(result, frame=index, time_s=timestamp)
+                for (index, timestamp, _), result in zip(window, window_results)
+            )
+            tampered = [r["probabilities"]["tampered"] for r in results]
+            if early_exit and video.is_decisive(tampered, min_frames, decisive):
+                stopped_early = True
+                break
+    finally:
+        # The generator may still be running in the decode thread; let it finish first
+        if not next_window.done():
+            try:
+                await next_window
+            except Exception:
+                pass
+        await asyncio.to_thread(getattr(frames, "close", lambda: None))
+    
+    return {
+        "verdict": video.aggregate(results, decision_threshold(version)),
+        "frames": results,
+        "sampling": sampler.describe(),
+        "early_exit": stopped_early,
+    }
+
+@contextmanager
+def track_request(endpoint: str):
+    """
+    Record latency and outcome of a prediction request. The block may set
+    ``outcome["value"]`` (e.g. "cached"); exceptions are classified by status code.
+    """
+    outcome = {"value": "ok"}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    except HTTPException as e:
+        outcome["value"] = "rejected" if e.status_code == 503 else "client_error" if e.status_code < 500 else "error"
+        raise
+    except Exception:
+        outcome["value"] = "error"
+        raise
+    finally:
+        metrics.REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+        metrics.REQUESTS.labels(endpoint, outcome["value"]).inc()
+
+# Scrape-time views of state owned by the pipeline, cache and registry
+metrics.Gauge("veriframe_in_flight_requests", "Requests currently admitted to the pipeline",
+              function=lambda: pipeline.in_flight)
+metrics.Gauge("veriframe_max_queue_depth", "Maximum number of requests admitted at once",
+              function=lambda: pipeline.max_queue_depth)
+metrics.Counter("veriframe_rejected_requests_total", "Requests rejected with 503 because the pipeline was full",
+                function=lambda: pipeline.rejected)
+metrics.Gauge("veriframe_ela_workers", "ELA worker processes (threads when ELA runs in-process)",
+              function=lambda: pipeline.ela_workers or (os.cpu_count() or 1))
+metrics.Gauge("veriframe_inference_workers", "Threads in the inference executor",
+              function=lambda: pipeline.inference_workers)
+metrics.Counter("veriframe_cache_hits_total", "Prediction cache hits", function=lambda: cache.hits)
+metrics.Counter("veriframe_cache_misses_total", "Prediction cache misses", function=lambda: cache.misses)
+metrics.Counter("veriframe_cache_evictions_total", "Prediction cache memory-tier evictions",
+                function=lambda: cache.evictions)
+metrics.Gauge("veriframe_cache_entries", "Entries in the prediction cache memory tier",
+              function=lambda: cache.stats()["entries"])
+metrics.Gauge("veriframe_cache_bytes", "Bytes used by the prediction cache memory tier",
+              function=lambda: cache.stats()["bytes"])
+metrics.Gauge("veriframe_near_duplicate_entries", "Images in the near-duplicate index",
+              function=lambda: len(near_duplicate_index))
+metrics.Gauge("veriframe_job_pending_items", "Images of queued jobs waiting to be scored",
+              function=lambda: job_store.stats()["pending_items"] if job_store else 0)
+metrics.Gauge("veriframe_job_running_items", "Images of jobs currently being scored (all processes)",
+              function=lambda: job_store.stats()["running_items"] if job_store else 0)
+metrics.Counter("veriframe_job_items_scored_total", "Job images scored by this process",
+                function=lambda: job_workers.scored if job_workers else 0)
+metrics.Gauge("veriframe_model_version_in_flight", "Requests currently pinned to each model version",
+              ["version"], function=lambda: {(v.name,): v.in_flight for v in registry.versions.values()})
+metrics.Gauge("veriframe_model_version_active", "1 for the active model version, 0 for other resident versions",
+              ["version"], function=lambda: {(v.name,): int(v.name == registry.active) for v in registry.versions.values()})
+
+def write_worker_status():
+    """Atomically replace WORKER_STATUS_FILE with the current health snapshot."""
+    status = dict(health_status(), pid=os.getpid(), timestamp=time.time(), requests={
+        values[0] + "/" + values[1]: child.value for values, child in list(metrics.REQUESTS._children.items())
+    })
+    tmp = f"{WORKER_STATUS_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(status, f, default=str)
+    os.replace(tmp, WORKER_STATUS_FILE)
+
+async def report_worker_status():
+    while True:
+        try:
+            write_worker_status()
+        except Exception as e:
+            logger.warning(f"Could not write worker status: {e}")
+        await asyncio.sleep(WORKER_STATUS_INTERVAL)
+
+_status_task = None
+
 @app.on_event("startup")
 async def startup_event():
     """Load the local PyTorch model when the application starts."""
-    global model
+    global _status_task, near_duplicate_index, near_duplicate_loaded, job_store, job_workers, job_ela_slots, score_calibrations
+    pipeline.start()
+    if WORKER_STATUS_FILE:
+        _status_task = asyncio.create_task(report_worker_status())
+    if NEAR_DUP_MODE != "off" and NEAR_DUP_INDEX and os.path.exists(NEAR_DUP_INDEX):
+        try:
+            near_duplicate_index = await asyncio.to_thread(NearDuplicateIndex.load, NEAR_DUP_INDEX)
+            near_duplicate_loaded = len(near_duplicate_index)
+            logger.info(f"Loaded near-duplicate index with {len(near_duplicate_index)} entries")
+        except Exception as e:
+            logger.warning(f"Could not load near-duplicate index {NEAR_DUP_INDEX}: {e}")
+    if SCORE_CALIBRATION:
+        try:
+            score_calibrations = load_calibrations(SCORE_CALIBRATION)
+            logger.info(f"Loaded score calibrations for {len(score_calibrations)} model(s) from {SCORE_CALIBRATION}")
+        except Exception as e:
+            logger.warning(f"Could not load score calibration {SCORE_CALIBRATION}: {e}")
+        for calibration in score_calibrations.values():
+            if calibration.info.get("ela_working_size", 0) != ELA_WORKING_SIZE:
+                logger.warning(
+                    f"Calibration of {calibration.info.get('model', calibration.fingerprint)} was fitted with ELA "
+                    f"working size {calibration.info.get('ela_working_size', 0)}, not {ELA_WORKING_SIZE}"
+                )
+    logger.info(f"Micro-batching enabled (max batch size {BATCH_MAX_SIZE}, max wait {BATCH_MAX_WAIT_MS} ms)")
     try:
-        print("=" * 50)
-        print("Starting VeriFrame API")
-        print("=" * 50)
-        model = load_model()
-        print("=" * 50)
-        print("API ready to accept requests")
-        print("=" * 50)
+        logger.info("=" * 50)
+        logger.info("Starting VeriFrame API")
+        logger.info("=" * 50)
+        await registry.load(DEFAULT_MODEL_VERSION, MODEL_PATH)
+        if SCORE_CALIBRATION and score_calibration() is None:
+            logger.warning(f"No score calibration for model version {registry.active}; using threshold 0.5")
+        logger.info("=" * 50)
+        logger.info("API ready to accept requests")
+        logger.info("=" * 50)
     except Exception as e:
-        print(f"Error loading model on startup: {str(e)}")
-        print("The API will still start, but predictions will fail until the model is loaded.")
-        print("You can try to load the model manually using the /load-model endpoint.")
+        logger.error(f"Error loading model on startup: {str(e)}")
+        logger.info("The API will still start, but predictions will fail until the model is loaded.")
+        logger.info("You can try to load the model manually using the /load-model endpoint.")
+    if JOB_DB:
+        try:
+            # Jobs interrupted by a restart resume here
+            job_store = JobStore(JOB_DB)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Job queue disabled: cannot open {JOB_DB}: {e}")
+    if job_store is not None:
+        job_ela_slots = asyncio.Semaphore(pipeline.ela_workers or (os.cpu_count() or 1))
+        job_workers = JobWorkers(
+            job_store, score_job_claim, workers=JOB_WORKERS, claim_size=JOB_CLAIM_SIZE,
+            can_run=job_capacity, max_age_seconds=JOB_RETENTION_SECONDS,
+        )
+        await job_workers.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the background batching task and worker pools."""
+    if _status_task is not None:
+        _status_task.cancel()
+    if NEAR_DUP_MODE != "off" and NEAR_DUP_INDEX:
+        try:
+            # Merged with the file, which other workers sharing it may have updated since
+            await asyncio.to_thread(near_duplicate_index.save_merged, NEAR_DUP_INDEX, near_duplicate_loaded)
+        except Exception as e:
+            logger.warning(f"Could not save near-duplicate index {NEAR_DUP_INDEX}: {e}")
+    if job_workers is not None:
+        await job_workers.shutdown()
+        job_store.close()
+    await registry.shutdown()
+    pipeline.shutdown()
+    # Results still queued for the disk cache tier
+    await asyncio.to_thread(cache.close)
 
 @app.get("/")
 async def root():
@@ -430,11 +1369,18 @@ async def root():
     }
 
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
+async def predict(file: UploadFile = File(...), model_version: Optional[str] = None,
+                  ela_qualities: Optional[str] = None, localize: bool = False):
     """
     Predict whether an uploaded image is Authentic or Tampered.
     
     - **file**: Image file (JPEG, PNG, etc.)
+    - **model_version**: Resident model version to use (default: the active version)
+    - **ela_qualities**: Optional comma-separated JPEG qualities (e.g. "75,85,90,95").
+      The image is decoded once, ELA is computed at every quality and all variants are
+      scored in one forward pass; the result averages them.
+    - **localize**: Also score overlapping 224x224 patches of the full-resolution ELA
+      map and return a coarse tamper heatmap with the most suspicious regions
     
     Returns:
     - prediction: "Authentic" or "Tampered"
@@ -442,69 +1388,431 @@ async def predict(file: UploadFile = File(...)):
     - confidence: Confidence score for the prediction
     - probabilities: Probability scores for both classes
     - raw_logits: Raw model output before softmax
+    - model_version: Name of the model version that produced the result
+    - ela_ensemble: Per-quality tampered probabilities (only with ela_qualities)
+    - localization: Heatmap, patch grid and top regions (only with localize)
     """
-    # Check if model is loaded
-    if model is None:
-        raise HTTPException(
-            status_code=503, 
-            detail="Model not loaded. Please wait for the model to load or use /load-model endpoint."
-        )
+    with track_request("predict") as outcome:
+        # Check if model is loaded (and the requested version exists)
+        registry.get(model_version)
+        qualities = parse_ela_qualities(ela_qualities)
+        
+        # Validate file type
+        if not file.content_type or not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="File must be an image")
+        
+        localization_task = None
+        try:
+            # The version is pinned for the whole request, so a concurrent hot-swap
+            # never changes the model under it
+            async with pipeline.admit(), registry.acquire(model_version) as version:
+                # Shadow version this request was admitted under (it may be cleared or
+                # changed before the request finishes)
+                shadow = registry.shadow
+                
+                # Check size, format and dimensions from the first chunk, then read
+                # the upload once into a buffer the decoder uses without copying
+                image_bytes = await read_image_upload(file)
+                
+                # Repeated uploads are answered from the cache without decoding
+                cache_key = None
+                if cache.enabled:
+                    digest = await asyncio.to_thread(content_hash, image_bytes)
+                    cache_key = cache.make_key(request_digest(digest, qualities, localize), cache_fingerprint(version))
+                    cached = await cache.lookup(cache_key)
+                    if cached is not None:
+                        outcome["value"] = "cached"
+                        return JSONResponse(content=dict(cached, model_version=version.name))
+                
+                # Preprocess image in the ELA worker pool (patches for localization
+                # are cut in parallel)
+                localization_task = asyncio.ensure_future(localize_image(image_bytes, version)) if localize else None
+                near_dup = NEAR_DUP_MODE != "off" and not qualities
+                try:
+                    ela_array, image_hash = await run_ela_timed(image_bytes, qualities, perceptual=near_dup)
+                except HTTPException:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error in preprocessing: {str(e)}")
+                    raise HTTPException(status_code=400, detail=f"Error preprocessing image: {str(e)}")
+                with metrics.STAGE_SECONDS.labels("to_tensor").time():
+                    image_tensor = ela_arrays_to_batch(ela_array) if qualities else ela_to_tensor(ela_array)
+                
+                # Make prediction (batched with other concurrent requests; the
+                # variants of an ensemble always share one forward pass)
+                # Off the event loop: a lookup waits while the index folds in new entries
+                match = await asyncio.to_thread(find_near_duplicate, image_hash, version) if near_dup else None
+                if match is not None and match["reused"]:
+                    # Re-encoded or resized copy of an image this model already scored
+                    result = dict(
+                        _format_prediction(match.pop("logits"), match.pop("probabilities"), score_calibration(version)),
+                        near_duplicate=match,
+                    )
+                elif qualities:
+                    result = combine_ensemble(await version.batcher.submit(image_tensor), qualities,
+                                              score_calibration(version))
+                else:
+                    result = (await version.batcher.submit(image_tensor))[0]
+                    if near_dup:
+                        if match is not None:
+                            result = dict(result, near_duplicate=match)
+                        if match is None or match["distance"] > 0 or not match["same_model"]:
+                            await asyncio.to_thread(
+                                near_duplicate_index.add, image_hash, result, cache_fingerprint(version), file.filename or ""
+                            )
+                if localization_task is not None:
+                    try:
+                        result = dict(result, localization=await localization_task)
+                    except HTTPException:
+                        raise
+                    except Exception as e:
+                        logger.error(f"Error in localization: {str(e)}")
+                        raise HTTPException(status_code=400, detail=f"Error localizing image: {str(e)}")
+                
+                if cache_key is not None:
+                    cache.put(cache_key, result)
+                if model_version is None and not qualities and not (match and match["reused"]):
+                    start_shadow_score(image_tensor, result, shadow)
+            
+            return JSONResponse(content=dict(result, model_version=version.name))
+        
+        except HTTPException:
+            raise
+        except Exception as e:
+            # Log the full error for debugging
+            error_trace = traceback.format_exc()
+            logger.error(f"Error in prediction: {str(e)}")
+            logger.error(f"Traceback: {error_trace}")
+            raise HTTPException(
+                status_code=500, 
+                detail=f"Internal server error: {str(e)}"
+            )
+        finally:
+            # Do not leave localization running for a request that already failed
+            if localization_task is not None and not localization_task.done():
+                localization_task.cancel()
+
+@app.post("/predict/batch")
+async def predict_batch_upload(files: List[UploadFile] = File(...), model_version: Optional[str] = None,
+                               ela_qualities: Optional[str] = None):
+    """
+    Predict many images in one request.
     
-    # Validate file type
-    if not file.content_type or not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
+    - **files**: Several image files, or a single zip/tar archive of images
+    - **model_version**: Resident model version to use (default: the active version)
+    - **ela_qualities**: Optional multi-quality ELA ensemble, as for /predict
     
-    try:
-        # Read image bytes
-        image_bytes = await file.read()
+    Images are preprocessed in parallel and run through the model in fixed-size
+    batches. A file that fails does not fail the batch; it gets an error entry instead.
+    
+    Returns:
+    - count / succeeded / failed: Item counts
+    - model_version: Name of the model version that scored every image
+    - results: One entry per image, in upload (or archive) order, with the filename
+      and either "result" (same format as /predict) or "error"
+    """
+    with track_request("predict_batch"):
+        registry.get(model_version)
+        qualities = parse_ela_qualities(ela_qualities)
         
-        if len(image_bytes) == 0:
-            raise HTTPException(status_code=400, detail="Empty file uploaded")
+        async with pipeline.admit(), registry.acquire(model_version) as version:
+            items, errors = await collect_uploads(files, BATCH_MAX_FILES)
+            pending = [i for i in range(len(items)) if i not in errors]
+            outcomes = await score_images([items[i][1] for i in pending], version, qualities)
+            results = [None] * len(items)
+            for i, (result, error) in zip(pending, outcomes):
+                if error is not None:
+                    errors[i] = error
+                else:
+                    results[i] = result
         
-        # Preprocess image
-        image_tensor = preprocess_image(image_bytes)
+        entries = []
+        for i, (name, _) in enumerate(items):
+            if i in errors:
+                entries.append({"filename": name, "error": errors[i]})
+            else:
+                entries.append({"filename": name, "result": dict(results[i], model_version=version.name)})
         
-        # Make prediction
-        result = predict_image(image_tensor)
+        return JSONResponse(content={
+            "count": len(entries),
+            "succeeded": len(entries) - len(errors),
+            "failed": len(errors),
+            "model_version": version.name,
+            "results": entries
+        })
+
+@app.post("/predict/video")
+async def predict_video(
+    file: UploadFile = File(...),
+    model_version: Optional[str] = None,
+    sample: str = VIDEO_SAMPLING,
+    stride: int = VIDEO_STRIDE,
+    scene_threshold: float = VIDEO_SCENE_THRESHOLD,
+    max_frames: int = VIDEO_MAX_FRAMES,
+    early_exit: bool = True,
+):
+    """
+    Score a video clip frame by frame and return an aggregated verdict.
+    
+    - **file**: Video clip (any container/codec FFmpeg reads, via PyAV) or animated GIF/WebP/PNG
+    - **model_version**: Resident model version to use (default: the active version)
+    - **sample**: "stride" (every stride-th frame), "scene" (frames after a scene
+      change) or "keyframes"
+    - **stride** / **scene_threshold**: Parameters of the sampling modes
+    - **max_frames**: Maximum number of frames scored (at most VIDEO_MAX_FRAMES)
+    - **early_exit**: Stop once the mean score of the frames scored so far is decisive
+    
+    Returns:
+    - verdict: Clip prediction (mean tampered probability over the scored frames),
+      with max_tampered, tampered_frames and tampered_fraction
+    - frames: Per-frame predictions with frame index and time_s
+    - sampling: Sampling settings and decoded/sampled frame counts
+    - early_exit: Whether scoring stopped early because the verdict was decisive
+    - model_version: Name of the model version that scored the frames
+    """
+    with track_request("predict_video"):
+        registry.get(model_version)
+        if VIDEO_MAX_MB and file.size is not None and file.size > VIDEO_MAX_MB * 1024 * 1024:
+            raise HTTPException(status_code=413, detail=f"Video is too large (maximum {VIDEO_MAX_MB:g} MB)")
+        max_frames = min(max_frames, VIDEO_MAX_FRAMES) if max_frames > 0 else VIDEO_MAX_FRAMES
+        try:
+            sampler = video.FrameSampler(
+                file.file, mode=sample, stride=stride, scene_threshold=scene_threshold,
+                max_frames=max_frames, working_size=ELA_WORKING_SIZE,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        async with pipeline.admit(), registry.acquire(model_version) as version:
+            try:
+                result = await score_video(sampler, version, early_exit=early_exit)
+            except video.VideoBackendUnavailable as e:
+                raise HTTPException(status_code=501, detail=str(e))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
         
-        return JSONResponse(content=result)
+        return JSONResponse(content=dict(result, filename=file.filename, model_version=version.name))
+
+def job_response(job: dict, results: bool) -> dict:
+    job = dict(job, completed=job["succeeded"] + job["failed"])
+    if results:
+        job["results"] = job_store.results(job["job_id"])
+    return job
+
+def get_job_store() -> JobStore:
+    if job_store is None:
+        raise HTTPException(status_code=503, detail="The job queue is disabled (VERIFRAME_JOB_DB)")
+    return job_store
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    model_version: Optional[str] = None,
+    ela_qualities: Optional[str] = None,
+    priority: str = "normal",
+    x_client_id: Optional[str] = Header(None),
+):
+    """
+    Queue images for background scoring and return a job id immediately.
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        # Log the full error for debugging
-        error_trace = traceback.format_exc()
-        print(f"Error in prediction: {str(e)}")
-        print(f"Traceback: {error_trace}")
+    - **files**: Image files and/or zip/tar archives of images
+    - **model_version**: Resident model version to use (default: the version active
+      when the images are scored)
+    - **ela_qualities**: Optional multi-quality ELA ensemble, as for /predict
+    - **priority**: "low", "normal" or "high"; higher priority jobs are scored first
+    - **X-Client-Id** header: Identity used for fair scheduling and per-client limits
+      (default: the client address)
+    
+    Returns:
+    - job_id: Id to poll with GET /jobs/{job_id}
+    - status, total and the other fields of GET /jobs/{job_id}
+    """
+    with track_request("jobs_submit"):
+        store = get_job_store()
+        registry.get(model_version)
+        qualities = parse_ela_qualities(ela_qualities)
+        if priority not in PRIORITIES:
+            raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+        client = x_client_id or (request.client.host if request.client else "anonymous")
+        
+        # Admission control: bound each client's unfinished jobs and the total backlog
+        if await asyncio.to_thread(store.active_jobs, client) >= JOB_MAX_ACTIVE_PER_CLIENT:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many unfinished jobs for this client (maximum {JOB_MAX_ACTIVE_PER_CLIENT})",
+                headers={"Retry-After": "10"},
+            )
+        if (await asyncio.to_thread(store.stats))["pending_items"] >= JOB_MAX_PENDING_ITEMS:
+            raise HTTPException(status_code=503, detail="The job queue is full, please retry later.",
+                                headers={"Retry-After": "30"})
+        
+        items, errors = await collect_uploads(files, JOB_MAX_FILES)
+        if errors:
+            raise HTTPException(status_code=400, detail=f"{items[min(errors)][0]}: {errors[min(errors)]}")
+        if not items:
+            raise HTTPException(status_code=400, detail="No images uploaded")
+        
+        job_id = await asyncio.to_thread(
+            store.submit, client, PRIORITIES[priority], items, model_version,
+            {"ela_qualities": list(qualities) if qualities else None},
+        )
+        job_workers.notify()
+        job = await asyncio.to_thread(store.get, job_id)
+        return JSONResponse(status_code=202, content=job_response(job, results=False),
+                            headers={"Location": f"/jobs/{job_id}"})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0, partial: bool = False):
+    """
+    Status of a job, with per-image results once it is finished.
+    
+    - **wait**: Long-poll: wait up to this many seconds (capped at
+      VERIFRAME_JOB_MAX_WAIT_SECONDS) for the job to finish before answering
+    - **partial**: Include the results scored so far while the job is still running
+    
+    Returns:
+    - job_id, status ("queued", "running", "completed" or "cancelled"), priority, client
+    - total / pending / running / completed / succeeded / failed: Image counts
+    - created_at / started_at / finished_at: Unix timestamps
+    - results: One entry per image, in upload (or archive) order, with the filename and
+      either "result" (same format as /predict), "error" or the image's "status"
+    """
+    store = get_job_store()
+    if wait > 0:
+        job = await job_workers.wait(job_id, min(wait, JOB_MAX_WAIT_SECONDS))
+    else:
+        job = await asyncio.to_thread(store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    finished = job["status"] in TERMINAL_STATUSES
+    return await asyncio.to_thread(job_response, job, finished or partial)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a job: images not scored yet are dropped, results so far are kept."""
+    store = get_job_store()
+    if not await asyncio.to_thread(store.cancel, job_id):
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_response(await asyncio.to_thread(store.get, job_id), results=False)
+
+def require_admin(x_veriframe_admin_token: Optional[str] = Header(None)):
+    """Reject model admin requests that did not come through the serve.py supervisor (when under it)."""
+    if ADMIN_TOKEN and not hmac.compare_digest(x_veriframe_admin_token or "", ADMIN_TOKEN):
         raise HTTPException(
-            status_code=500, 
-            detail=f"Internal server error: {str(e)}"
+            status_code=409,
+            detail="This server runs several workers (serve.py): send model admin requests to the supervisor's "
+                   "/admin/ endpoint so that every worker applies them",
         )
 
-@app.post("/load-model")
-async def load_model_endpoint(model_path: Optional[str] = None):
+@app.post("/load-model", dependencies=[Depends(require_admin)])
+async def load_model_endpoint(
+    model_path: Optional[str] = None,
+    version: Optional[str] = None,
+    activate: bool = True,
+    wait: bool = False,
+):
     """
-    Manually load or reload the local PyTorch model.
+    Load a model version in the background and swap it in once it is warmed up.
+    
+    - **model_path**: Checkpoint inside the configured model directories (default: model.pth)
+    - **version**: Version name (default: the startup version, i.e. replace it in place)
+    - **activate**: Route default traffic to the version once it is ready
+    - **wait**: Respond only after the load finished (the server keeps serving meanwhile)
+    
+    Requests already in flight finish on the version they started on.
     """
-    global model
+    path = resolve_model_path(model_path) if model_path else MODEL_PATH
+    name = version or DEFAULT_MODEL_VERSION
     try:
-        path = model_path if model_path else MODEL_PATH
-        model = load_model(path)
-        return {
-            "message": "Model loaded successfully",
+        registry.validate_name(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if registry.is_loading(name):
+        raise HTTPException(status_code=409, detail=f"Model version {name} is already loading")
+    
+    if not wait:
+        status = registry.start_load(name, path, activate)
+        return JSONResponse(status_code=202, content={
+            "message": "Model loading started",
+            "version": name,
             "model_path": path,
-            "device": str(device)
-        }
+            "status": status["status"],
+        })
+    
+    try:
+        loaded = await registry.load(name, path, activate)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading model: {str(e)}")
+    return {
+        "message": "Model loaded successfully",
+        "version": loaded.name,
+        "active": registry.active,
+        "model_path": path,
+        "device": str(device)
+    }
+
+@app.get("/models")
+async def list_models():
+    """Resident model versions, the active and shadow version, and recent loads."""
+    return registry.describe()
+
+@app.post("/models/{name}/activate", dependencies=[Depends(require_admin)])
+async def activate_model(name: str):
+    """Route default traffic to a resident version (instant, no reload)."""
+    registry.activate(name)
+    return {"message": f"Model version {name} is now active", "active": registry.active}
+
+@app.delete("/models/shadow", dependencies=[Depends(require_admin)])
+async def disable_shadow():
+    """Stop shadow scoring."""
+    registry.set_shadow(None)
+    return {"message": "Shadow scoring disabled", "shadow": None}
+
+@app.post("/models/{name}/shadow", dependencies=[Depends(require_admin)])
+async def shadow_model(name: str):
+    """Score default /predict traffic with a resident version in the background and compare results."""
+    try:
+        registry.set_shadow(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": f"Model version {name} is now shadowing {registry.active}", "shadow": name}
+
+@app.delete("/models/{name}", dependencies=[Depends(require_admin)])
+async def unload_model(name: str):
+    """Release a resident version once its in-flight requests have finished."""
+    try:
+        registry.unload(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": f"Model version {name} unloaded", "active": registry.active}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics: per-stage latency histograms, batch sizes, pipeline and cache state."""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
+    return health_status()
+
+def health_status() -> dict:
+    """
+    Snapshot of this process' health (served by /health and, under serve.py, written
+    to the worker status file for the supervisor).
+    """
     return {
         "status": "healthy" if model is not None else "unhealthy",
         "model_loaded": model is not None,
-        "device": str(device)
+        "device": str(device),
+        "runtime": model_runtime,
+        "model_version": registry.active,
+        "calibration": score_calibration().describe() if score_calibration() is not None else None,
+        "model_cache": model_artifacts.stats(),
+        "pipeline": pipeline.stats(),
+        "cache": cache.stats(),
+        "jobs": job_store.stats() if job_store else None
     }
 
 if __name__ == "__main__":
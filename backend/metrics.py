@@ -0,0 +1,217 @@
+"""
+Prometheus-style metrics for the inference service.
+
+A small, dependency-free implementation of counters, gauges and histograms rendered in
+the Prometheus text exposition format (served by ``GET /metrics``). Observations are a
+lock plus a bisect, so instrumenting the request path costs microseconds.
+
+Metrics whose value already lives elsewhere (pipeline, cache, registry stats) are
+registered with a ``function`` that is only called when /metrics is scraped.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Seconds, from sub-millisecond tensor conversion up to multi-second forward passes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_metrics = []
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable] = None):
+        """
+        Args:
+            name: Metric name.
+            documentation: HELP text.
+            labelnames: Label names; use ``labels(...)`` to get a labelled child.
+            function: Called at scrape time instead of tracking values. Returns a number,
+                or a dict mapping label value tuples to numbers when ``labelnames`` is set.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple, object] = {}
+        if not self.labelnames and function is None:
+            self.labels()  # Unlabelled metrics are exported from the start
+        _metrics.append(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def _samples(self):
+        if self.function is None:
+            return [(values, child.value) for values, child in sorted(self._children.items())]
+        result = self.function()
+        if isinstance(result, dict):
+            return [(tuple(str(v) for v in k), v) for k, v in result.items()]
+        return [((), result)]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the duration of the ``with`` block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            lines.append(f"# {metric.name} unavailable: {e}")
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Per-stage latency of the request pipeline. Stages: decode, ela, ela_queue (ELA pool
+# wait and transfer), to_tensor, queue_wait (micro-batcher), forward
+STAGE_SECONDS = Histogram(
+    "veriframe_stage_seconds", "Latency of each request pipeline stage in seconds", ["stage"]
+)
+REQUEST_SECONDS = Histogram(
+    "veriframe_request_seconds", "End-to-end latency of prediction requests in seconds", ["endpoint"]
+)
+REQUESTS = Counter(
+    "veriframe_requests_total", "Prediction requests by endpoint and outcome", ["endpoint", "outcome"]
+)
+BATCH_SIZE = Histogram(
+    "veriframe_batch_size", "Number of images per forward pass", buckets=BATCH_SIZE_BUCKETS
+)
+NEAR_DUPLICATES = Counter(
+    "veriframe_near_duplicate_lookups_total", "Near-duplicate index lookups by outcome (miss, flagged, reused)", ["outcome"]
+)
@@ -0,0 +1,168 @@
+"""
+On-disk cache of resolved model artifacts, keyed by the checkpoint's SHA-256.
+
+Without it, every boot re-infers the architecture from state dict keys (possibly
+building a ResNet18 just to fall back to the generic CNN), runs test forward passes
+and, for non-eager runtimes, re-traces/exports and re-verifies the model. With it:
+
+- the eager model is stored as ``{arch, state_dict}`` and rebuilt on the meta device
+  with weights assigned straight from a memory-mapped ``torch.load(mmap=True)``;
+- TorchScript and ONNX runtime artifacts are stored with their parity report, so a
+  warm boot loads the ready-to-run model directly;
+- checkpoint hashes are remembered by (path, size, mtime) so large checkpoints are
+  not re-hashed on every start.
+"""
+import json
+import logging
+import os
+import tempfile
+from typing import Callable, Dict, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+from cache import file_sha256
+from runtime import OnnxModel
+
+logger = logging.getLogger("veriframe.model_cache")
+
+ARTIFACT_FORMAT = 1
+
+
+def _atomic_write(path: str, write: Callable[[str], None]):
+    """
+    Call ``write(tmp_path)`` and rename the result into place, so concurrent workers
+    never see partially written files.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _write_json(path: str, obj):
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(obj, f, indent=2)
+    _atomic_write(path, write)
+
+
+def _write_bytes(path: str, data: bytes):
+    def write(tmp):
+        with open(tmp, "wb") as f:
+            f.write(data)
+    _atomic_write(path, write)
+
+
+class ModelArtifactCache:
+    """
+    Args:
+        cache_dir: Directory for artifacts (created on demand).
+        mmap: Memory-map cached weights instead of reading them into memory.
+    """
+
+    def __init__(self, cache_dir: str, mmap: bool = True):
+        self.cache_dir = cache_dir
+        self.mmap = mmap
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, name: str) -> str:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return os.path.join(self.cache_dir, name)
+
+    def checkpoint_hash(self, model_path: str) -> str:
+        """SHA-256 of the checkpoint, reusing the stored hash if size and mtime are unchanged."""
+        index_path = self._path("index.json")
+        stat = os.stat(model_path)
+        key = os.path.abspath(model_path)
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        entry = index.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+
+        digest = file_sha256(model_path)
+        index[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+        _write_json(index_path, index)
+        return digest
+
+    def _load_tensors(self, path: str, device):
+        try:
+            return torch.load(path, map_location=device, weights_only=True, mmap=self.mmap)
+        except TypeError:
+            # torch < 2.1 has no mmap argument
+            return torch.load(path, map_location=device)
+
+    def load_eager(self, fingerprint: str, builders: Dict[str, Callable[[], nn.Module]], device) -> Optional[Tuple[nn.Module, str]]:
+        """
+        Rebuild the eager model from a cached artifact.
+
+        Returns (model, arch) or None on a miss.
+        """
+        path = os.path.join(self.cache_dir, f"{fingerprint}.eager.pt")
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        try:
+            artifact = self._load_tensors(path, device)
+            if artifact.get("format") != ARTIFACT_FORMAT or artifact.get("arch") not in builders:
+                raise ValueError("incompatible artifact")
+            # Build the skeleton without allocating or initializing weights, then adopt
+            # the (memory-mapped) cached tensors directly
+            with torch.device("meta"):
+                model = builders[artifact["arch"]]()
+            model.load_state_dict(artifact["state_dict"], strict=True, assign=True)
+        except Exception as e:
+            logger.warning(f"Ignoring unusable model cache entry {path}: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return model.eval().to(device), artifact["arch"]
+
+    def save_eager(self, fingerprint: str, arch: str, model: nn.Module):
+        artifact = {"format": ARTIFACT_FORMAT, "arch": arch, "state_dict": model.state_dict()}
+        _atomic_write(self._path(f"{fingerprint}.eager.pt"), lambda tmp: torch.save(artifact, tmp))
+
+    def load_runtime(self, fingerprint: str, config_key: str, device) -> Optional[Tuple[object, dict]]:
+        """
+        Load a cached TorchScript/ONNX runtime artifact and its runtime info.
+
+        Returns (model, info) or None on a miss.
+        """
+        base = os.path.join(self.cache_dir, f"{fingerprint}.{config_key}")
+        try:
+            with open(base + ".json") as f:
+                info = json.load(f)
+            if info.get("format") != ARTIFACT_FORMAT:
+                return None
+            if info["runtime"] == "onnx":
+                with open(base + ".onnx", "rb") as f:
+                    model = OnnxModel(f.read(), num_threads=torch.get_num_threads())
+            else:
+                model = torch.jit.load(base + ".ts", map_location=device)
+        except (OSError, ValueError, KeyError, RuntimeError):
+            return None
+        info.pop("format", None)
+        info["cached"] = True
+        return model, info
+
+    def save_runtime(self, fingerprint: str, config_key: str, model, info: dict):
+        base = self._path(f"{fingerprint}.{config_key}")
+        if isinstance(model, OnnxModel):
+            _write_bytes(base + ".onnx", model.onnx_bytes)
+        elif isinstance(model, torch.jit.ScriptModule):
+            _atomic_write(base + ".ts", lambda tmp: torch.jit.save(model, tmp))
+        else:
+            return  # Eager variants are rebuilt from the eager artifact instead
+        _write_json(base + ".json", dict(info, format=ARTIFACT_FORMAT))
+
+    def stats(self) -> dict:
+        return {"dir": self.cache_dir, "mmap": self.mmap, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,458 @@
+"""
+Perceptual-hash index of scored images, for near-duplicate detection.
+
+The prediction cache only recognizes byte-identical uploads. Re-encoded, resized or
+re-shared copies of an image have different bytes but (nearly) the same perceptual
+hash, a 64-bit fingerprint of the image's low-frequency structure:
+
+- ``phash``: signs of the 8x8 lowest DCT coefficients of a 32x32 grayscale thumbnail
+  relative to their median (robust to re-encoding, resizing and mild edits);
+- ``dhash``: signs of horizontal gradients of a 9x8 thumbnail (cheaper, less robust).
+
+``NearDuplicateIndex`` stores a hash and the stored verdict per scored image and finds
+the nearest entry within a Hamming distance using multi-index hashing: the 64 bits
+are split into 4 chunks of 16, and any hash within distance ``d`` has at least one
+chunk within ``d // 4`` of the query's (pigeonhole principle). Each chunk has a
+bucket table over all 65536 values, so a lookup probes a few dozen to a few hundred
+buckets and verifies only their entries, instead of scanning millions of hashes. New entries go
+to a small unindexed tail that is scanned linearly and folded into the tables when
+it grows.
+
+The index persists to a single ``.npz`` file and can be rebuilt from bulk-scoring
+output (see ``python near_duplicates.py rebuild --help``).
+
+Usage (from the backend directory):
+    python near_duplicates.py rebuild scores.csv --index near_duplicates.npz --model model.pth
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import threading
+from functools import lru_cache
+from typing import Iterator, Optional
+
+import numpy as np
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves are not serialized between processes
+    fcntl = None
+
+HASH_ALGORITHMS = ("phash", "dhash")
+
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+
+
+@lru_cache(maxsize=1)
+def _dct_matrix(n: int = 32) -> np.ndarray:
+    """Orthonormal DCT-II matrix, so ``M @ x @ M.T`` is the 2-D DCT of ``x``."""
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+def _thumbnail(image: Image.Image, size: tuple) -> np.ndarray:
+    # Box-reduce large images first; resizing 12 MP straight to 32x32 is much slower
+    factor = min(image.size) // (4 * max(size))
+    if factor > 1:
+        image = image.reduce(factor)
+    return np.asarray(image.convert("L").resize(size, Image.Resampling.BILINEAR), dtype=np.float32)
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def perceptual_hash(image: Image.Image, algorithm: str = "phash") -> int:
+    """
+    64-bit perceptual hash of an image.
+
+    Args:
+        image: PIL image (any mode and size)
+        algorithm: "phash" (DCT) or "dhash" (gradient)
+
+    Returns:
+        The hash as an unsigned 64-bit integer.
+    """
+    if algorithm == "dhash":
+        pixels = _thumbnail(image, (9, 8))
+        return _pack(pixels[:, 1:] > pixels[:, :-1])
+    if algorithm != "phash":
+        raise ValueError(f"Unknown perceptual hash {algorithm!r} (expected one of {', '.join(HASH_ALGORITHMS)})")
+    matrix = _dct_matrix(32)
+    low = (matrix @ _thumbnail(image, (32, 32)) @ matrix.T)[:8, :8]
+    # The DC coefficient only encodes overall brightness
+    return _pack(low > np.median(low.ravel()[1:]))
+
+
+def hash_file(path: str, algorithm: str = "phash") -> int:
+    """Perceptual hash of an image file, decoding JPEGs at reduced size."""
+    with Image.open(path) as image:
+        image.draft("RGB", (64, 64))
+        return perceptual_hash(image, algorithm)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+@lru_cache(maxsize=8)
+def _chunk_masks(radius: int) -> np.ndarray:
+    """All 16-bit masks with at most ``radius`` bits set."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in itertools.combinations(range(CHUNK_BITS), r):
+            masks.append(sum(1 << b for b in bits))
+    return np.array(masks, dtype=np.int64)
+
+
+def _ranges(lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Concatenation of ``arange(lo[i], hi[i])`` for all i, without a Python loop."""
+    lengths = hi - lo
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    # Each position steps by one, except at the start of a range where it jumps to lo
+    steps = np.ones(total, dtype=np.int64)
+    firsts = np.cumsum(lengths) - lengths
+    nonempty = lengths > 0
+    steps[firsts[nonempty]] = lo[nonempty] - np.concatenate(([0], (hi[nonempty] - 1)[:-1]))
+    return np.cumsum(steps)
+
+
+class NearDuplicateIndex:
+    """
+    In-memory multi-index hash table of scored images.
+
+    Every entry holds a 64-bit perceptual hash, the verdict stored for it (logits and
+    probabilities), the fingerprint of the model that produced the verdict and a
+    reference (file name, path or content digest). Thread-safe.
+
+    Args:
+        merge_fraction: Fold the unindexed tail into the bucket tables once it holds
+            more than this fraction of all entries (and at least 1024).
+    """
+
+    def __init__(self, merge_fraction: float = 0.05):
+        self.merge_fraction = merge_fraction
+        self._lock = threading.Lock()
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._scores = np.empty((0, 4), dtype=np.float32)  # logit_0, logit_1, prob_0, prob_1
+        self._models = np.empty(0, dtype=np.uint16)
+        self._model_names = []
+        self._refs = []
+        self._size = 0
+        self._indexed = 0
+        self._starts = []  # Per chunk: bucket offsets into _order (65537 entries)
+        self._order = []  # Per chunk: entry ids sorted by chunk value
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, capacity: int):
+        if capacity <= len(self._hashes):
+            return
+        capacity = max(capacity, 2 * len(self._hashes), 1024)
+        for name in ("_hashes", "_scores", "_models"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _model_id(self, model: str) -> int:
+        try:
+            return self._model_names.index(model)
+        except ValueError:
+            self._model_names.append(model)
+            return len(self._model_names) - 1
+
+    def add(self, image_hash: int, result: dict, model: str, ref: str = ""):
+        """
+        Add a scored image.
+
+        Args:
+            image_hash: Perceptual hash of the image
+            result: Prediction dict (as returned by predict_batch)
+            model: Fingerprint of the model that produced ``result``
+            ref: Reference to the image (file name, path or digest)
+        """
+        with self._lock:
+            self._grow(self._size + 1)
+            i = self._size
+            self._hashes[i] = image_hash
+            self._scores[i] = (
+                result["raw_logits"]["class_0"], result["raw_logits"]["class_1"],
+                result["probabilities"]["authentic"], result["probabilities"]["tampered"],
+            )
+            self._models[i] = self._model_id(model)
+            self._refs.append(ref)
+            self._size += 1
+            if self._size - self._indexed > max(1024, self.merge_fraction * self._size):
+                self._build_tables()
+
+    def add_many(self, hashes, scores, model: str, refs):
+        """Bulk insert: ``hashes`` (N,) and ``scores`` (N, 4) arrays, as for ``add``."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        with self._lock:
+            self._grow(self._size + len(hashes))
+            end = self._size + len(hashes)
+            self._hashes[self._size:end] = hashes
+            self._scores[self._size:end] = scores
+            self._models[self._size:end] = self._model_id(model)
+            self._refs.extend(refs)
+            self._size = end
+            self._build_tables()
+
+    def extend_from(self, other: "NearDuplicateIndex", start: int = 0):
+        """Append the entries of ``other`` from position ``start`` on."""
+        with other._lock:
+            hashes = other._hashes[start:other._size].copy()
+            scores = other._scores[start:other._size].copy()
+            models = [other._model_names[m] for m in other._models[start:other._size]]
+            refs = other._refs[start:other._size]
+        with self._lock:
+            self._grow(self._size + len(hashes))
+            end = self._size + len(hashes)
+            self._hashes[self._size:end] = hashes
+            self._scores[self._size:end] = scores
+            self._models[self._size:end] = [self._model_id(name) for name in models]
+            self._refs.extend(refs)
+            self._size = end
+            if self._size - self._indexed > max(1024, self.merge_fraction * self._size):
+                self._build_tables()
+
+    def _build_tables(self):
+        """Index all entries (called with the lock held)."""
+        hashes = self._hashes[:self._size]
+        self._starts, self._order = [], []
+        for chunk in range(CHUNKS):
+            values = ((hashes >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.int64)
+            order = np.argsort(values, kind="stable").astype(np.int32)
+            self._order.append(order)
+            self._starts.append(np.searchsorted(values[order], np.arange(65537)))
+        self._indexed = self._size
+
+    def lookup(self, image_hash: int, max_distance: int, model: Optional[str] = None) -> Optional[dict]:
+        """
+        Find the nearest stored image within ``max_distance`` bits.
+
+        Args:
+            image_hash: Perceptual hash of the query image
+            max_distance: Maximum Hamming distance (0-64)
+            model: Only consider verdicts from this model fingerprint
+
+        Returns:
+            None, or a dict with "distance", "ref", "model" and the stored "logits"
+            and "probabilities" of the match.
+        """
+        with self._lock:
+            if self._size == 0:
+                return None
+            if model is not None and model not in self._model_names:
+                return None
+            candidates = [np.arange(self._indexed, self._size)]
+            if self._indexed:
+                masks = _chunk_masks(max_distance // CHUNKS)
+                for chunk in range(CHUNKS):
+                    value = (image_hash >> (chunk * CHUNK_BITS)) & 0xFFFF
+                    neighbours = value ^ masks
+                    starts = self._starts[chunk]
+                    candidates.append(self._order[chunk][_ranges(starts[neighbours], starts[neighbours + 1])])
+            # An entry can match in several chunks; duplicates do not change the minimum
+            ids = np.concatenate(candidates)
+            if model is not None:
+                ids = ids[self._models[ids] == self._model_names.index(model)]
+            if len(ids) == 0:
+                return None
+            distances = np.bitwise_count(self._hashes[ids] ^ np.uint64(image_hash))
+            best = int(np.argmin(distances))
+            if distances[best] > max_distance:
+                return None
+            i = int(ids[best])
+            logit_0, logit_1, prob_0, prob_1 = (float(v) for v in self._scores[i])
+            return {
+                "distance": int(distances[best]),
+                "ref": self._refs[i],
+                "model": self._model_names[self._models[i]],
+                "logits": [logit_0, logit_1],
+                "probabilities": [prob_0, prob_1],
+            }
+
+    def stats(self) -> dict:
+        return {
+            "entries": self._size,
+            "indexed": self._indexed,
+            "models": len(self._model_names),
+            "bytes": int(self._hashes.nbytes + self._scores.nbytes + self._models.nbytes
+                         + sum(o.nbytes for o in self._order) + sum(s.nbytes for s in self._starts)),
+        }
+
+    def save(self, path: str):
+        """Write the index to ``path`` atomically (an ``.npz`` file)."""
+        with self._lock:
+            refs = [ref.encode("utf-8") for ref in self._refs]
+            arrays = {
+                "hashes": self._hashes[:self._size],
+                "scores": self._scores[:self._size],
+                "models": self._models[:self._size],
+                "model_names": np.array(json.dumps(self._model_names)),
+                "ref_offsets": np.cumsum([0] + [len(r) for r in refs], dtype=np.int64),
+                "ref_data": np.frombuffer(b"".join(refs), dtype=np.uint8),
+            }
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    def save_merged(self, path: str, since: int = 0):
+        """
+        Add the entries after the first ``since`` (those added since the index was
+        loaded from ``path``) to the index file at ``path``, under an exclusive lock,
+        so processes sharing the file each contribute their entries instead of the
+        last one to save overwriting the others'.
+        """
+        with open(f"{path}.lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = NearDuplicateIndex.load(path) if os.path.exists(path) else NearDuplicateIndex()
+            merged.extend_from(self, since)
+            merged.save(path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "NearDuplicateIndex":
+        """Read an index written by ``save``."""
+        index = cls(**kwargs)
+        with np.load(path) as data:
+            data_bytes = data["ref_data"].tobytes()
+            offsets = data["ref_offsets"]
+            index._hashes = data["hashes"].copy()
+            index._scores = data["scores"].copy()
+            index._models = data["models"].copy()
+            index._model_names = json.loads(str(data["model_names"]))
+        index._refs = [data_bytes[a:b].decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:])]
+        index._size = len(index._hashes)
+        with index._lock:
+            index._build_tables()
+        return index
+
+
+def iter_bulk_rows(path: str) -> Iterator[dict]:
+    """Rows of a bulk_score.py output file (CSV, JSONL or a Parquet directory)."""
+    if os.path.isdir(path) or path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Reading Parquet output requires pyarrow (pip install pyarrow)")
+        yield from pq.read_table(path).to_pylist()
+    elif path.endswith((".jsonl", ".json", ".ndjson")):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, newline="") as f:
+            yield from csv.DictReader(f)
+
+
+def rebuild(outputs: list, model: str, algorithm: str = "phash", index: Optional[NearDuplicateIndex] = None,
+            temperature: Optional[float] = None) -> dict:
+    """
+    Add every successfully scored row of bulk-scoring outputs to an index.
+
+    Rows carry the perceptual hash computed during scoring (``phash`` column); for
+    older outputs without it, the image is re-read from its path.
+
+    Rows written with a ``namespace`` column (the settings bulk_score.py scored them
+    under) are added under it as they are; ``model`` and ``temperature`` apply to older
+    rows without it.
+
+    Args:
+        model: Key of the entries, as the API computes it (``cache.result_namespace``)
+        temperature: Score calibration temperature of the model; the stored
+            probabilities are recomputed from the logits with it
+
+    Returns:
+        {"index", "added", "hashed", "skipped"}
+    """
+    index = index or NearDuplicateIndex()
+    # namespace (None: use model) -> hashes, scores, refs
+    groups = {}
+    hashed = skipped = 0
+    for output in outputs:
+        for row in iter_bulk_rows(output):
+            if row.get("error") or row.get("prob_tampered") in (None, ""):
+                skipped += 1
+                continue
+            if row.get("phash"):
+                image_hash = int(row["phash"], 16)
+            else:
+                try:
+                    image_hash = hash_file(row["path"], algorithm)
+                    hashed += 1
+                except OSError:
+                    skipped += 1
+                    continue
+            hashes, scores, refs = groups.setdefault(row.get("namespace") or None, ([], [], []))
+            hashes.append(image_hash)
+            scores.append((float(row["logit_0"]), float(row["logit_1"]),
+                           float(row["prob_authentic"]), float(row["prob_tampered"])))
+            refs.append(row["path"])
+    for namespace, (hashes, scores, refs) in groups.items():
+        scores = np.array(scores, dtype=np.float32)
+        if namespace is None and temperature is not None:
+            from calibration import tampered_probability
+            scores[:, 3] = tampered_probability(scores[:, :2], temperature)
+            scores[:, 2] = 1.0 - scores[:, 3]
+        index.add_many(hashes, scores, namespace or model, refs)
+    added = sum(len(hashes) for hashes, _, _ in groups.values())
+    return {"index": index, "added": added, "hashed": hashed, "skipped": skipped}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = commands.add_parser("rebuild", help="Build an index from bulk_score.py output")
+    rebuild_parser.add_argument("outputs", nargs="+", help="bulk_score.py output files (.csv, .jsonl) or Parquet directories")
+    rebuild_parser.add_argument("--index", required=True, help="Index file to write (.npz)")
+    rebuild_parser.add_argument("--model", help="Checkpoint that produced the scores (default: backend/model.pth)")
+    rebuild_parser.add_argument("--append", action="store_true", help="Add to an existing index instead of replacing it")
+    rebuild_parser.add_argument("--algorithm", choices=HASH_ALGORITHMS, default="phash",
+                                help="Hash for rows without a phash column (must match the API's)")
+    # Entries are only reused by an API serving the model with the same settings; the
+    # defaults come from the same environment variables as the API's
+    rebuild_parser.add_argument("--runtime", default=os.environ.get("VERIFRAME_RUNTIME", "eager"),
+                                help="Runtime the API serves the model with (VERIFRAME_RUNTIME)")
+    rebuild_parser.add_argument("--quantize", default=os.environ.get("VERIFRAME_QUANTIZE", "none"),
+                                help="Quantization the API serves the model with (VERIFRAME_QUANTIZE)")
+    rebuild_parser.add_argument("--working-size", type=int,
+                                default=int(os.environ.get("VERIFRAME_ELA_WORKING_SIZE", "0")),
+                                help="ELA working size of the API (VERIFRAME_ELA_WORKING_SIZE)")
+    rebuild_parser.add_argument("--calibration", default=os.environ.get("VERIFRAME_SCORE_CALIBRATION") or None,
+                                help="Score calibration file of the API (VERIFRAME_SCORE_CALIBRATION)")
+    args = parser.parse_args(argv)
+
+    from cache import file_sha256, result_namespace
+    from calibration import load_calibrations
+    model_path = args.model or os.path.join(os.path.dirname(os.path.abspath(__file__)), "model.pth")
+    fingerprint = file_sha256(model_path)
+    calibration = load_calibrations(args.calibration).get(fingerprint) if args.calibration else None
+    runtime_info = {"runtime": args.runtime, "quantize": args.quantize, "fallback": None}
+    model = result_namespace(fingerprint, runtime_info, args.working_size, calibration)
+    index = NearDuplicateIndex.load(args.index) if args.append and os.path.exists(args.index) else None
+    summary = rebuild(args.outputs, model, args.algorithm, index,
+                      calibration.temperature if calibration is not None else None)
+    summary["index"].save(args.index)
+    # model: key of rows without a namespace column
+    print(json.dumps(dict(summary, model=model, index=summary["index"].stats())))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
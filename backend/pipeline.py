@@ -0,0 +1,161 @@
+"""
+Pipelined execution for the inference service.
+
+CPU-bound ELA preprocessing runs in a process pool (so JPEG encode/decode and resizing
+do not contend for the GIL or stall the event loop), while forward passes run in a
+dedicated thread pool. Admission control bounds the number of requests in the pipeline
+so overload turns into fast 503 responses instead of unbounded latency.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+from uploads import picklable
+
+logger = logging.getLogger("veriframe.pipeline")
+
+
+class PipelineOverloaded(HTTPException):
+    """Raised when the pipeline already holds its maximum number of requests."""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__(
+            status_code=503,
+            detail="Server is overloaded, please retry later.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class InferencePipeline:
+    """
+    Own the executors used by the request pipeline and apply backpressure.
+
+    Args:
+        ela_workers: Number of ELA worker processes. 0 runs ELA in a thread pool in
+            this process instead (useful for debugging or single-core machines).
+        ela_initializer: Called with ``ela_initargs`` in every ELA worker process (or
+            thread) before it runs anything, e.g. to pass settings to the functions
+            it runs. Workers are spawned, so they only import what those functions need.
+        inference_workers: Number of threads in the dedicated inference executor.
+        max_queue_depth: Maximum number of requests admitted at once; further requests
+            are rejected with 503 until capacity frees up.
+    """
+
+    def __init__(self, ela_workers: int = 0, inference_workers: int = 1, max_queue_depth: int = 64,
+                 ela_initializer: Optional[Callable] = None, ela_initargs: tuple = ()):
+        self.ela_workers = max(0, int(ela_workers))
+        self.ela_initializer = ela_initializer
+        self.ela_initargs = ela_initargs
+        self.inference_workers = max(1, int(inference_workers))
+        self.max_queue_depth = max(1, int(max_queue_depth))
+        self.ela_executor = None
+        self.inference_executor: Optional[ThreadPoolExecutor] = None
+        self.in_flight = 0
+        self.background_in_flight = 0
+        self.rejected = 0
+
+    def _create_ela_executor(self):
+        if self.ela_workers == 0:
+            return ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="ela",
+                                      initializer=self.ela_initializer, initargs=self.ela_initargs)
+        # "spawn" avoids forking a parent that already has torch thread pools running
+        return ProcessPoolExecutor(
+            max_workers=self.ela_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=self.ela_initializer,
+            initargs=self.ela_initargs,
+        )
+
+    def start(self):
+        """Create the executors. Safe to call more than once."""
+        if self.ela_executor is None:
+            self.ela_executor = self._create_ela_executor()
+        if self.inference_executor is None:
+            self.inference_executor = ThreadPoolExecutor(
+                max_workers=self.inference_workers, thread_name_prefix="inference"
+            )
+
+    def shutdown(self):
+        """Shut down both executors, cancelling queued work."""
+        if self.ela_executor is not None:
+            self.ela_executor.shutdown(wait=False, cancel_futures=True)
+            self.ela_executor = None
+        if self.inference_executor is not None:
+            self.inference_executor.shutdown(wait=False, cancel_futures=True)
+            self.inference_executor = None
+
+    @asynccontextmanager
+    async def admit(self, background: bool = False):
+        """
+        Reserve a pipeline slot for the duration of a request.
+
+        Args:
+            background: The slot is taken by background work (e.g. a job claim) rather
+                than a client request; it is also counted in ``background_in_flight``
+                and its rejection is not counted in ``rejected``.
+
+        Raises:
+            PipelineOverloaded: If ``max_queue_depth`` requests are already in flight.
+        """
+        if self.in_flight >= self.max_queue_depth:
+            if not background:
+                self.rejected += 1
+            raise PipelineOverloaded()
+        self.in_flight += 1
+        self.background_in_flight += background
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.background_in_flight -= background
+
+    @property
+    def interactive_in_flight(self) -> int:
+        """Admitted client requests (``in_flight`` minus background work)."""
+        return self.in_flight - self.background_in_flight
+
+    async def run_ela(self, fn: Callable, *args):
+        """
+        Run a CPU-bound preprocessing function in the ELA pool.
+
+        ``fn`` must be a picklable module-level function when processes are used;
+        upload buffers passed as memoryviews are sent as the buffer they view.
+        """
+        if self.ela_executor is None:
+            raise RuntimeError("Pipeline is not started")
+        if self.ela_workers:
+            args = tuple(picklable(arg) for arg in args)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.ela_executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OOM killer); replace the pool for later requests
+            logger.warning("ELA worker pool broke, restarting it")
+            self.ela_executor.shutdown(wait=False, cancel_futures=True)
+            self.ela_executor = self._create_ela_executor()
+            raise PipelineOverloaded()
+
+    async def run_inference(self, fn: Callable, *args):
+        """Run a blocking inference call in the dedicated inference executor."""
+        if self.inference_executor is None:
+            raise RuntimeError("Pipeline is not started")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.inference_executor, fn, *args)
+
+    def stats(self) -> dict:
+        return {
+            "ela_workers": self.ela_workers,
+            "ela_mode": "process" if self.ela_workers else "thread",
+            "inference_workers": self.inference_workers,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": self.in_flight,
+            "background_in_flight": self.background_in_flight,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,309 @@
+"""
+Versioned model registry with background loading and atomic hot-swap.
+
+Each named version holds its own model, fingerprint, runtime info and micro-batcher.
+New versions are built and warmed up in a background thread while the current version
+keeps serving; the swap itself is a single assignment on the event loop. Requests take
+a reference to their version for their whole lifetime (``acquire``), so in-flight
+requests finish on the version they started on, and a replaced or unloaded version is
+only released once its last request has completed.
+
+Several versions can stay resident at once: requests may pick one explicitly (A/B),
+and a shadow version can score live traffic in the background for comparison.
+"""
+import asyncio
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger("veriframe.registry")
+
+VERSION_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+
+class UnknownModelVersion(HTTPException):
+    """Raised when a request names a version that is not resident."""
+
+    def __init__(self, name: str):
+        super().__init__(status_code=404, detail=f"Model version not found: {name}")
+
+
+class ModelVersion:
+    """
+    A loaded, warmed-up model and everything needed to serve it.
+
+    Args:
+        name: Version name (unique within the registry).
+        model: Model to serve (eager, TorchScript or ONNX, see runtime.prepare_model).
+        fingerprint: SHA-256 of the checkpoint.
+        runtime: Runtime info dict from runtime.prepare_model.
+        path: Checkpoint the version was loaded from.
+    """
+
+    def __init__(self, name: str, model, fingerprint: str, runtime: dict, path: str):
+        self.name = name
+        self.model = model
+        self.fingerprint = fingerprint
+        self.runtime = runtime
+        self.path = path
+        self.loaded_at = time.time()
+        self.warmup_ms = 0.0
+        self.batcher = None  # MicroBatcher for /predict traffic, created by the registry
+        self.in_flight = 0
+        self.served = 0
+        self.retiring = False
+
+    def describe(self) -> dict:
+        return {
+            "name": self.name,
+            "path": self.path,
+            "fingerprint": self.fingerprint,
+            "runtime": self.runtime,
+            "loaded_at": self.loaded_at,
+            "warmup_ms": round(self.warmup_ms, 1),
+            "in_flight": self.in_flight,
+            "served": self.served,
+        }
+
+
+class ModelRegistry:
+    """
+    Args:
+        build: Callable(path) -> (model, fingerprint, runtime_info). Runs in the
+            registry's load thread.
+        warmup: Callable(ModelVersion) running representative batches through a new
+            version before it becomes visible; raising rejects the version. Runs in
+            the load thread.
+        make_batcher: Callable(ModelVersion) -> MicroBatcher for the version.
+        max_versions: Maximum number of resident versions; the oldest version that is
+            neither active nor shadow is released when a load exceeds it.
+        on_change: Callback invoked on the event loop after the active version or the
+            set of resident versions changed.
+    """
+
+    def __init__(
+        self,
+        build: Callable,
+        warmup: Callable,
+        make_batcher: Callable,
+        max_versions: int = 2,
+        on_change: Optional[Callable] = None,
+    ):
+        self.build = build
+        self.warmup = warmup
+        self.make_batcher = make_batcher
+        self.max_versions = max(1, int(max_versions))
+        self.on_change = on_change
+        self.versions: Dict[str, ModelVersion] = {}  # In load order
+        self.active: Optional[str] = None
+        self.shadow: Optional[str] = None
+        self.loads: Dict[str, dict] = {}  # Status of the latest load per version name
+        self.shadow_stats = {"compared": 0, "agreed": 0, "abs_prob_delta_sum": 0.0}
+        # One loader thread: loads are serialized and never compete with each other
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-load")
+        self._tasks = set()
+
+    @staticmethod
+    def validate_name(name: str) -> str:
+        if not VERSION_NAME.match(name or "") or name == "shadow":
+            raise ValueError(
+                "Version names must be 1-64 characters of letters, digits, '.', '_' or '-'"
+            )
+        return name
+
+    def is_loading(self, name: str) -> bool:
+        return self.loads.get(name, {}).get("status") == "loading"
+
+    def _begin_load(self, name: str, path: str, activate: bool) -> dict:
+        self.validate_name(name)
+        if self.is_loading(name):
+            raise ValueError(f"Version {name} is already loading")
+        status = {"status": "loading", "path": path, "activate": activate,
+                  "started_at": time.time(), "finished_at": None, "error": None}
+        self.loads[name] = status
+        return status
+
+    async def load(self, name: str, path: str, activate: bool = True) -> ModelVersion:
+        """
+        Build, warm up and register a version, replacing any version with the same name.
+
+        Args:
+            name: Version name.
+            path: Checkpoint path.
+            activate: Make the version serve default traffic once it is ready (the first
+                loaded version is always activated).
+
+        Returns the new version. Raises whatever ``build`` or ``warmup`` raised, after
+        recording the failure in ``loads``; the serving versions are left untouched.
+        """
+        return await self._load(name, path, activate, self._begin_load(name, path, activate))
+
+    def start_load(self, name: str, path: str, activate: bool = True) -> dict:
+        """Start ``load`` in the background and return its status entry."""
+        status = self._begin_load(name, path, activate)
+        task = asyncio.create_task(self._load(name, path, activate, status))
+        self._tasks.add(task)
+        task.add_done_callback(self._load_done)
+        return status
+
+    async def _load(self, name: str, path: str, activate: bool, status: dict) -> ModelVersion:
+        loop = asyncio.get_running_loop()
+        try:
+            model, fingerprint, runtime = await loop.run_in_executor(self._executor, self.build, path)
+            version = ModelVersion(name, model, fingerprint, runtime, path)
+            start = time.perf_counter()
+            await loop.run_in_executor(self._executor, self.warmup, version)
+            version.warmup_ms = (time.perf_counter() - start) * 1000
+            version.batcher = self.make_batcher(version)
+            await version.batcher.start()
+        except Exception as e:
+            status.update(status="failed", error=str(e), finished_at=time.time())
+            raise
+
+        # The swap: from here on new requests resolve to the new version, requests
+        # holding the previous one finish on it
+        previous = self.versions.pop(name, None)
+        self.versions[name] = version
+        if activate or self.active is None or self.active not in self.versions:
+            self.active = name
+        if previous is not None:
+            self._retire(previous)
+        self._evict()
+        status.update(status="ready", finished_at=time.time(), fingerprint=fingerprint)
+        logger.info(f"Model version {name} ready (warmup {version.warmup_ms:.0f} ms, active: {self.active})")
+        self._changed()
+        return version
+
+    def _load_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error loading model version: {task.exception()}")
+
+    def get(self, name: Optional[str] = None) -> ModelVersion:
+        """
+        Resolve a version by name (default: the active version).
+
+        Raises:
+            UnknownModelVersion: If ``name`` is not resident.
+            HTTPException: 503 if no version is loaded yet.
+        """
+        if name is None:
+            if self.active is None:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Model not loaded. Please wait for the model to load or use /load-model endpoint."
+                )
+            name = self.active
+        version = self.versions.get(name)
+        if version is None:
+            raise UnknownModelVersion(name)
+        return version
+
+    @asynccontextmanager
+    async def acquire(self, name: Optional[str] = None):
+        """
+        Pin a version for the duration of a request.
+
+        Yields the ModelVersion; it stays usable until the block exits even if it is
+        replaced or unloaded in the meantime.
+        """
+        version = self.get(name)
+        version.in_flight += 1
+        try:
+            yield version
+        finally:
+            version.in_flight -= 1
+            version.served += 1
+            if version.retiring and version.in_flight == 0:
+                self._release(version)
+
+    def activate(self, name: str) -> ModelVersion:
+        """Route default traffic to a resident version."""
+        version = self.get(name)
+        self.active = name
+        if self.shadow == name:
+            self.shadow = None
+        self._changed()
+        return version
+
+    def set_shadow(self, name: Optional[str]):
+        """Score default traffic with ``name`` in the background (None disables shadowing)."""
+        if name is not None:
+            self.get(name)
+            if name == self.active:
+                raise ValueError("The active version cannot be its own shadow")
+        self.shadow = name
+        self.shadow_stats = {"compared": 0, "agreed": 0, "abs_prob_delta_sum": 0.0}
+
+    def unload(self, name: str):
+        """Release a resident version once its in-flight requests have finished."""
+        version = self.get(name)
+        if name == self.active:
+            raise ValueError("Cannot unload the active version; activate another version first")
+        del self.versions[name]
+        if self.shadow == name:
+            self.shadow = None
+        self._retire(version)
+        self._changed()
+
+    def record_shadow(self, primary: dict, shadow: dict):
+        """Compare a shadow prediction with the served one."""
+        stats = self.shadow_stats
+        stats["compared"] += 1
+        stats["agreed"] += primary["class"] == shadow["class"]
+        stats["abs_prob_delta_sum"] += abs(
+            primary["probabilities"]["tampered"] - shadow["probabilities"]["tampered"]
+        )
+
+    def _retire(self, version: ModelVersion):
+        version.retiring = True
+        if version.in_flight == 0:
+            self._release(version)
+
+    def _release(self, version: ModelVersion):
+        version.retiring = False
+        logger.info(f"Releasing model version {version.name} (served {version.served} requests)")
+        if version.batcher is not None:
+            # No request holds the version any more, so its queue is empty
+            task = asyncio.get_running_loop().create_task(version.batcher.stop())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        version.model = None
+
+    def _evict(self):
+        while len(self.versions) > self.max_versions:
+            candidates = [n for n in self.versions if n not in (self.active, self.shadow)]
+            if not candidates:
+                break
+            self._retire(self.versions.pop(candidates[0]))
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    async def shutdown(self):
+        """Stop every version's batcher and the load thread."""
+        for version in self.versions.values():
+            if version.batcher is not None:
+                await version.batcher.stop()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def describe(self) -> dict:
+        compared = self.shadow_stats["compared"]
+        return {
+            "active": self.active,
+            "shadow": self.shadow,
+            "max_versions": self.max_versions,
+            "versions": [v.describe() for v in self.versions.values()],
+            "loads": self.loads,
+            "shadow_comparison": {
+                "compared": compared,
+                "agreement": round(self.shadow_stats["agreed"] / compared, 4) if compared else None,
+                "mean_abs_prob_delta": round(self.shadow_stats["abs_prob_delta_sum"] / compared, 5) if compared else None,
+            },
+        }
@@ -0,0 +1,348 @@
+"""
+Pluggable inference runtimes for the loaded model.
+
+The eager PyTorch model built by ``load_model`` can be served as-is or converted to:
+
+- ``torchscript``: traced, frozen and optimized for inference;
+- ``onnx``: exported and executed with onnxruntime (optional dependency);
+
+optionally combined with post-training INT8 quantization (``dynamic`` quantizes the
+Linear layers, ``static`` quantizes convolutions too using a calibration set),
+channels-last memory format and an explicit intra-op thread count.
+
+Every converted model is checked against the eager model on a calibration set before
+it is used; if the outputs drift more than the tolerance, the eager model is served
+instead and the reason is reported.
+
+The module can also be run to export a checkpoint and print the parity report:
+    python runtime.py --runtime onnx --quantize dynamic --export model.onnx
+"""
+import copy
+import io
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+import fast_ela
+from archives import is_image_name
+from decoding import open_image
+
+logger = logging.getLogger("veriframe.runtime")
+
+RUNTIMES = ("eager", "torchscript", "onnx")
+QUANTIZATION_MODES = ("none", "dynamic", "static")
+
+
+class ChannelsLastModel(nn.Module):
+    """Run a channels-last model on inputs converted to the same memory format."""
+
+    def __init__(self, module: nn.Module):
+        super().__init__()
+        self.module = module.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        return self.module(x.contiguous(memory_format=torch.channels_last))
+
+
+class OnnxModel:
+    """
+    Callable wrapper around an onnxruntime session with the nn.Module calling
+    convention used by ``predict_batch`` (torch tensor in, torch tensor out).
+    """
+
+    def __init__(self, onnx_bytes: bytes, num_threads: int = 0):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("The onnx runtime requires onnxruntime (pip install onnxruntime)")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.onnx_bytes = onnx_bytes
+        self.session = ort.InferenceSession(onnx_bytes, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        array = x.detach().cpu().numpy().astype(np.float32, copy=False)
+        return torch.from_numpy(self.session.run(None, {self.input_name: array})[0])
+
+    def eval(self):
+        return self
+
+
+def calibration_batch(directory: Optional[str] = None, size: int = 32, seed: int = 0) -> torch.Tensor:
+    """
+    Build a (N, 3, 224, 224) batch of real ELA inputs for calibration and parity checks.
+
+    Images come from ``directory`` when given; otherwise synthetic photos (smooth,
+    JPEG-compressed backgrounds with pasted noisy regions) are generated, which give
+    ELA maps with a realistic mix of dark and bright areas.
+    """
+    arrays = []
+    if directory:
+        for name in sorted(n for n in os.listdir(directory) if is_image_name(n))[:size]:
+            with open(os.path.join(directory, name), "rb") as f:
+                arrays.append(fast_ela.ela_array(open_image(f.read(), working_size=1024)))
+    if not arrays:
+        rng = np.random.default_rng(seed)
+        for _ in range(size):
+            h, w = int(rng.integers(256, 640)), int(rng.integers(256, 640))
+            x = np.linspace(0, 1, w, dtype=np.float32)
+            y = np.linspace(0, 1, h, dtype=np.float32)[:, None]
+            base = rng.uniform(0, 255, 3) * x[..., None] + rng.uniform(0, 255, 3) * y[..., None]
+            image = np.clip(base / 2, 0, 255).astype(np.uint8)
+            buffer = io.BytesIO()
+            Image.fromarray(image).save(buffer, format="JPEG", quality=int(rng.integers(50, 95)))
+            image = np.array(Image.open(buffer).convert("RGB"))
+            ph, pw = int(rng.integers(16, h // 2)), int(rng.integers(16, w // 2))
+            top, left = int(rng.integers(0, h - ph)), int(rng.integers(0, w - pw))
+            image[top:top + ph, left:left + pw] = rng.integers(0, 256, (ph, pw, 3), dtype=np.uint8)
+            arrays.append(fast_ela.ela_array(image))
+    batch = torch.empty((len(arrays), 3, 224, 224), dtype=torch.float32)
+    for row, array in zip(batch, arrays):
+        fast_ela.to_tensor(array, out=row)
+    return batch
+
+
+def _quantize(model: nn.Module, mode: str, calibration: torch.Tensor) -> nn.Module:
+    from torch.ao.quantization import quantize_dynamic
+
+    if mode == "dynamic":
+        return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    backend = "x86" if "x86" in torch.backends.quantized.supported_engines else "qnnpack"
+    torch.backends.quantized.engine = backend
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), (calibration[:1],))
+    with torch.no_grad():
+        for start in range(0, calibration.shape[0], 8):
+            prepared(calibration[start:start + 8])
+    return convert_fx(prepared)
+
+
+def _export_onnx(model: nn.Module, example: torch.Tensor) -> bytes:
+    buffer = io.BytesIO()
+    torch.onnx.export(
+        model, (example,), buffer,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+        dynamo=False,
+    )
+    return buffer.getvalue()
+
+
+def _quantize_onnx(onnx_bytes: bytes) -> bytes:
+    import tempfile
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source, target = os.path.join(tmp, "model.onnx"), os.path.join(tmp, "model.int8.onnx")
+        with open(source, "wb") as f:
+            f.write(onnx_bytes)
+        quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+        with open(target, "rb") as f:
+            return f.read()
+
+
+def build_runtime(
+    model: nn.Module,
+    runtime: str = "eager",
+    quantize: str = "none",
+    channels_last: bool = False,
+    calibration: Optional[torch.Tensor] = None,
+):
+    """
+    Convert an eval-mode eager model to the requested runtime.
+
+    Returns a callable taking a (N, 3, 224, 224) tensor and returning (N, 2) logits.
+    """
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown runtime {runtime!r}, expected one of {RUNTIMES}")
+    if quantize not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization {quantize!r}, expected one of {QUANTIZATION_MODES}")
+
+    device = next(model.parameters()).device
+    if (runtime == "onnx" or quantize != "none") and device.type != "cpu":
+        raise ValueError(f"runtime={runtime}, quantize={quantize} is only supported on CPU")
+    if calibration is None:
+        calibration = calibration_batch()
+    example = calibration[:1].to(device)
+
+    if runtime == "onnx":
+        if quantize == "static":
+            raise ValueError("Static quantization is not supported for the onnx runtime; use dynamic")
+        onnx_bytes = _export_onnx(model, example)
+        if quantize == "dynamic":
+            onnx_bytes = _quantize_onnx(onnx_bytes)
+        return OnnxModel(onnx_bytes, num_threads=torch.get_num_threads())
+
+    # Work on a copy so the eager model stays untouched as the parity reference / fallback
+    converted = copy.deepcopy(model)
+    if quantize != "none":
+        converted = _quantize(converted, quantize, calibration)
+    if channels_last:
+        converted = ChannelsLastModel(converted).eval()
+    if runtime == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(converted, example)
+            converted = torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+    return converted
+
+
+def parity_check(reference, candidate, inputs: torch.Tensor, repeat: int = 3) -> dict:
+    """
+    Compare ``candidate`` against ``reference`` on ``inputs``.
+
+    Returns the maximum logit and probability differences, the fraction of inputs on
+    which both predict the same class, and the best-of-``repeat`` latency of each.
+    """
+    def run(fn):
+        best, out = float("inf"), None
+        with torch.no_grad():
+            for _ in range(repeat):
+                start = time.perf_counter()
+                out = fn(inputs)
+                best = min(best, time.perf_counter() - start)
+        return out.float().cpu(), best
+
+    expected, reference_time = run(reference)
+    actual, candidate_time = run(candidate)
+    expected_probs, actual_probs = torch.softmax(expected, dim=1), torch.softmax(actual, dim=1)
+    return {
+        "samples": int(inputs.shape[0]),
+        "max_logit_delta": round((expected - actual).abs().max().item(), 6),
+        "max_prob_delta": round((expected_probs - actual_probs).abs().max().item(), 6),
+        "label_agreement": round((expected.argmax(1) == actual.argmax(1)).float().mean().item(), 4),
+        "eager_ms": round(reference_time * 1000, 2),
+        "runtime_ms": round(candidate_time * 1000, 2),
+    }
+
+
+def configure_threads(num_threads: int = 0):
+    """Set torch's intra-op thread count (0 keeps the default)."""
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+
+def config_key(runtime: str, quantize: str, channels_last: bool, calibration_dir: Optional[str] = None) -> str:
+    """Short identifier of a runtime configuration, used to name cached artifacts."""
+    key = f"{runtime}-{quantize}" + ("-cl" if channels_last else "")
+    if quantize == "static" and calibration_dir:
+        import hashlib
+        key += "-cal" + hashlib.sha1(os.path.abspath(calibration_dir).encode()).hexdigest()[:8]
+    return key
+
+
+def prepare_model(
+    model: nn.Module,
+    runtime: str = "eager",
+    quantize: str = "none",
+    channels_last: bool = False,
+    num_threads: int = 0,
+    calibration_dir: Optional[str] = None,
+    tolerance: float = 0.02,
+) -> Tuple[object, dict]:
+    """
+    Configure threads, build the requested runtime and verify it against the eager model.
+
+    Args:
+        model: Eval-mode eager model on the inference device.
+        runtime: One of RUNTIMES.
+        quantize: One of QUANTIZATION_MODES.
+        channels_last: Use channels-last memory format (eager/torchscript).
+        num_threads: Intra-op threads for torch (0 keeps the default).
+        calibration_dir: Directory of images used for calibration and the parity check.
+        tolerance: Maximum allowed difference in softmax probabilities vs. eager.
+
+    Returns:
+        (model to serve, info dict). The eager model is returned, with the failure
+        recorded in info, if conversion fails or the parity check exceeds tolerance.
+    """
+    configure_threads(num_threads)
+    info = {
+        "runtime": runtime,
+        "quantize": quantize,
+        "channels_last": channels_last,
+        "num_threads": torch.get_num_threads(),
+        "fallback": None,
+    }
+    if runtime == "eager" and quantize == "none" and not channels_last:
+        return model, info
+    if not isinstance(model, nn.Module):
+        info["fallback"] = "loaded checkpoint is not an nn.Module"
+        return model, info
+
+    device = next(model.parameters()).device
+    calibration = calibration_batch(calibration_dir).to(device)
+    try:
+        candidate = build_runtime(model, runtime, quantize, channels_last, calibration)
+        info["parity"] = parity_check(model, candidate, calibration)
+    except Exception as e:
+        logger.warning(f"Could not build {runtime} runtime (quantize={quantize}): {e}")
+        info["fallback"] = f"conversion failed: {e}"
+        return model, info
+
+    if info["parity"]["max_prob_delta"] > tolerance:
+        logger.warning(f"{runtime} runtime drifts from eager model "
+                       f"(max probability delta {info['parity']['max_prob_delta']} > {tolerance}); serving eager model")
+        info["fallback"] = "parity check failed"
+        return model, info
+
+    logger.info(f"Using {runtime} runtime (quantize={quantize}, channels_last={channels_last}): {info['parity']}")
+    return candidate, info
+
+
+def export(model, path: str):
+    """Save a converted model: ONNX bytes, or a TorchScript archive."""
+    if isinstance(model, OnnxModel):
+        with open(path, "wb") as f:
+            f.write(model.onnx_bytes)
+    elif isinstance(model, torch.jit.ScriptModule):
+        torch.jit.save(model, path)
+    else:
+        raise ValueError("Only torchscript and onnx runtimes can be exported")
+
+
+def main(argv=None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Checkpoint to load (defaults to backend/model.pth)")
+    parser.add_argument("--runtime", choices=RUNTIMES, default="torchscript")
+    parser.add_argument("--quantize", choices=QUANTIZATION_MODES, default="none")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--num-threads", type=int, default=0)
+    parser.add_argument("--calibration-dir", help="Directory of images for calibration/parity")
+    parser.add_argument("--tolerance", type=float, default=0.02)
+    parser.add_argument("--export", help="Write the converted model to this path")
+    args = parser.parse_args(argv)
+
+    import main as app_main
+    eager = app_main.load_checkpoint(args.model or app_main.MODEL_PATH)
+    converted, info = prepare_model(
+        eager, args.runtime, args.quantize, args.channels_last,
+        args.num_threads, args.calibration_dir, args.tolerance,
+    )
+    print(json.dumps(info, indent=2))
+    if args.export:
+        if info["fallback"]:
+            print(f"Not exporting: {info['fallback']}")
+            return 1
+        export(converted, args.export)
+        print(f"Exported {args.runtime} model to {args.export}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
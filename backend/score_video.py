@@ -0,0 +1,77 @@
+"""
+Score video clips from the command line.
+
+Uses the same frame sampling, ELA worker pool, batched inference and early exit as
+the /predict/video endpoint, without going through HTTP. Prints one JSON line per clip
+(verdict and sampling summary; per-frame scores with --frames), or writes them to
+--output.
+
+Usage (from the backend directory):
+    python score_video.py clip.mp4
+    python score_video.py clips/*.mp4 --sample scene --scene-threshold 0.2 --output scores.jsonl
+    python score_video.py clip.mp4 --sample keyframes --no-early-exit --frames
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="Video files (or animated GIF/WebP/PNG)")
+    parser.add_argument("--model", default=None, help="Model checkpoint (defaults to backend/model.pth)")
+    parser.add_argument("--sample", choices=["stride", "scene", "keyframes"], help="Frame sampling mode")
+    parser.add_argument("--stride", type=int, help="Score every N-th frame (stride sampling)")
+    parser.add_argument("--scene-threshold", type=float, help="Minimum frame difference (0-1) for scene sampling")
+    parser.add_argument("--max-frames", type=int, help="Maximum frames scored per clip (0 = no limit)")
+    parser.add_argument("--no-early-exit", action="store_true", help="Score all sampled frames")
+    parser.add_argument("--frames", action="store_true", help="Include per-frame scores in the output")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ELA worker processes (0 = threads)")
+    parser.add_argument("--output", help="Write JSON lines to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    # main reads the pool size at import time
+    os.environ["VERIFRAME_ELA_WORKERS"] = str(args.workers)
+    import main as app_main
+    import video
+
+    app_main.load_model(args.model or app_main.MODEL_PATH)
+
+    async def score_all(out):
+        failed = 0
+        for path in args.inputs:
+            sampler = video.FrameSampler(
+                path,
+                mode=args.sample or app_main.VIDEO_SAMPLING,
+                stride=args.stride or app_main.VIDEO_STRIDE,
+                scene_threshold=app_main.VIDEO_SCENE_THRESHOLD if args.scene_threshold is None else args.scene_threshold,
+                max_frames=app_main.VIDEO_MAX_FRAMES if args.max_frames is None else args.max_frames,
+                working_size=app_main.ELA_WORKING_SIZE,
+            )
+            try:
+                result = await app_main.score_video(sampler, early_exit=not args.no_early_exit)
+            except (OSError, ValueError, video.VideoBackendUnavailable) as e:
+                failed += 1
+                out.write(json.dumps({"path": path, "error": str(e)}) + "\n")
+                continue
+            if not args.frames:
+                result.pop("frames")
+            out.write(json.dumps(dict(result, path=path)) + "\n")
+            out.flush()
+        return failed
+
+    app_main.pipeline.start()
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        failed = asyncio.run(score_all(out))
+    finally:
+        app_main.pipeline.shutdown()
+        if args.output:
+            out.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,511 @@
+"""
+Multi-worker serving with shared model weights.
+
+Runs N uvicorn worker processes that accept connections on one shared listening
+socket, plus a lightweight supervisor that restarts crashed workers and serves the
+aggregate health of all workers on a separate port.
+
+Memory: before starting the workers the supervisor resolves the checkpoint into the
+model artifact cache (see model_cache.py). Every worker then loads the same cached
+weights with ``torch.load(mmap=True)``. The mapped pages are read-only during
+inference, so they stay in the page cache once and are shared by all workers instead
+of being copied into each process. Converted runtimes (TorchScript/ONNX, quantized
+or channels-last models) are private to each worker.
+
+Workers are forked from a fork server that has already imported torch and the other
+libraries the app uses (``PRELOAD_MODULES``), so the code and import-time state of
+those libraries, most of what a worker holds before it serves anything, is shared
+copy-on-write instead of being rebuilt in every worker. ``main`` itself is imported
+after the fork, since it reads the worker's configuration. Each worker's ELA pool
+covers its own CPU set and its processes only import the preprocessing code (see
+ela_worker.py). What remains private per worker is what it allocates while running:
+the model's runtime state and the allocator arenas grown by warmup and inference.
+``/health`` reports the PSS of every worker and of the whole node (supervisor, fork
+server, workers and their ELA processes).
+
+CPU: the available cores are split into one contiguous set per worker. Each worker
+is pinned to its set before torch is imported, and sizes its intra-op thread pool and
+its ELA pool to it, so workers do not oversubscribe the machine.
+
+Model admin: a request on the shared socket reaches only the one worker that accepts
+it, so workers refuse model admin requests (``/load-model``, ``/models/...``) there.
+They are sent to the supervisor's ``/admin/`` endpoint instead, which forwards them
+to every worker over a private per-worker socket and records them, so that a
+restarted worker replays them and serves the same versions as the others.
+
+Usage (from the backend directory):
+    python serve.py --workers 4 --port 8000 --health-port 8001
+    curl localhost:8001/health
+    curl -X POST "localhost:8001/admin/load-model?model_path=v2.pth&version=v2&wait=true"
+"""
+import argparse
+import http.client
+import http.server
+import json
+import os
+import secrets
+import shutil
+import signal
+import socket
+import multiprocessing
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Admin requests may wait for a model load (wait=true)
+ADMIN_TIMEOUT = 600.0
+
+# Imported by the fork server before it forks workers, so that their pages are shared
+# by all workers (main reads its configuration at import, so it is not among them)
+PRELOAD_MODULES = [
+    "torch", "torch.nn", "numpy", "PIL.Image", "fastapi", "uvicorn", "prometheus_client",
+    "runtime", "model_cache", "batching", "registry", "pipeline", "jobs", "cache", "calibration",
+    "near_duplicates", "archives", "uploads", "video", "localization", "ela_worker", "metrics",
+]
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """Parse a CPU list like "0-3,8,10-11"."""
+    cpus = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpu_list(cpus: List[int]) -> str:
+    return ",".join(str(c) for c in cpus)
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def partition_cpus(cpus: List[int], workers: int) -> List[List[int]]:
+    """
+    Split ``cpus`` into ``workers`` contiguous sets of (nearly) equal size. With more
+    workers than CPUs, workers share single CPUs round-robin.
+    """
+    if workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+    size, extra = divmod(len(cpus), workers)
+    sets, start = [], 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(cpus[start:end])
+        start = end
+    return sets
+
+
+def process_memory(pid: int) -> Optional[dict]:
+    """
+    Resident (RSS) and proportional (PSS, shared pages divided among the processes
+    mapping them) memory of a process in MB, from /proc on Linux.
+    """
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Private_Dirty"):
+                    values[key.lower()] = round(int(rest.split()[0]) / 1024, 1)
+    except (OSError, ValueError):
+        return None
+    return {"rss_mb": values.get("rss"), "pss_mb": values.get("pss"),
+            "shared_clean_mb": values.get("shared_clean"), "private_dirty_mb": values.get("private_dirty")}
+
+
+def child_pids(pid: int) -> List[int]:
+    """Direct children of a process (Linux)."""
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return []
+
+
+def descendant_pids(pid: int) -> List[int]:
+    children = child_pids(pid)
+    return children + [d for child in children for d in descendant_pids(child)]
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket (a worker's private admin socket)."""
+
+    def __init__(self, path: str, timeout: float = ADMIN_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class Worker:
+    """One uvicorn worker process and its restart bookkeeping."""
+
+    def __init__(self, index: int, cpus: List[int], status_file: str, admin_path: str):
+        self.index = index
+        self.cpus = cpus
+        self.status_file = status_file
+        self.admin_path = admin_path
+        self.admin_sock: Optional[socket.socket] = None
+        self.process: Optional[multiprocessing.Process] = None
+        self.restarts = 0
+        self.started_at = 0.0
+        # Set on restart: the recorded admin requests must be replayed once it is healthy
+        self.needs_replay = False
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def status(self, stale_after: float) -> dict:
+        entry = {
+            "index": self.index,
+            "pid": self.process.pid if self.process else None,
+            "alive": self.alive,
+            "restarts": self.restarts,
+            "cpus": self.cpus,
+            "healthy": False,
+        }
+        try:
+            with open(self.status_file) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            report = None
+        if report is not None and self.alive and report.get("pid") == self.process.pid:
+            age = time.time() - report.get("timestamp", 0)
+            entry["heartbeat_age_s"] = round(age, 1)
+            entry["health"] = report
+            entry["healthy"] = age <= stale_after and report.get("status") == "healthy"
+        if self.alive:
+            entry["memory"] = process_memory(self.process.pid)
+            # The worker's ELA processes count towards its cost
+            ela = [process_memory(pid) for pid in child_pids(self.process.pid)]
+            entry["ela_pss_mb"] = round(sum(m["pss_mb"] or 0 for m in ela if m), 1)
+        return entry
+
+
+class Supervisor:
+    """
+    Args:
+        workers: Number of worker processes.
+        host / port: Address of the shared listening socket.
+        threads_per_worker: Intra-op threads per worker (default: size of its CPU set).
+        affinity: Pin each worker to its CPU set.
+        log_level: uvicorn log level of the workers.
+    """
+
+    def __init__(self, workers: int, host: str, port: int, threads_per_worker: int = 0,
+                 affinity: bool = True, log_level: str = "info"):
+        self.host = host
+        self.port = port
+        self.threads_per_worker = threads_per_worker
+        self.affinity = affinity
+        self.log_level = log_level
+        self.run_dir = tempfile.mkdtemp(prefix="veriframe-workers-")
+        cpu_sets = partition_cpus(available_cpus(), workers)
+        self.workers = [
+            Worker(i, cpu_sets[i], os.path.join(self.run_dir, f"worker-{i}.json"),
+                   os.path.join(self.run_dir, f"worker-{i}.sock"))
+            for i in range(workers)
+        ]
+        self.admin_token = secrets.token_hex(16)
+        # Model admin requests applied to all workers, in order, for replay on restart
+        self.admin_log = []
+        self.admin_lock = threading.Lock()
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload(PRELOAD_MODULES)
+        self.sock: Optional[socket.socket] = None
+        self.stopping = False
+        self.started_at = time.time()
+
+    def preload(self):
+        """
+        Resolve the checkpoint into the model artifact cache once, so all workers mmap
+        the same cached weights instead of each building its own copy.
+        """
+        if os.environ.get("VERIFRAME_MODEL_CACHE", "1") != "1" or os.environ.get("VERIFRAME_MODEL_MMAP", "1") != "1":
+            print("WARNING: Model cache or mmap disabled; every worker will hold its own copy of the weights")
+            return
+        code = "import main; main.build_model(main.MODEL_PATH)"
+        result = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR)
+        if result.returncode != 0:
+            print("WARNING: Could not preload the model; workers will load it on their own")
+
+    def listen(self):
+        self.sock = socket.socket(socket.AF_INET6 if ":" in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.host, self.port))
+        self.sock.listen(2048)
+        self.sock.set_inheritable(True)
+        for worker in self.workers:
+            worker.admin_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            worker.admin_sock.bind(worker.admin_path)
+            worker.admin_sock.listen(64)
+            worker.admin_sock.set_inheritable(True)
+
+    def worker_env(self, worker: Worker) -> dict:
+        threads = self.threads_per_worker or len(worker.cpus)
+        env = dict(
+            os.environ,
+            VERIFRAME_WORKER_INDEX=str(worker.index),
+            VERIFRAME_WORKER_STATUS_FILE=worker.status_file,
+            VERIFRAME_ADMIN_TOKEN=self.admin_token,
+            VERIFRAME_NUM_THREADS=str(threads),
+            OMP_NUM_THREADS=str(threads),
+            VERIFRAME_UVICORN_LOG_LEVEL=self.log_level,
+        )
+        # Each worker's ELA pool covers its own CPU set unless configured explicitly
+        env.setdefault("VERIFRAME_ELA_WORKERS", str(len(worker.cpus)))
+        if self.affinity:
+            env["VERIFRAME_CPU_AFFINITY"] = format_cpu_list(worker.cpus)
+        return env
+
+    def start_worker(self, worker: Worker):
+        # Sockets sent to a forkserver child are duplicated into it
+        worker.process = self.context.Process(
+            target=run_worker, args=(self.worker_env(worker), self.sock, worker.admin_sock),
+            name=f"veriframe-worker-{worker.index}",
+        )
+        worker.process.start()
+        worker.started_at = time.time()
+        print(f"Started worker {worker.index} (pid {worker.process.pid}, cpus {format_cpu_list(worker.cpus)})")
+
+    def health(self) -> dict:
+        stale_after = 3 * float(os.environ.get("VERIFRAME_WORKER_STATUS_INTERVAL", "2")) + 5
+        workers = [w.status(stale_after) for w in self.workers]
+        healthy = sum(w["healthy"] for w in workers)
+        memory = [w["memory"] for w in workers if w.get("memory")]
+        node = [process_memory(pid) for pid in [os.getpid(), *descendant_pids(os.getpid())]]
+        in_flight = sum(w["health"]["pipeline"]["in_flight"] for w in workers if "health" in w)
+        return {
+            "status": "healthy" if healthy == len(workers) else "degraded" if healthy else "unhealthy",
+            "workers_total": len(workers),
+            "workers_healthy": healthy,
+            "in_flight": in_flight,
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "memory": {
+                "rss_mb": round(sum(m["rss_mb"] or 0 for m in memory), 1),
+                "pss_mb": round(sum(m["pss_mb"] or 0 for m in memory), 1),
+                # Everything the node runs: supervisor, fork server, workers, ELA processes
+                "node_pss_mb": round(sum(m["pss_mb"] or 0 for m in node if m), 1),
+            } if memory else None,
+            "workers": workers,
+        }
+
+    def forward(self, worker: Worker, method: str, path: str, body: bytes = b"") -> dict:
+        """Send one admin request to a worker over its private socket."""
+        connection = UnixHTTPConnection(worker.admin_path)
+        try:
+            connection.request(method, path, body=body or None, headers={
+                "X-VeriFrame-Admin-Token": self.admin_token, "Content-Type": "application/json",
+            })
+            response = connection.getresponse()
+            payload = response.read()
+            try:
+                payload = json.loads(payload)
+            except ValueError:
+                payload = payload.decode(errors="replace")
+            return {"index": worker.index, "status": response.status, "response": payload}
+        except OSError as e:
+            return {"index": worker.index, "status": 502, "response": {"detail": f"Worker unreachable: {e}"}}
+        finally:
+            connection.close()
+
+    def admin(self, method: str, path: str, body: bytes = b"") -> tuple:
+        """
+        Apply a model admin request to every worker concurrently. Requests that change
+        state and succeed everywhere are recorded for replay on restarted workers.
+
+        Returns:
+            (HTTP status, report): 200 if every worker succeeded, the workers' common
+            status if they all failed the same way, 502 otherwise.
+        """
+        workers = [w for w in self.workers if w.alive]
+        with ThreadPoolExecutor(max_workers=max(1, len(workers))) as executor:
+            results = list(executor.map(lambda w: self.forward(w, method, path, body), workers))
+        statuses = {r["status"] for r in results}
+        ok = bool(results) and all(200 <= s < 300 for s in statuses)
+        if ok and method != "GET":
+            with self.admin_lock:
+                self.admin_log.append((method, path, body))
+        if ok:
+            status = 200
+        elif len(statuses) == 1 and results:
+            status = statuses.pop()
+        else:
+            status = 502
+        return status, {"workers": results, "applied": ok}
+
+    def replay(self, worker: Worker):
+        """Bring a restarted worker to the model state of the others."""
+        with self.admin_lock:
+            log = list(self.admin_log)
+        for method, path, body in log:
+            parts = urlsplit(path)
+            if parts.path == "/load-model":
+                # Finish each load before the next request (e.g. an activation) is replayed
+                query = dict(parse_qsl(parts.query), wait="true")
+                path = f"{parts.path}?{urlencode(query)}"
+            result = self.forward(worker, method, path, body)
+            if not 200 <= result["status"] < 300:
+                print(f"WARNING: Replaying {method} {path} on worker {worker.index} failed: {result['response']}")
+
+    def serve_health(self, host: str, port: int):
+        supervisor = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/admin/"):
+                    self.do_admin()
+                    return
+                if self.path.split("?")[0] != "/health":
+                    self.send_error(404)
+                    return
+                report = supervisor.health()
+                self.send_json(200 if report["status"] != "unhealthy" else 503, report)
+
+            def do_POST(self):
+                self.do_admin()
+
+            def do_DELETE(self):
+                self.do_admin()
+
+            def do_admin(self):
+                if not self.path.startswith("/admin/"):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, report = supervisor.admin(self.command, self.path[len("/admin"):], body)
+                self.send_json(status, report)
+
+            def send_json(self, status: int, report: dict):
+                body = json.dumps(report, default=str).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True, name="health").start()
+        print(f"Supervisor health endpoint on http://{host}:{port}/health (model admin: /admin/...)")
+        return server
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self, health_host: str, health_port: int):
+        self.preload()
+        self.listen()
+        for worker in self.workers:
+            self.start_worker(worker)
+        health_server = self.serve_health(health_host, health_port)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        try:
+            while not self.stopping:
+                for worker in self.workers:
+                    if not worker.alive and not self.stopping:
+                        code = worker.process.exitcode if worker.process else None
+                        # Back off when a worker keeps dying right after start
+                        if time.time() - worker.started_at < 5:
+                            time.sleep(1)
+                        print(f"WARNING: Worker {worker.index} exited with {code}, restarting")
+                        worker.restarts += 1
+                        worker.needs_replay = bool(self.admin_log)
+                        self.start_worker(worker)
+                    elif worker.needs_replay and worker.status(float("inf"))["healthy"]:
+                        worker.needs_replay = False
+                        threading.Thread(target=self.replay, args=(worker,), daemon=True,
+                                         name=f"replay-{worker.index}").start()
+                time.sleep(0.5)
+        finally:
+            print("Stopping workers")
+            for worker in self.workers:
+                if worker.alive:
+                    worker.process.terminate()
+            deadline = time.time() + 30
+            for worker in self.workers:
+                if worker.process is not None:
+                    worker.process.join(max(0.1, deadline - time.time()))
+                    if worker.process.is_alive():
+                        worker.process.kill()
+                        worker.process.join()
+            health_server.shutdown()
+            self.sock.close()
+            for worker in self.workers:
+                if worker.admin_sock is not None:
+                    worker.admin_sock.close()
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+def run_worker(env: dict, listen_sock: socket.socket, admin_sock: socket.socket):
+    """
+    Worker entry point (in a process forked from the fork server): take the worker's
+    configuration, pin to the assigned CPUs before torch starts any threads, then
+    serve the app on the shared public socket and this worker's private admin socket.
+    """
+    os.environ.clear()
+    os.environ.update(env)
+    os.chdir(BACKEND_DIR)
+    cpus = env.get("VERIFRAME_CPU_AFFINITY")
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, parse_cpu_list(cpus))
+    import uvicorn
+
+    config = uvicorn.Config("main:app", log_level=env.get("VERIFRAME_UVICORN_LOG_LEVEL", "info"))
+    uvicorn.Server(config).run(sockets=[listen_sock, admin_sock])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("VERIFRAME_SERVE_WORKERS", "2")),
+                        help="Number of worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--health-host", default="127.0.0.1", help="Address of the supervisor health endpoint")
+    parser.add_argument("--health-port", type=int, default=8001)
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="Intra-op threads per worker (default: number of CPUs assigned to it)")
+    parser.add_argument("--no-affinity", action="store_true", help="Do not pin workers to CPU sets")
+    parser.add_argument("--log-level", default="info", help="uvicorn log level for the workers")
+    args = parser.parse_args(argv)
+
+    supervisor = Supervisor(
+        workers=max(1, args.workers),
+        host=args.host,
+        port=args.port,
+        threads_per_worker=args.threads_per_worker,
+        affinity=not args.no_affinity,
+        log_level=args.log_level,
+    )
+    supervisor.run(args.health_host, args.health_port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
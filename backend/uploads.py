@@ -0,0 +1,245 @@
+"""
+Streaming upload ingestion with early rejection.
+
+An upload is checked before its body is buffered in memory:
+
+1. ``RequestSizeLimit`` (ASGI middleware) rejects request bodies above a per-endpoint
+   byte limit, from the Content-Length header or, for chunked uploads, as soon as
+   the streamed body crosses the limit, before the multipart parser spools it;
+2. ``read_upload`` reads only the first chunk of each file, sniffs the format from its
+   magic bytes and reads the image dimensions from its header, so unsupported files,
+   oversized files and decompression bombs (small files declaring huge dimensions)
+   are rejected without reading the rest;
+3. accepted files are read once into a preallocated buffer and handed on as a
+   ``memoryview``, which the decoder reads without another copy
+   (``decoding.BufferReader``).
+"""
+import asyncio
+import io
+import json
+import warnings
+from typing import Callable, Optional
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+# First chunk read from every upload; holds the header of almost every image
+HEAD_BYTES = 64 * 1024
+# JPEG metadata (EXIF, ICC profiles, thumbnails) can push the frame header further back
+MAX_HEADER_BYTES = 1024 * 1024
+
+SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+)
+FORMATS = ("JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF")
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Image format from the magic bytes at the start of a file, or None if unknown."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, fmt in SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return None
+
+
+def header_size(head: bytes) -> Optional[tuple]:
+    """
+    (width, height) from the image header in ``head``, without decoding pixel data, or
+    None if the header is not complete in ``head``.
+
+    Raises:
+        ValueError: If the header is invalid.
+    """
+    try:
+        with warnings.catch_warnings():
+            # Pixel limits are enforced by the caller
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(head)) as image:
+                return image.size
+    except Image.DecompressionBombError as e:
+        # Reported as a size limit by the caller, not as a corrupt file
+        raise ValueError(str(e))
+    except (OSError, SyntaxError, IndexError, ValueError):
+        # Pillow cannot tell a truncated header from a corrupt one
+        return None
+
+
+def check_image(head: bytes, formats=FORMATS, max_pixels: int = 0) -> tuple:
+    """
+    Validate the start of an image file.
+
+    Args:
+        head: The first bytes of the file.
+        formats: Accepted formats (Pillow format names).
+        max_pixels: Reject images with more pixels than this (0 = no limit).
+
+    Returns:
+        (format, (width, height)), with size None if the header is not complete in
+        ``head`` (or is corrupt, which the decoder reports).
+
+    Raises:
+        HTTPException: 400 (empty file), 413 (too many pixels) or 415 (unsupported
+            format).
+    """
+    if not head:
+        raise HTTPException(status_code=400, detail="Empty file uploaded")
+    fmt = sniff_format(head)
+    if fmt is None or fmt not in formats:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported image format{f' {fmt}' if fmt else ''} (supported: {', '.join(formats)})",
+        )
+    try:
+        size = header_size(head)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=f"Image is too large: {e}")
+    if size is None:
+        return fmt, None
+    width, height = size
+    if max_pixels and width * height > max_pixels:
+        raise HTTPException(
+            status_code=413, detail=f"Image is too large ({width}x{height} pixels, maximum {max_pixels} pixels)"
+        )
+    return fmt, size
+
+
+async def read_upload(file: UploadFile, max_bytes: int = 0, max_pixels: int = 0, formats=FORMATS) -> memoryview:
+    """
+    Read an uploaded image after checking its size, format and dimensions.
+
+    Args:
+        file: The upload (already spooled by the multipart parser).
+        max_bytes: Reject files larger than this (0 = no limit).
+        max_pixels: Reject images with more pixels than this (0 = no limit).
+        formats: Accepted formats.
+
+    Returns:
+        The file contents as a read-only memoryview of a buffer allocated once.
+
+    Raises:
+        HTTPException: As for ``check_image``, or 413 if the file exceeds ``max_bytes``.
+    """
+    if max_bytes and file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File is too large (maximum {max_bytes / 1024 / 1024:g} MB)")
+
+    head = await file.read(HEAD_BYTES)
+    fmt, size = check_image(head, formats, max_pixels)
+    while size is None and len(head) < MAX_HEADER_BYTES:
+        # The header is further back (large metadata): read up to MAX_HEADER_BYTES
+        more = await file.read(len(head))
+        if not more:
+            break
+        head += more
+        fmt, size = check_image(head, formats, max_pixels)
+    # Without a header here (e.g. a TIFF directory at the end of the file) the
+    # decoder still enforces the pixel limit before decoding pixel data
+
+    if file.size is None:
+        rest = await file.read()
+        buffer = bytearray(len(head) + len(rest))
+        buffer[:len(head)] = head
+        buffer[len(head):] = rest
+    else:
+        # One allocation; the rest of the spooled file is read straight into it
+        buffer = bytearray(file.size)
+        buffer[:len(head)] = head
+        view = memoryview(buffer)
+        filled = len(head)
+        while filled < len(buffer):
+            count = await asyncio.to_thread(file.file.readinto, view[filled:])
+            if not count:
+                break
+            filled += count
+        del view
+        buffer = buffer[:filled] if filled < len(buffer) else buffer
+    if max_bytes and len(buffer) > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File is too large (maximum {max_bytes / 1024 / 1024:g} MB)")
+    return memoryview(buffer).toreadonly()
+
+
+def picklable(data):
+    """
+    Upload contents in a form that can be sent to a worker process: memoryviews
+    cannot be pickled, so the buffer they view is sent instead (without a copy when
+    they view the whole buffer).
+    """
+    if isinstance(data, memoryview):
+        if isinstance(data.obj, (bytes, bytearray)) and data.nbytes == len(data.obj):
+            return data.obj
+        return data.tobytes()
+    return data
+
+
+class RequestTooLarge(HTTPException):
+    def __init__(self, limit: int):
+        super().__init__(status_code=413, detail=f"Request body is too large (maximum {limit / 1024 / 1024:g} MB)")
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware bounding request body size per path.
+
+    Args:
+        app: The ASGI app.
+        limit_for: Maps a request path to its byte limit (None or 0 = no limit).
+    """
+
+    def __init__(self, app, limit_for: Callable[[str], Optional[int]]):
+        self.app = app
+        self.limit_for = limit_for
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limit_for(scope["path"]) if scope["type"] == "http" else None
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", ()):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                await self._reject(send, limit)
+                return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Stops the multipart parser; raised as an HTTPException so the
+                    # app answers 413 instead of a generic parsing error
+                    raise RequestTooLarge(limit)
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except RequestTooLarge:
+            if started:
+                raise
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        body = json.dumps({"detail": RequestTooLarge(limit).detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,227 @@
+"""
+Frame sampling and clip-level aggregation for video scoring.
+
+``FrameSampler`` decodes a clip frame by frame (never materializing the whole clip)
+and yields only the sampled frames as RGB arrays:
+
+- ``stride``: every ``stride``-th frame;
+- ``scene``: the first frame and every frame whose 32x32 grayscale thumbnail differs
+  from the last sampled one by more than ``scene_threshold`` (mean absolute
+  difference, 0-1), so static shots are scored once and cuts are never missed;
+- ``keyframes``: only keyframes; the decoder skips all other frames entirely.
+
+Frames that are not sampled are decoded (later frames depend on them) but never
+converted to RGB. Containers and codecs are read with PyAV (``pip install av``);
+animated GIF/WebP/PNG clips are also read with Pillow, without PyAV.
+"""
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageSequence, UnidentifiedImageError
+
+from decoding import working_dimensions
+
+SAMPLING_MODES = ("stride", "scene", "keyframes")
+VIDEO_SUFFIXES = ('.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi', '.mpg', '.mpeg', '.ts', '.gif')
+
+THUMBNAIL_SIZE = 32
+
+
+class VideoBackendUnavailable(RuntimeError):
+    """The clip needs PyAV to be decoded, and it is not installed."""
+
+
+def is_video_name(name: str) -> bool:
+    return name.lower().endswith(VIDEO_SUFFIXES)
+
+
+class FrameSampler:
+    """
+    Iterate over the sampled frames of a clip.
+
+    Args:
+        source: Path or seekable binary file object.
+        mode: One of SAMPLING_MODES.
+        stride: Sample every ``stride``-th frame (``stride`` mode).
+        scene_threshold: Minimum thumbnail difference to the last sampled frame
+            (``scene`` mode).
+        max_frames: Stop after this many sampled frames (0 = no limit).
+        working_size: Downscale frames so their longest side is at most this many
+            pixels (0 = full resolution).
+
+    Yields:
+        (frame index, timestamp in seconds, uint8 RGB array of shape (H, W, 3))
+
+    After iteration, ``decoded`` and ``sampled`` hold the frame counts, ``truncated``
+    tells whether ``max_frames`` stopped decoding early and ``backend`` is "av" or
+    "pillow".
+
+    Raises:
+        ValueError: If the clip cannot be decoded or the options are invalid.
+        VideoBackendUnavailable: If the clip needs PyAV and it is not installed.
+    """
+
+    def __init__(
+        self,
+        source: Union[str, BinaryIO],
+        mode: str = "stride",
+        stride: int = 10,
+        scene_threshold: float = 0.15,
+        max_frames: int = 0,
+        working_size: int = 0,
+    ):
+        if mode not in SAMPLING_MODES:
+            raise ValueError(f"Unknown sampling mode {mode!r} (expected one of {', '.join(SAMPLING_MODES)})")
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+        self.source = source
+        self.mode = mode
+        self.stride = stride
+        self.scene_threshold = scene_threshold
+        self.max_frames = max(0, int(max_frames))
+        self.working_size = working_size
+        self.decoded = 0
+        self.sampled = 0
+        self.truncated = False
+        self.backend: Optional[str] = None
+        self.fps: Optional[float] = None
+        self._last_thumbnail: Optional[np.ndarray] = None
+
+    def __iter__(self) -> Iterator[Tuple[int, float, np.ndarray]]:
+        image = self._open_animated_image()
+        frames = self._pillow_frames(image) if image is not None else self._av_frames()
+        for index, timestamp, rgb in frames:
+            yield index, timestamp, rgb
+            self.sampled += 1
+            if self.max_frames and self.sampled >= self.max_frames:
+                self.truncated = True
+                return
+
+    def describe(self) -> dict:
+        return {
+            "mode": self.mode,
+            "stride": self.stride if self.mode == "stride" else None,
+            "scene_threshold": self.scene_threshold if self.mode == "scene" else None,
+            "max_frames": self.max_frames,
+            "backend": self.backend,
+            "fps": round(self.fps, 3) if self.fps else None,
+            "frames_decoded": self.decoded,
+            "frames_sampled": self.sampled,
+            "truncated": self.truncated,
+        }
+
+    def _is_scene_change(self, thumbnail: np.ndarray) -> bool:
+        if self._last_thumbnail is not None:
+            difference = np.abs(thumbnail.astype(np.int16) - self._last_thumbnail).mean() / 255.0
+            if difference <= self.scene_threshold:
+                return False
+        self._last_thumbnail = thumbnail.astype(np.int16)
+        return True
+
+    def _wanted(self, index: int, thumbnail) -> bool:
+        if self.mode == "stride":
+            return index % self.stride == 0
+        if self.mode == "scene":
+            return self._is_scene_change(thumbnail())
+        return True  # keyframes: the decoder only returns keyframes
+
+    def _open_animated_image(self) -> Optional[Image.Image]:
+        """Open the source with Pillow if it is a (possibly animated) image format."""
+        try:
+            image = Image.open(self.source)
+        except UnidentifiedImageError:
+            if hasattr(self.source, "seek"):
+                self.source.seek(0)
+            return None
+        if image.format not in ("GIF", "WEBP", "PNG"):
+            raise ValueError(f"{image.format} is a still image format, not a video")
+        return image
+
+    def _pillow_frames(self, image: Image.Image):
+        self.backend = "pillow"
+        duration_ms = image.info.get("duration") or 0
+        self.fps = 1000.0 / duration_ms if duration_ms else None
+        timestamp = 0.0
+        # Animated images have no inter-frame dependencies, so every frame is a keyframe
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            self.decoded += 1
+            if self._wanted(index, lambda: np.asarray(frame.convert("L").resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE)))):
+                rgb = frame.convert("RGB")
+                target = working_dimensions(rgb.size, self.working_size)
+                if target != rgb.size:
+                    rgb = rgb.resize(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+                yield index, round(timestamp, 3), np.asarray(rgb)
+            timestamp += (frame.info.get("duration") or duration_ms or 0) / 1000.0
+
+    def _av_frames(self):
+        try:
+            import av
+        except ImportError:
+            raise VideoBackendUnavailable("Video decoding requires PyAV (pip install av)")
+        self.backend = "av"
+        try:
+            container = av.open(self.source, mode="r")
+        except av.error.FFmpegError as e:
+            raise ValueError(f"Cannot decode video: {e}")
+        try:
+            if not container.streams.video:
+                raise ValueError("File has no video stream")
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            if self.mode == "keyframes":
+                stream.codec_context.skip_frame = "NONKEY"
+            self.fps = float(stream.average_rate) if stream.average_rate else None
+            width, height = working_dimensions((stream.codec_context.width, stream.codec_context.height), self.working_size)
+            try:
+                for index, frame in enumerate(container.decode(stream)):
+                    self.decoded += 1
+                    thumbnail = lambda: frame.reformat(
+                        width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE, format="gray"
+                    ).to_ndarray()
+                    if self._wanted(index, thumbnail):
+                        rgb = frame.to_ndarray(width=width, height=height, format="rgb24")
+                        timestamp = float(frame.time) if frame.time is not None else index / (self.fps or 1.0)
+                        if self.mode == "keyframes" and self.fps and frame.time is not None:
+                            # Skipped frames are not counted by the decoder
+                            index = round(timestamp * self.fps)
+                        yield index, round(timestamp, 3), rgb
+            except av.error.FFmpegError as e:
+                if self.decoded == 0:
+                    raise ValueError(f"Cannot decode video: {e}")
+                # A truncated or partly corrupt clip still yields the frames decoded so far
+        finally:
+            container.close()
+
+
+def is_decisive(tampered_probabilities: List[float], min_frames: int, threshold: float) -> bool:
+    """
+    True once at least ``min_frames`` frames are scored and their mean tampered
+    probability is at least ``threshold`` or at most ``1 - threshold``.
+    """
+    if not tampered_probabilities or len(tampered_probabilities) < min_frames:
+        return False
+    mean = sum(tampered_probabilities) / len(tampered_probabilities)
+    return mean >= threshold or mean <= 1.0 - threshold
+
+
+def aggregate(frame_results: List[dict], threshold: float = 0.5) -> dict:
+    """
+    Clip verdict from per-frame predictions: the mean tampered probability decides
+    (above ``threshold``, as for images); the maximum and the share of frames predicted
+    tampered show whether manipulation is localized to part of the clip.
+    """
+    if not frame_results:
+        raise ValueError("No frames could be scored")
+    tampered = [r["probabilities"]["tampered"] for r in frame_results]
+    mean = sum(tampered) / len(tampered)
+    tampered_frames = sum(p > threshold for p in tampered)
+    return {
+        "prediction": "Tampered" if mean > threshold else "Authentic",
+        "class": int(mean > threshold),
+        "confidence": round(mean if mean > threshold else 1.0 - mean, 4),
+        "probabilities": {"authentic": round(1.0 - mean, 4), "tampered": round(mean, 4)},
+        "max_tampered": round(max(tampered), 4),
+        "tampered_frames": tampered_frames,
+        "tampered_fraction": round(tampered_frames / len(tampered), 4),
+        "frames_scored": len(tampered),
+    }